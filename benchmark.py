@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Times and memory-profiles the public entry points at several scales,
+using synthetic data from :mod:`synthetic`.
+
+Each benchmark runs in a fresh process, so its peak resident set size is not
+polluted by earlier runs or by data generation. Results are written as a JSON
+list of records, one per (benchmark, scale, repetition), e.g.
+
+.. code-block:: json
+
+   {"benchmark": "earlyoften", "events": 100000, "repeat": 0,
+    "seconds": 41.2, "peakRssMb": 312.5, "rowsOut": 268}
+
+To use:
+    `import benchmark`, or
+    ./benchmark.py [--scales 1000 10000 ...] [--only earlyoften ...] [--out results.json]
+"""
+import io
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import contextlib
+import multiprocessing
+
+import cli
+import synthetic
+
+def _earlyoften(paths):
+    from early_often import earlyoften
+    return earlyoften(paths['sensordata'], paths['submissions'], paths['due_times'])
+
+def _maptouuids(paths):
+    import utils
+    return utils.maptouuids(sdpath=paths['sensordata'], uuidpath=paths['uuids'])
+
+def _processline(paths):
+    import utils
+    outpath = paths['raw'] + '.csv'
+    utils.raw_to_csv(paths['raw'], outpath)
+    with open(outpath) as outfile:
+        return sum(1 for _ in outfile) - 1
+
+def _getdebugsessions(paths):
+    import debugging
+    return debugging.getdebugsessions(debuggerusepath=paths['debugger'])
+
+def _load_submission_data(paths):
+    import load_datasets
+    return load_datasets.load_submission_data(paths['submissions'])
+
+def _computemetrics(paths):
+    import metrics
+    return metrics.computemetrics(paths['sensordata'], metrics=[
+        metrics.EarlyOftenMetric(paths['submissions'], paths['due_times']),
+        metrics.IncrementalCheckingMetric(),
+        metrics.TimeSpentMetric(),
+        metrics.DebugSessionsMetric()
+    ])
+
+#: Benchmarked entry points, by name
+BENCHMARKS = {
+    'earlyoften': _earlyoften,
+    'maptouuids': _maptouuids,
+    'processline': _processline,
+    'getdebugsessions': _getdebugsessions,
+    'load_submission_data': _load_submission_data,
+    'computemetrics': _computemetrics
+}
+
+def _runone(name, paths):
+    """Run a single benchmark in this process, and measure it."""
+    os.environ['SENSORDATA_CACHE'] = 'off' # measure the computation, not the cache
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = BENCHMARKS[name](paths)
+        seconds = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin': # Linux reports kilobytes, macOS reports bytes
+        peak = peak * 1024
+
+    return {
+        'seconds': seconds,
+        'peakRssMb': peak / 2**20,
+        'rowsOut': result if isinstance(result, int) else len(result)
+    }
+
+def dataset(workdir, events, seed=0):
+    """Returns paths to a synthetic dataset with the given number of events,
+    generating it under `workdir` if it does not already exist.
+    """
+    outdir = os.path.join(workdir, 'events-{}-seed-{}'.format(events, seed))
+    paths = {
+        'sensordata': os.path.join(outdir, 'sensordata.csv'),
+        'raw': os.path.join(outdir, 'raw.log'),
+        'debugger': os.path.join(outdir, 'debugger-use.csv'),
+        'uuids': os.path.join(outdir, 'uuids.csv'),
+        'submissions': os.path.join(outdir, 'submissions.csv'),
+        'due_times': os.path.join(outdir, 'due_times.json')
+    }
+    if not all(os.path.exists(p) for p in paths.values()):
+        paths = synthetic.generate(outdir, events=events, seed=seed)
+
+    return paths
+
+def run(scales=(1000, 10000, 100000), benchmarks=None, workdir='benchmark-data', repeat=1,
+        seed=0, outfile=None):
+    """Run benchmarks at each scale.
+
+    Args:
+        scales (list): Numbers of events to benchmark with
+        benchmarks (list, optional): Names of benchmarks to run (see :attr:`BENCHMARKS`).
+                                     Runs all of them if omitted.
+        workdir (str): Directory in which synthetic datasets are generated and cached
+        repeat (int): Number of times to run each benchmark at each scale
+        seed (int): Seed for synthetic data generation
+        outfile (str, optional): Path to a JSON file where results should be written
+
+    Returns:
+        A *list* of result records.
+    """
+    benchmarks = benchmarks or list(BENCHMARKS)
+    unknown = [b for b in benchmarks if b not in BENCHMARKS]
+    if unknown:
+        raise ValueError('Unknown benchmarks: {}'.format(', '.join(unknown)))
+
+    context = multiprocessing.get_context('spawn')
+    environment = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count()
+    }
+    results = []
+    for events in scales:
+        paths = dataset(workdir, events, seed=seed)
+        for name in benchmarks:
+            for i in range(repeat):
+                with context.Pool(processes=1) as pool:
+                    measured = pool.apply(_runone, (name, paths))
+                record = {'benchmark': name, 'events': events, 'repeat': i, 'seed': seed}
+                record.update(measured)
+                record.update(environment)
+                results.append(record)
+                print('{benchmark:>22} {events:>11,} events {seconds:10.2f}s {peakRssMb:9.1f}MB'
+                      .format(**record))
+
+    if outfile:
+        with open(outfile, 'w') as out:
+            json.dump(results, out, indent=2)
+
+    return results
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('benchmark').parse_args(args)
+
+    run(scales=args.scales, benchmarks=args.only, workdir=args.workdir, repeat=args.repeat,
+        seed=args.seed, outfile=args.out)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,224 @@
+"""A content-addressed, on-disk cache for derived datasets.
+
+Decorate a function with :meth:`cached` to memoise its results on disk. Results
+are keyed on the package's code (see :meth:`code_version`), the function's
+arguments, and the contents of any input files it is given, so changing an input
+file (or any module, including those the function calls) means a fresh
+computation, while calling it again with the same inputs, in this or any later
+session, just reads the stored result.
+
+.. code-block:: python
+
+   import cache
+
+   @cache.cached(paths=['webcat_path'])
+   def load_submission_data(webcat_path, onlyfinal=True):
+       ...
+
+   load_submission_data.invalidate() # forget results for this function
+   cache.clear()                     # forget everything
+
+Caching is off unless `SENSORDATA_CACHE=on` is set (decorated functions then
+just run as usual), so that nothing is written to disk behind anyone's back,
+e.g. by jobs fanned out by a scheduler. Results are pickled to :attr:`CACHE_DIR`
+(or `$SENSORDATA_CACHE_DIR`), which is logged the first time it is used. When the
+cache grows past :attr:`MAX_BYTES` (or `$SENSORDATA_CACHE_MAX_MB` megabytes),
+the least recently used results are evicted.
+
+To use:
+    `import cache`
+"""
+import os
+import glob
+import pickle
+import hashlib
+import inspect
+import logging
+import functools
+
+import pandas as pd
+
+#: Where cached results are stored
+CACHE_DIR = os.environ.get('SENSORDATA_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'sensordata'))
+
+#: Size cap for the cache, in bytes
+MAX_BYTES = int(float(os.environ.get('SENSORDATA_CACHE_MAX_MB', 2048)) * 2**20)
+
+logger = logging.getLogger('sensordata.cache')
+
+_fingerprints = {}
+_code_version = None
+_announced = False
+
+def enabled():
+    """Returns *True* if caching has been turned on with `SENSORDATA_CACHE=on`."""
+    return os.environ.get('SENSORDATA_CACHE', 'off').lower() in ('on', '1', 'true', 'yes')
+
+def _announce():
+    """Log where results are being cached, once per session."""
+    global _announced
+    if not _announced:
+        logger.info('Caching results in %s', CACHE_DIR)
+        _announced = True
+
+def fingerprint(path):
+    """Returns a hash of a file's contents. Hashes are remembered for as long as the
+    file's size, modification time and inode stay the same, so unchanged files are
+    only read once per session.
+
+    The fingerprint of a directory (such as a partitioned dataset, see :mod:`dataset`)
+    covers the name, size and modification time of every file beneath it, but not
+    their contents, so that fingerprinting a large dataset doesn't mean reading all
+    of it. Files in a directory are expected to be replaced rather than edited in
+    place; a copy of a directory that doesn't keep modification times has a
+    different fingerprint."""
+    if os.path.isdir(path):
+        digest = hashlib.sha256()
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                filepath = os.path.join(dirpath, name)
+                stat = os.stat(filepath)
+                digest.update(os.path.relpath(filepath, path).encode())
+                digest.update('{}:{}'.format(stat.st_size, stat.st_mtime_ns).encode())
+        return digest.hexdigest()
+
+    stat = os.stat(path)
+    meta = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    if meta not in _fingerprints:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as infile:
+            for block in iter(lambda: infile.read(2**20), b''):
+                digest.update(block)
+        _fingerprints[meta] = digest.hexdigest()
+    return _fingerprints[meta]
+
+def code_version():
+    """Returns a hash of the source of every module in this package. A cached
+    result depends on the functions its function calls as well as on its own
+    code, so any change to the package's modules means a fresh computation."""
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        package = os.path.dirname(os.path.abspath(__file__))
+        for path in sorted(glob.glob(os.path.join(package, '*.py'))):
+            digest.update(os.path.basename(path).encode())
+            digest.update(fingerprint(path).encode())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+def _hashvalue(digest, value):
+    """Feed a stable representation of an argument to a hash."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(type(value).__name__.encode())
+        digest.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(repr(list(value.index.names)).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, dict):
+        for k in sorted(value, key=repr):
+            digest.update(repr(k).encode())
+            _hashvalue(digest, value[k])
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _hashvalue(digest, v)
+    else:
+        digest.update(repr(value).encode())
+    digest.update(b'\0')
+
+def _prefix(func):
+    return '{}.{}'.format(func.__module__, func.__qualname__)
+
+def _entries(pattern='*'):
+    return glob.glob(os.path.join(CACHE_DIR, '{}.pkl'.format(pattern)))
+
+def key(func, paths, *args, **kwargs):
+    """Returns the cache key for calling `func` with the given arguments. Arguments
+    named in `paths` that point at existing files or directories are keyed by their
+    contents."""
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    digest = hashlib.sha256()
+    digest.update(code_version().encode())
+    try:
+        digest.update(inspect.getsource(func).encode())
+    except (OSError, TypeError):
+        digest.update(func.__code__.co_code)
+    for name, value in bound.arguments.items():
+        digest.update(name.encode())
+        if name in paths and isinstance(value, str) and os.path.exists(value):
+            digest.update(fingerprint(value).encode())
+        else:
+            _hashvalue(digest, value)
+    return '{}-{}'.format(_prefix(func), digest.hexdigest()[:32])
+
+def evict(max_bytes=None):
+    """Remove the least recently used results until the cache fits in `max_bytes`
+    (defaults to :attr:`MAX_BYTES`)."""
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for path in _entries():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError: # removed by another process
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def clear():
+    """Remove every cached result."""
+    for path in _entries():
+        os.remove(path)
+
+def cached(paths=()):
+    """Decorator that memoises a function's results on disk.
+
+    Args:
+        paths (list): Names of arguments that are paths to input files. They are
+                      keyed on their contents rather than their names.
+
+    The decorated function gains an `invalidate()` method that removes its cached
+    results, and an `uncached` attribute holding the original function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+
+            path = os.path.join(CACHE_DIR, '{}.pkl'.format(key(func, paths, *args, **kwargs)))
+            try:
+                with open(path, 'rb') as infile:
+                    result = pickle.load(infile)
+                os.utime(path) # mark as recently used
+                return result
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+
+            result = func(*args, **kwargs)
+            _announce()
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            partial = '{}.{}.tmp'.format(path, os.getpid())
+            with open(partial, 'wb') as outfile:
+                pickle.dump(result, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(partial, path) # readers never see partial results
+            evict()
+            return result
+
+        def invalidate():
+            for path in _entries('{}-*'.format(glob.escape(_prefix(func)))):
+                os.remove(path)
+
+        wrapper.invalidate = invalidate
+        wrapper.uncached = func
+        return wrapper
+    return decorator
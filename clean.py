@@ -4,6 +4,8 @@ import csv
 import sys
 import re
 
+import instrument
+
 def clean_assignment_names(infile, outfile, clean_launches=None):
     """
     * Assigns cleaned assignment names to each row, making an educated guess
@@ -18,8 +20,8 @@ def clean_assignment_names(infile, outfile, clean_launches=None):
     clean_launches -- true (or any non-None) value to indicate whether launches need to be
         cleaned up or not.
     """
-    print("This could take a few minutes, depending on how large the input is.")
-    with open(infile, 'r') as fin, open(outfile, 'w') as fout:
+    with open(infile, 'r') as fin, open(outfile, 'w') as fout, \
+            instrument.stage('clean.clean_assignment_names') as stage:
         reader = csv.DictReader(fin, delimiter=',')
         headers = list((fn) for fn in reader.fieldnames)
         headers.append('cleaned_assignment')
@@ -34,7 +36,9 @@ def clean_assignment_names(infile, outfile, clean_launches=None):
         writer.writerow(dict((fn, fn) for fn in writer.fieldnames))
 
         assignment_name = None
+        stage.rows_in = stage.rows_out = 0
         for row in reader:
+            stage.rows_in += 1
             assignment_name = squashed_assignment_name(row['CASSIGNMENTNAME'])
             uri = row['uri']
             project_id = row['projectId']
@@ -62,6 +66,24 @@ def clean_assignment_names(infile, outfile, clean_launches=None):
                 del row['TerminationType']
 
             writer.writerow(row)
+            stage.rows_out += 1
+
+def cleaned_assignments(df):
+    """
+    Assigns cleaned assignment names to events already in memory, as
+    clean_assignment_names does for a file (without clean_launches).
+
+    Keyword arguments:
+    df -- sensordata, with 'CASSIGNMENTNAME' and 'uri' columns
+
+    Returns a copy of df with the 'cleaned_assignment' and 'cleaned?' columns added.
+    """
+    squashed = df['CASSIGNMENTNAME'].fillna('').astype(str).map(squashed_assignment_name)
+    from_uri = df['uri'].fillna('').astype(str).map(assignment_name_from_uri)
+    return df.assign(**{
+        'cleaned_assignment': from_uri.fillna(squashed),
+        'cleaned?': from_uri.notnull().astype(int)
+    })
 
 def squashed_assignment_name(assignment):
     split = assignment.split()
@@ -98,4 +120,5 @@ if __name__ == '__main__':
     if len(sys.argv) < 3:
         print('Usage:\n\t./clean.py <input_file> <output_file> [clean_launches]')
         sys.exit()
+    instrument.log_to_stderr()
     main(sys.argv[1:])
@@ -0,0 +1,283 @@
+"""A single `sensordata` command for the scripts in this repository.
+
+Each analysis is a subcommand. Nothing heavy (pandas, numpy, or the analysis
+modules themselves) is imported until a subcommand actually runs, so `--help`
+and argument errors return immediately. That includes the subcommands that are
+handed to a script's own `main` (see :attr:`DELEGATED`): their arguments are
+defined here, and checked before the script is imported; the scripts parse
+their arguments with the same parsers (see :meth:`commandparser`).
+
+.. code-block:: bash
+
+   ./sensordata earlyoften all.csv submissions.csv due_times.json early-often.csv
+   ./sensordata clean raw.csv clean.csv
+   ./sensordata ingest data/live --port 8080
+   ./sensordata --help
+
+To use:
+    ./sensordata <subcommand> [arguments] on the command line, or
+    `cli.main(['earlyoften', ...])`
+"""
+import sys
+import argparse
+import importlib
+
+def _compactarguments(parser):
+    parser.add_argument('infile', help='CSV of sensordata')
+    parser.add_argument('outfile', help='Where to write the compacted sensordata')
+    parser.add_argument('--submissions', help='Web-CAT submissions, to split runs at final submissions')
+
+def _datasetarguments(parser):
+    parser.add_argument('infile', help='CSV of events')
+    parser.add_argument('outdir', help='Root directory of the dataset')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='Rows read into memory at a time')
+
+def _estimatearguments(parser):
+    parser.add_argument('infile', help='SensorData CSV')
+    parser.add_argument('submissions', help='Web-CAT submissions CSV')
+    parser.add_argument('duetimes', help='JSON file of due dates')
+    parser.add_argument('outfile', help='Path to write estimates to')
+    parser.add_argument('--fraction', type=float, default=0.05, help='Fraction of users to sample')
+    parser.add_argument('--replicates', type=int, default=1000, help='Bootstrap replicates')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the intervals')
+    parser.add_argument('--deadlines', nargs='+', metavar='KEY', default=None,
+                        help='Due date keys to measure against (default: dueTime)')
+
+def _editlatencyarguments(parser):
+    parser.add_argument('infile', help='SensorData CSV')
+    parser.add_argument('outfile', help='Path to write results to')
+    parser.add_argument('--all-edits', action='store_true', help='Include edits to test code')
+
+def _cubearguments(parser):
+    parser.add_argument('infile', help='SensorData CSV')
+    parser.add_argument('duetimes', help='JSON file of due dates')
+    parser.add_argument('outfile', help='Where to write the cube (.csv or .parquet)')
+    parser.add_argument('--submissions', help='Web-CAT submissions, to cut off events as Early/Often does')
+    parser.add_argument('--debugger', help='Debugger events CSV, to count debug sessions')
+
+def _ingestarguments(parser):
+    parser.add_argument('outdir', nargs='?', help='Root directory of the event log')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--flush-interval', type=float, default=5.0)
+    parser.add_argument('--max-queue', type=int, default=100000)
+    parser.add_argument('--replay', metavar='LOG', help='Replay a raw URL log against a running server')
+
+def _pipelinearguments(parser):
+    parser.add_argument('workdir', help='Directory for intermediate and final artifacts')
+    parser.add_argument('sources', nargs='+', metavar='name=path',
+                        help='Inputs: raw, uuids, submissions and due_times')
+    parser.add_argument('--targets', nargs='+', default=None, help='Stages to produce')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='Rerun every stage')
+    parser.add_argument('--csv', action='store_true', help='Also write each artifact as CSV')
+
+def _sqlstorearguments(parser):
+    tables = ('events', 'debugger') # sqlstore.SENSORDATA_TABLE and DEBUGGER_TABLE, without importing pandas
+    parser.add_argument('infile', help='CSV of events')
+    parser.add_argument('database', help='Path to the SQLite database')
+    parser.add_argument('--table', default=tables[0],
+                        help='Table to load into (use "{}" for debugger events)'.format(tables[1]))
+    parser.add_argument('--chunksize', type=int, default=100000, help='Rows inserted per transaction')
+
+def _shardsarguments(parser):
+    tasks = ['earlyoften', 'getdebugsessions'] # shards.TASKS, without importing pandas
+    commands = parser.add_subparsers(dest='command', metavar='<command>')
+    commands.required = True
+    sub = commands.add_parser('partition', help='Partition inputs into shards')
+    sub.add_argument('nshards', type=int, help='Number of shards')
+    sub.add_argument('outdir', help='Directory in which shard directories are created')
+    sub.add_argument('inputs', nargs='+', metavar='name=path',
+                     help='Inputs, e.g. sensordata, submissions, debugger and due_times')
+    sub = commands.add_parser('run', help='Run an analysis on one shard')
+    sub.add_argument('task', choices=tasks)
+    sub.add_argument('sharddir', help='A shard directory')
+    sub.add_argument('outfile', help='Where to write the partial result')
+    sub = commands.add_parser('merge', help='Merge partial results')
+    sub.add_argument('outfile', help='Path to write the merged result to')
+    sub.add_argument('partials', nargs='+', help='Partial results, or glob patterns matching them')
+
+def _sortarguments(parser):
+    parser.add_argument('outfile', help='Path to the sorted CSV file')
+    parser.add_argument('infiles', nargs='+', help='CSV or parquet files to sort together')
+    parser.add_argument('--by', nargs='+', default=['userName', 'assignment', 'time'],
+                        help='Columns to sort by (default: userName assignment time)')
+    parser.add_argument('--numeric', nargs='*', default=None,
+                        help='Columns to compare as numbers (default: known numeric columns)')
+    parser.add_argument('--run-size', type=int, default=500000, # extsort.RUNSIZE
+                        help='Rows held in memory at once')
+    parser.add_argument('--tmpdir', default=None, help='Where to write sorted runs')
+
+def _syntheticarguments(parser):
+    parser.add_argument('outdir', help='Directory to write generated files to')
+    parser.add_argument('events', type=int, help='Number of events to generate')
+    parser.add_argument('--students', type=int, default=None)
+    parser.add_argument('--assignments', type=int, default=4)
+    parser.add_argument('--term', default='fall2018')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-raw', dest='rawlog', action='store_false',
+                        help='Skip writing raw URL logs')
+
+def _benchmarkarguments(parser):
+    # benchmark.BENCHMARKS, without importing pandas
+    benchmarks = ['earlyoften', 'maptouuids', 'processline', 'getdebugsessions', 'load_submission_data',
+                  'computemetrics']
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Numbers of events to benchmark with')
+    parser.add_argument('--only', nargs='+', default=None, choices=benchmarks,
+                        help='Run only these benchmarks')
+    parser.add_argument('--workdir', default='benchmark-data',
+                        help='Where synthetic datasets are generated and cached')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='benchmark-results.json',
+                        help='Path to the JSON results file')
+
+#: Subcommands that hand their arguments straight to an existing script's `main`: the
+#: script's module, a description, and a function that adds the subcommand's arguments
+DELEGATED = {
+    'compact': ('compaction', 'Merge runs of Edit events on the same class and day', _compactarguments),
+    'dataset': ('dataset', 'Partition events by term and assignment', _datasetarguments),
+    'estimate': ('sampling', 'Estimate population Early/Often figures from a sample of users',
+                 _estimatearguments),
+    'editlatency': ('edit_latency', 'Time from solution edits to the next test run', _editlatencyarguments),
+    'cube': ('cube', 'Build a daily activity cube for fast roll-ups by day', _cubearguments),
+    'ingest': ('ingest', 'Receive live DevEventTracker events over HTTP', _ingestarguments),
+    'pipeline': ('pipeline', 'Run the processing pipeline, skipping unchanged stages', _pipelinearguments),
+    'sqlstore': ('sqlstore', 'Load events into an indexed SQLite store', _sqlstorearguments),
+    'shards': ('shards', 'Partition, run and merge sharded analyses', _shardsarguments),
+    'sort': ('extsort', 'Sort files larger than memory by any columns', _sortarguments),
+    'synthetic': ('synthetic', 'Generate synthetic DevEventTracker data', _syntheticarguments),
+    'benchmark': ('benchmark', 'Benchmark public entry points at several scales', _benchmarkarguments)
+}
+
+def commandparser(name, prog=None):
+    """Returns the argument parser for one of the :attr:`DELEGATED` subcommands.
+
+    Args:
+        name (str): The subcommand, e.g. `compact`
+        prog (str, optional): Name of the program in usage messages. Defaults to the
+                              name of the script being run.
+    """
+    _, description, arguments = DELEGATED[name]
+    parser = argparse.ArgumentParser(prog=prog, description=description + '.')
+    arguments(parser)
+    return parser
+
+def _earlyoften(args):
+    from early_often import earlyoften
+    earlyoften(args.infile, args.submissions, args.duetimes, outfile=args.outfile,
+               quantiles=args.quantiles, checkpoint=args.checkpoint, deadlines=args.deadlines,
+               sample=args.sample, replicates=args.replicates, processes=args.processes,
+               digests=args.digests)
+
+def _clean(args):
+    from clean import clean_assignment_names
+    clean_assignment_names(args.infile, args.outfile, True if args.clean_launches else None)
+
+def _timespent(args):
+    from time_spent import get_time_spent
+    get_time_spent(args.infile, args.outfile)
+
+def _incchecking(args):
+    from incremental_checking import incremental_checking
+    incremental_checking(args.infile, args.outfile, args.deadline)
+
+def _rawtocsv(args):
+    import utils
+    fieldnames = utils.DEFAULT_FIELDNAMES + ['userUuid', 'studentProjectUuid', 'Set']
+    utils.raw_to_csv(args.infile, args.outfile, fieldnames)
+
+def _debugsessions(args):
+    import debugging
+    sessions = debugging.getdebugsessions(debuggerusepath=args.infile)
+    if args.collapse:
+        sessions = debugging.collapsesessions(sessions, quantiles=args.quantiles, digests=args.digests)
+    sessions.to_csv(args.outfile)
+
+def parser():
+    """Returns the argument parser for the `sensordata` command."""
+    top = argparse.ArgumentParser(prog='sensordata', description=
+                                  'Measure incremental development from DevEventTracker SensorData.')
+    subcommands = top.add_subparsers(dest='command', metavar='<subcommand>')
+    quantiles = ['exact', 'sketch', 'validate'] # sketches.QUANTILE_MODES, without importing numpy
+
+    sub = subcommands.add_parser('earlyoften', help='Calculate Early/Often indices')
+    sub.add_argument('infile', help='SensorData CSV')
+    sub.add_argument('submissions', help='Web-CAT submissions CSV')
+    sub.add_argument('duetimes', help='JSON file of due dates')
+    sub.add_argument('outfile', help='Path to write results to')
+    sub.add_argument('--quantiles', choices=quantiles, default='exact', help='How medians are computed')
+    sub.add_argument('--digests', action='store_true',
+                     help='Keep the mergeable digest behind each sketched median')
+    sub.add_argument('--checkpoint', metavar='DIR', help='Save partial results here, and resume from them')
+    sub.add_argument('--deadlines', nargs='+', metavar='KEY', default=None,
+                     help='Due date keys to measure against, e.g. milestone1 dueTime (default: dueTime)')
+    sub.add_argument('--sample', type=float, metavar='FRACTION', default=None,
+                     help='Only measure this fraction of users, picked by a stable hash')
+    sub.add_argument('--replicates', type=int, metavar='N', default=None,
+                     help='Add bootstrap confidence intervals for each index, from N replicates')
+    sub.add_argument('--processes', type=int, default=None, help='Worker processes for the intervals')
+    sub.set_defaults(func=_earlyoften)
+
+    sub = subcommands.add_parser('clean', help='Clean assignment names in SensorData')
+    sub.add_argument('infile')
+    sub.add_argument('outfile')
+    sub.add_argument('--clean-launches', action='store_true', help='Also clean up launch types')
+    sub.set_defaults(func=_clean)
+
+    sub = subcommands.add_parser('timespent', help='Calculate time spent from work session data')
+    sub.add_argument('infile')
+    sub.add_argument('outfile')
+    sub.set_defaults(func=_timespent)
+
+    sub = subcommands.add_parser('incchecking', help='Calculate incremental checking metrics')
+    sub.add_argument('infile', help='Cleaned SensorData CSV')
+    sub.add_argument('outfile')
+    sub.add_argument('deadline', nargs='?', default=None)
+    sub.set_defaults(func=_incchecking)
+
+    sub = subcommands.add_parser('rawtocsv', help='Convert a raw URL log to CSV')
+    sub.add_argument('infile', help='File of newline separated URLs')
+    sub.add_argument('outfile')
+    sub.set_defaults(func=_rawtocsv)
+
+    sub = subcommands.add_parser('debugsessions', help='Summarise debugger sessions')
+    sub.add_argument('infile', help='Debugger events CSV')
+    sub.add_argument('outfile')
+    sub.add_argument('--collapse', action='store_true', help='One line per student-project')
+    sub.add_argument('--quantiles', choices=quantiles, default='exact', help='How medians are computed')
+    sub.add_argument('--digests', action='store_true',
+                     help='Keep the mergeable digest behind each sketched median')
+    sub.set_defaults(func=_debugsessions)
+
+    for name, (_, description, _) in sorted(DELEGATED.items()):
+        subcommands.add_parser(name, help='{} (see `sensordata {} --help`)'.format(description, name),
+                               add_help=False)
+
+    return top
+
+def main(args):
+    """Parses CLI arguments and runs a subcommand."""
+    if args and args[0] in DELEGATED:
+        # arguments are checked before the script (and pandas) is imported
+        commandparser(args[0], prog='sensordata {}'.format(args[0])).parse_args(args[1:])
+        module = importlib.import_module(DELEGATED[args[0]][0])
+        return module.main(args[1:])
+
+    args = parser().parse_args(args)
+    if not args.command:
+        parser().print_help()
+        sys.exit(2)
+
+    import instrument
+    instrument.log_to_stderr()
+    try:
+        args.func(args)
+    except FileNotFoundError as e:
+        print('Error! File {} does not exist.'.format(e.filename), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Lossless compaction of Edit events, so that Early/Often measures are computed
+over far fewer rows.
+
+DevEventTracker sends an Edit event for nearly every save, and a heavy student
+can have hundreds of thousands of them on one class, each of which
+:meth:`early_often.userearlyoften` visits in turn. :meth:`compact` merges each
+run of Edit events that are adjacent in a student-project's event stream (in
+time order) and share
+
+* the class (`Class-Name`),
+* the local day, and so the days until every deadline,
+* `onTestCase`, and so whether they count as solution or test code, and
+* the side of the student's final submission (if submissions are given)
+
+into one event: the run's last event, with its sizes, plus
+
+* `Changed-Size`, `Changed-Statements`, `Changed-Methods` and
+  `Changed-Test-Assertions`: the sum over the run of the absolute changes that
+  Early/Often measures at each edit (see :attr:`CHANGED`),
+* `First-Time`, `First-Size`, `First-Statements`, `First-Methods` and
+  `First-Test-Assertions`: the time and sizes of the run's first event, and
+* `Compacted-Edits`: the number of events merged.
+
+Other events are passed through, with these columns empty.
+
+Every Early/Often index is a mean of days until the deadline weighted by edit
+size, sum(size * days) / sum(size), over the edits counted for a measure, and
+the medians and standard deviations beside them are of the same days, each
+repeated once per unit of size. All of a run's edits count for the same measures
+at the same days, so one edit whose size is their total leaves these sums and
+distributions exactly as they were; and each class ends the run at its last
+size, so the next edit's change is measured from the same place. Sums of edit
+sizes (such as the daily totals in :mod:`cube`) are kept for the same reason.
+
+:meth:`early_often.earlyoften`, :mod:`cube`, :mod:`online_early_often` and the
+churn in :class:`sizeindex.SizeIndex` use the `Changed-*` columns wherever they
+are present. Without `submissions`, a run may straddle a student's final
+submission, and then the edits before it are cut off with the rest of the run;
+pass the submissions that Early/Often will be computed with.
+
+Measures that depend on the time of every edit, or on the number of edits, are
+not preserved: :mod:`incremental_checking`, :mod:`time_spent` (work sessions are
+delimited by gaps between events, which merging widens) and :mod:`edit_latency`
+count each merged run as one edit at its last event's time. They, and the
+matching metrics in :mod:`metrics`, warn when given compacted sensordata (see
+:meth:`iscompacted`); compute them from the original events.
+
+.. code-block:: python
+
+   import compaction
+
+   compacted = compaction.compact(events, submissions=load_submission_data('submissions.csv'))
+
+To use:
+    `import compaction`, or
+    ./compaction.py <input file> <output file> [--submissions <file>] on the command line
+"""
+import sys
+import logging
+
+import numpy as np
+import pandas as pd
+
+import cli
+import utils
+import instrument
+from load_datasets import load_submission_data, last_submission_times
+
+logger = logging.getLogger('sensordata.compaction')
+
+#: Size columns, and the columns holding the total change in each over a compacted run
+CHANGED = {
+    'Current-Size': 'Changed-Size',
+    'Current-Statements': 'Changed-Statements',
+    'Current-Methods': 'Changed-Methods',
+    'Current-Test-Assertions': 'Changed-Test-Assertions'
+}
+
+#: Size columns, and the columns holding their values at the first event of a run
+FIRST = {column: column.replace('Current-', 'First-') for column in CHANGED}
+
+def recorded(event, column):
+    """The total change in a size column recorded on a compacted event.
+
+    Args:
+        event (dict): An event (a *dict* or a row *Series*)
+        column (str): One of the keys of :attr:`CHANGED`, e.g. `Current-Size`
+
+    Returns:
+        The change as an *int*, or *None* if the event was not compacted.
+    """
+    value = event.get(CHANGED[column], '')
+    if value == '' or pd.isnull(value):
+        return None
+    return int(value)
+
+def iscompacted(events):
+    """Whether a *DataFrame* of events includes edits merged by :meth:`compact`,
+    judging by whichever of the columns it adds are present."""
+    columns = [c for c in ['Compacted-Edits'] + list(CHANGED.values()) if c in events.columns]
+    return any((events[c].fillna('').astype(str) != '').any() for c in columns)
+
+def _changes(values, classcodes):
+    """Absolute change at each edit from the class's previous value (0 before the
+    first), as :meth:`early_often.userearlyoften` measures it. Empty values (e.g.,
+    assertions in solution code) change nothing and are skipped over."""
+    present = values != ''
+    sizes = pd.Series(pd.to_numeric(values[present]).astype(np.int64))
+    previous = sizes.groupby(classcodes[present], sort=False).shift(1).fillna(0).astype(np.int64)
+    changes = np.zeros(len(values), dtype=np.int64)
+    changes[present] = (sizes - previous).abs().values
+    return changes
+
+@instrument.instrumented('compaction.compact')
+def compact(events, submissions=None):
+    """Merge runs of consecutive Edit events on the same class and day.
+
+    Args:
+        events (DataFrame): Sensordata with string columns, `time` in milliseconds,
+                            and user and assignment columns (see :meth:`utils.group_columns`)
+        submissions (DataFrame, optional): As returned by
+            :meth:`load_datasets.load_submission_data`. Runs are split at each
+            student's final submission.
+
+    Returns:
+        A *DataFrame* of the compacted events, in order of user, assignment and time,
+        with the columns described above.
+    """
+    usercol, assignmentcol = utils.group_columns(events.columns)
+    events = events.fillna('')
+    events = events.assign(_millis=pd.to_numeric(events['time']))
+    events = utils.ensure_sorted(events, [usercol, assignmentcol, '_millis']).reset_index(drop=True)
+    millis = events.pop('_millis')
+    count = len(events)
+
+    added = list(CHANGED.values()) + ['First-Time'] + list(FIRST.values()) + ['Compacted-Edits']
+    if not count:
+        return events.assign(**{column: '' for column in added})
+
+    edit = ((events['Type'] == 'Edit') & (events['Class-Name'] != '')).values
+    times = utils.local_times(millis)
+    keys = pd.DataFrame({
+        'user': events[usercol].values,
+        'assignment': events[assignmentcol].values,
+        'class': events['Class-Name'].values,
+        'day': times.dt.normalize().values,
+        'onTestCase': events['onTestCase'].values,
+        'after': False
+    })
+    if submissions is not None:
+        projects = keys.groupby(['user', 'assignment'], sort=False)
+        firsts = projects.size().index
+        cutoffs = last_submission_times(submissions, firsts.get_level_values(0),
+                                        firsts.get_level_values(1), usercol=usercol)
+        keys['after'] = times.values > cutoffs[projects.ngroup().values]
+
+    # an edit continues a run if the event before it is an edit with the same keys
+    runkeys = keys.groupby(list(keys.columns), sort=False).ngroup().values
+    continues = np.zeros(count, dtype=bool)
+    continues[1:] = edit[1:] & edit[:-1] & (runkeys[1:] == runkeys[:-1])
+    starts = np.flatnonzero(~continues)
+    lasts = np.append(starts[1:], count) - 1
+    merged = edit[lasts]
+
+    compacted = events.iloc[lasts].reset_index(drop=True)
+    classcodes = keys[edit].groupby(['user', 'assignment', 'class'], sort=False).ngroup().values
+    for column, changed in CHANGED.items():
+        values = events[column].values.astype(str)
+        changes = np.zeros(count, dtype=np.int64)
+        changes[edit] = _changes(values[edit], classcodes)
+        totals = np.add.reduceat(changes, starts)
+        compacted[changed] = np.where(merged, totals.astype(str), '')
+        compacted[FIRST[column]] = np.where(merged, values[starts], '')
+
+    # a run ends with the last assertion count it recorded, even if its last event had none
+    assertions = events['Current-Test-Assertions'].values.astype(str)
+    latest = np.maximum.accumulate(np.where(assertions != '', np.arange(count), -1))[lasts]
+    compacted['Current-Test-Assertions'] = np.where(
+        merged, np.where(latest >= starts, assertions[np.maximum(latest, 0)], ''),
+        compacted['Current-Test-Assertions'].values)
+
+    compacted['First-Time'] = np.where(merged, events['time'].values.astype(str)[starts], '')
+    compacted['Compacted-Edits'] = np.where(merged, (lasts - starts + 1).astype(str), '')
+
+    logger.info('Compacted %d events to %d (%d edits to %d), a reduction of %.1fx',
+                count, len(compacted), edit.sum(), merged.sum(), count / len(compacted))
+    return compacted
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('compact').parse_args(args)
+
+    try:
+        events = pd.read_csv(args.infile, dtype=str, na_values=[], keep_default_na=False, low_memory=False)
+        submissions = load_submission_data(args.submissions) if args.submissions else None
+    except FileNotFoundError as e:
+        print("Error! File '%s' does not exist." % e.filename)
+        return
+
+    compacted = compact(events, submissions=submissions)
+    compacted.to_csv(args.outfile, index=False)
+    print('{} events compacted to {}: a reduction of {:.1f}x'.format(
+        len(events), len(compacted), len(events) / max(len(compacted), 1)))
+
+if __name__ == '__main__':
+    instrument.log_to_stderr()
+    main(sys.argv[1:])
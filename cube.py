@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""A daily activity cube: what each student did on each project, on each day
+leading up to (and just after) the deadline.
+
+Most of our questions are roll-ups by days until the deadline (Early/Often
+indices, skyline plots, work distributions), and each used to go back to the raw
+events. :meth:`build` scans sensordata once and keeps one row per
+(user, assignment, daysToDeadline), with:
+
+* code written: absolute changes in bytes, statements and methods of solution
+  and test code (`solutionBytes`, `testBytes`, `solutionStmts`, `testStmts`,
+  `solutionMethods`, `testMethods`), and in test assertions (`testAssertions`),
+  replaying each class's size the same way :meth:`early_often.userearlyoften` does
+  (sensordata may have been compacted; see :mod:`compaction`)
+* `launches`, and launches of each subtype (e.g., `testLaunches`, `normalLaunches`)
+* `debugSessions` longer than 30 seconds, if debugger sessions are given
+* `activeMinutes`: distinct minutes in which the student produced any event
+
+Events are cut off the same way they are for Early/Often (after the final
+submission, or more than 4 days after the due date), so :meth:`earlyoften`
+reproduces the Early/Often indices from the cube alone.
+
+.. code-block:: python
+
+   import cube
+
+   activity = cube.build('all.csv', 'due_times.json', submissionpath='submissions.csv')
+   indices = cube.earlyoften(activity) # computed in milliseconds from the cube
+
+To use:
+    `import cube`, or
+    ./cube.py <sensordata> <duedates file> <output file> [--submissions <file>] on the command line
+"""
+import sys
+import json
+
+import numpy as np
+import pandas as pd
+
+import cli
+import utils
+import instrument
+import compaction
+from load_datasets import load_submission_data
+from early_often import deadlinetable, withdeadlines
+
+#: Edit measures, as (cube column suffix, sensordata column)
+SIZES = [('Bytes', 'Current-Size'), ('Stmts', 'Current-Statements'), ('Methods', 'Current-Methods')]
+
+#: Early/Often indices computable from the cube, and the cube columns they weight
+INDICES = {
+    'byteEarlyOftenIndex': ['solutionBytes', 'testBytes'],
+    'stmtEarlyOftenIndex': ['solutionStmts', 'testStmts'],
+    'solutionByteEarlyOftenIndex': ['solutionBytes'],
+    'solutionStmtEarlyOftenIndex': ['solutionStmts'],
+    'solutionMethodsEarlyOftenIndex': ['solutionMethods'],
+    'testByteEarlyOftenIndex': ['testBytes'],
+    'testStmtsEarlyOftenIndex': ['testStmts'],
+    'testMethodsEarlyOftenIndex': ['testMethods'],
+    'assertionsEarlyOftenIndex': ['testAssertions'],
+    'launchEarlyOften': ['launches'],
+    'testLaunchEarlyOften': ['testLaunches'],
+    'normalLaunchEarlyOften': ['normalLaunches'],
+    'debugSessionEarlyOften': ['debugSessions']
+}
+
+def _deltas(edits, keys, column):
+    """Absolute change in `column` from each class's previous value (0 at first), or
+    the change recorded on edits merged by :meth:`compaction.compact`."""
+    values = pd.to_numeric(edits[column], errors='raise').astype(np.int64)
+    previous = values.groupby([edits[k] for k in keys], sort=False).shift(1).fillna(0)
+    deltas = (values - previous).abs().astype(np.int64)
+    changed = compaction.CHANGED[column]
+    if changed in edits.columns:
+        recorded = edits[changed] != ''
+        deltas[recorded] = pd.to_numeric(edits.loc[recorded, changed]).astype(np.int64)
+    return deltas
+
+@instrument.instrumented('cube.build')
+def build(infile, duetimepath, submissionpath=None, sessions=None, outfile=None):
+    """Build the daily activity cube from sensordata.
+
+    Args:
+        infile (str or DataFrame): Path to sensordata (time in milliseconds), or
+                                   already loaded sensordata with string columns
+        duetimepath (str): Path to a JSON file of due dates
+        submissionpath (str, optional): Path to Web-CAT submissions. If given, events
+            after each student's final submission are cut off, and student-projects
+            with no submission are left out, as for Early/Often.
+        sessions (DataFrame, optional): Debugger sessions, as returned by
+            :meth:`debugging.getdebugsessions`
+        outfile (str, optional): Where to write the cube (parquet if the name ends in
+            `.parquet`, CSV otherwise)
+
+    Returns:
+        A *DataFrame* indexed by (user, assignment, daysToDeadline) if no *outfile*
+        is specified. *None* otherwise.
+    """
+    with instrument.stage('cube.read') as stage:
+        if isinstance(infile, pd.DataFrame):
+            df = infile.fillna('')
+        else:
+            df = pd.read_csv(infile, dtype=str, na_values=[], keep_default_na=False, low_memory=False)
+        usercol, assignmentcol = utils.group_columns(df.columns)
+        df = df[[usercol, assignmentcol, 'time', 'Class-Name', 'Type', 'Subtype', 'onTestCase'] +
+                [col for _, col in SIZES] + ['Current-Test-Assertions'] +
+                [col for col in compaction.CHANGED.values() if col in df.columns]].copy()
+        df['time'] = utils.local_times(pd.to_numeric(df['time']))
+        stage.rows_out = len(df)
+
+    with open(duetimepath) as data_file:
+        due_date_data = json.load(data_file)
+    submissions = load_submission_data(submissionpath) if submissionpath else None
+
+    with instrument.stage('cube.deadlines', rows_in=len(df)) as stage:
+        keys = [usercol, assignmentcol]
+        df = utils.ensure_sorted(df, keys + ['time'])
+        firsts = df.groupby(keys, sort=False)['time'].first()
+        table = deadlinetable(firsts.index.get_level_values(0), firsts.index.get_level_values(1),
+                              firsts.values, due_date_data, submissions, usercol=usercol)
+        df = withdeadlines(df, table, usercol=usercol, assignmentcol=assignmentcol)
+        if submissions is not None:
+            df = df[df['lastSubmissionTime'].notnull()]
+        stage.rows_out = len(df)
+
+    day = keys + ['daysToDeadline']
+    parts = []
+
+    with instrument.stage('cube.edits', rows_in=len(df)) as stage:
+        # sizes are replayed over all of a student's edits, before the cutoff applies
+        edits = df[(df['Type'] == 'Edit') & (df['Class-Name'] != '')]
+        classes = keys + ['Class-Name']
+        kind = np.where(pd.to_numeric(edits['onTestCase'], errors='coerce') == 1, 'test', 'solution')
+        changes = pd.DataFrame({col: edits[col] for col in day + ['pastCutoff']})
+        for suffix, column in SIZES:
+            delta = _deltas(edits, classes, column)
+            for k in ('solution', 'test'):
+                changes[k + suffix] = delta.where(kind == k, 0)
+        assertions = edits[edits['Current-Test-Assertions'] != '']
+        changes['testAssertions'] = _deltas(assertions, classes, 'Current-Test-Assertions')
+        changes['testAssertions'] = changes['testAssertions'].fillna(0).astype(np.int64)
+        changes = changes[~changes.pop('pastCutoff')]
+        parts.append(changes.groupby(day, sort=False).sum())
+        stage.rows_out = len(edits)
+
+    df = df[~df['pastCutoff']]
+
+    launches = df[df['Type'] == 'Launch']
+    counts = pd.crosstab([launches[col] for col in day], launches['Subtype'])
+    total = counts.sum(axis=1)
+    # launches with no subtype count only towards the total
+    counts = counts.drop(columns=[s for s in counts.columns if s == ''])
+    counts.columns = [s[0].lower() + s[1:] + 'Launches' for s in counts.columns]
+    counts['launches'] = total
+    parts.append(counts)
+
+    minutes = df['time'].dt.floor('min')
+    parts.append(df.assign(minute=minutes).groupby(day, sort=False)['minute'].nunique()
+                   .rename('activeMinutes').to_frame())
+
+    if sessions is not None:
+        debug = sessions.reset_index()
+        debug = debug[debug['length'] > 30] \
+                  .rename(columns={'userName': usercol, 'assignment': assignmentcol})
+        debug = debug[debug.set_index(keys).index.isin(table.index)]
+        debug = withdeadlines(debug, table, usercol=usercol, assignmentcol=assignmentcol)
+        debug = debug[~debug['pastCutoff']]
+        if submissions is not None:
+            debug = debug[debug['lastSubmissionTime'].notnull()]
+        parts.append(debug.groupby(day).size().rename('debugSessions').to_frame())
+
+    with instrument.stage('cube.combine') as stage:
+        cube = pd.concat(parts, axis=1).fillna(0).astype(np.int64).sort_index()
+        for column in ('testLaunches', 'normalLaunches', 'debugSessions'):
+            if column not in cube.columns:
+                cube[column] = 0
+        cube.index.names = day
+        stage.rows_out = len(cube)
+
+    if outfile:
+        save(cube, outfile)
+    else:
+        return cube
+
+def save(cube, path):
+    """Write a cube to parquet (if `path` ends in `.parquet`) or CSV."""
+    if path.endswith('.parquet'):
+        cube.to_parquet(path)
+    else:
+        cube.to_csv(path)
+
+def load(path):
+    """Read a cube written by :meth:`build` or :meth:`save`."""
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    df = pd.read_csv(path, dtype={0: str, 1: str})
+    return df.set_index(list(df.columns[:3]))
+
+def earlyoften(cube, columns=None):
+    """Early/Often indices from a cube: for each measure, the mean number of days
+    until the deadline, weighted by the amount of activity on each day.
+
+    Args:
+        cube (DataFrame): As returned by :meth:`build`
+        columns (dict, optional): Indices to compute, mapping names to the cube
+                                  columns they weight. Defaults to :attr:`INDICES`.
+
+    Returns:
+        A *DataFrame* indexed by (user, assignment), with the same values as the
+        corresponding columns from :meth:`early_often.earlyoften`.
+    """
+    columns = columns or INDICES
+    days = cube.index.get_level_values(2).values
+    amounts = pd.DataFrame({name: cube[cols].sum(axis=1) for name, cols in columns.items()},
+                           index=cube.index)
+    groups = [cube.index.get_level_values(0), cube.index.get_level_values(1)]
+    weighted = amounts.mul(days, axis=0).groupby(groups, sort=False).sum()
+    totals = amounts.groupby(groups, sort=False).sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        results = weighted / totals
+    results.index.names = cube.index.names[:2]
+    return results
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('cube').parse_args(args)
+
+    sessions = None
+    if args.debugger:
+        import debugging
+        sessions = debugging.getdebugsessions(debuggerusepath=args.debugger)
+    build(args.infile, args.duetimes, submissionpath=args.submissions, sessions=sessions,
+          outfile=args.outfile)
+
+if __name__ == '__main__':
+    instrument.log_to_stderr()
+    main(sys.argv[1:])
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""A Hive-style partitioned dataset of events, so that analyses of one term or one
+assignment read only that term or assignment.
+
+Events are laid out as parquet files under `term=<term>/assignment=<assignment>/`
+directories. The term comes from :meth:`utils.get_term`, applied to the time of
+the first event of each student-project (as due dates are resolved), so a
+project is never split across terms. Values are stored as they appear in the
+CSV (as strings, with missing values empty), so reading a partition gives the
+same frame as reading the CSV with `dtype=str`.
+
+:meth:`early_often.earlyoften`, :meth:`load_datasets.load_edits` and
+:meth:`debugging.getdebugsessions` accept a dataset directory wherever they
+accept a CSV, along with `terms` and `assignments` to prune partitions.
+
+.. code-block:: python
+
+   import dataset
+
+   dataset.write('data/fall-2018/all.csv', 'data/events')
+   dataset.write('data/fall-2016/debugger-use.csv', 'data/debugger')
+
+   events = dataset.read('data/events', terms=['fall2018'], assignments=['Project 1'])
+   earlyoften('data/events', ..., terms=['fall2018'])
+
+To use:
+    `import dataset`, or
+    ./dataset.py <infile> <outdir> on the command line
+"""
+import os
+import sys
+import glob
+import shutil
+from urllib.parse import quote, unquote
+
+import pandas as pd
+
+import cli
+import utils
+import instrument
+
+def _partitiondir(outdir, term, assignment):
+    return os.path.join(outdir, 'term={}'.format(quote(term, safe=' ')),
+                        'assignment={}'.format(quote(assignment, safe=' ')))
+
+def isdataset(path):
+    """Returns *True* if `path` is a directory written by :meth:`write`."""
+    return isinstance(path, str) and os.path.isdir(path) and \
+        any(name.startswith('term=') for name in os.listdir(path))
+
+def partitions(path, terms=None, assignments=None):
+    """List the partitions of a dataset, optionally only those for some terms and
+    assignments.
+
+    Returns:
+        A list of `(term, assignment, directory)` tuples, in sorted order.
+    """
+    found = []
+    for termdir in sorted(glob.glob(os.path.join(path, 'term=*'))):
+        term = unquote(os.path.basename(termdir)[len('term='):])
+        if terms and term not in terms:
+            continue
+        for assignmentdir in sorted(glob.glob(os.path.join(termdir, 'assignment=*'))):
+            assignment = unquote(os.path.basename(assignmentdir)[len('assignment='):])
+            if assignments and assignment not in assignments:
+                continue
+            found.append((term, assignment, assignmentdir))
+    return found
+
+@instrument.instrumented('dataset.write')
+def write(infile, outdir, chunksize=1000000):
+    """Write events from a CSV file to a partitioned dataset.
+
+    Partitions that receive events are replaced; other partitions already in
+    `outdir` are left alone, so several files (e.g., one per term) can be written
+    to the same dataset.
+
+    Args:
+        infile (str): Path to sensordata, debugger events, or any other CSV with a
+                      user column, an assignment column and `time`
+        outdir (str): Root directory of the dataset
+        chunksize (int): Number of rows read into memory at a time
+
+    Returns:
+        The partitions written, as `(term, assignment)` tuples.
+    """
+    # first pass: the term of each student-project, from the time of its first event
+    header = pd.read_csv(infile, nrows=0).columns
+    usercol, assignmentcol = utils.group_columns(header)
+    firsts = None
+    for chunk in pd.read_csv(infile, dtype={usercol: str, assignmentcol: str}, na_values=[],
+                             keep_default_na=False, usecols=[usercol, assignmentcol, 'time'],
+                             chunksize=chunksize):
+        chunkfirsts = chunk.groupby([usercol, assignmentcol], sort=False)['time'].min()
+        firsts = chunkfirsts if firsts is None else \
+            pd.concat([firsts, chunkfirsts]).groupby(level=[0, 1], sort=False).min()
+    terms = {} if firsts is None else {key: utils.get_term(first) for key, first in firsts.items()}
+
+    written = set()
+    chunks = pd.read_csv(infile, dtype=str, na_values=[], keep_default_na=False, chunksize=chunksize)
+    for number, chunk in enumerate(chunks):
+        chunkterms = [terms[key] for key in zip(chunk[usercol], chunk[assignmentcol])]
+
+        for (term, assignment), part in chunk.groupby([chunkterms, chunk[assignmentcol]], sort=False):
+            partdir = _partitiondir(outdir, term, assignment)
+            if (term, assignment) not in written:
+                shutil.rmtree(partdir, ignore_errors=True)
+                os.makedirs(partdir)
+                written.add((term, assignment))
+            path = os.path.join(partdir, 'part-{:05d}.parquet'.format(number))
+            part.to_parquet(path + '.tmp', index=False)
+            os.replace(path + '.tmp', path)
+
+    return sorted(written)
+
+@instrument.instrumented('dataset.read')
+def read(path, terms=None, assignments=None, columns=None):
+    """Read events from a partitioned dataset, opening only the partitions needed.
+
+    Args:
+        path (str): Root directory of the dataset
+        terms (list, optional): Only read these terms (e.g., `['fall2018']`)
+        assignments (list, optional): Only read these assignments (e.g., `['Project 1']`)
+        columns (list, optional): Only read these columns. Columns missing from a
+                                  partition are empty.
+
+    Returns:
+        A *DataFrame* of string columns, in the order events were written, partition
+        by partition.
+    """
+    frames = []
+    for _, _, partdir in partitions(path, terms=terms, assignments=assignments):
+        for part in sorted(glob.glob(os.path.join(partdir, 'part-*.parquet'))):
+            if columns is None:
+                frames.append(pd.read_parquet(part))
+            else:
+                import pyarrow.parquet as pq
+                present = pq.read_schema(part).names
+                frames.append(pd.read_parquet(part, columns=[c for c in columns if c in present])
+                                .reindex(columns=columns, fill_value=''))
+
+    if not frames:
+        return pd.DataFrame(columns=columns or [])
+    return pd.concat(frames, ignore_index=True)
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('dataset').parse_args(args)
+
+    for term, assignment in write(args.infile, args.outdir, chunksize=args.chunksize):
+        print('term={}/assignment={}'.format(term, assignment))
+
+if __name__ == '__main__':
+    instrument.log_to_stderr()
+    main(sys.argv[1:])
@@ -4,6 +4,12 @@ from datetime import datetime
 import numpy as np
 import pandas as pd
 
+import instrument
+import cache
+import sketches
+import dataset
+import sqlstore
+
 # Setup items
 pd.options.display.float_format = '{:.2f}'.format
 
@@ -83,14 +89,14 @@ def sessionsummary(session):
 
 def userdebugsessions(userevents):
     """Given all Debug events from a student on a project, organise them into debug 
-    sessions and summarise.
+    sessions and summarise. Sessions are numbered in order within the student-project,
+    so the numbering doesn't depend on where the events sat in the input file.
 
     See also:
         :meth:`sessionsummary`
     """
-    userevents.loc[
-        userevents.Subtype == 'Terminate', 'session'
-    ] = userevents.index[userevents.Subtype == 'Terminate']
+    terminations = userevents.Subtype == 'Terminate'
+    userevents.loc[terminations, 'session'] = np.arange(terminations.sum())
     userevents.session = (
         userevents.session
         # fill backwards from termination
@@ -104,19 +110,46 @@ def userdebugsessions(userevents):
     sessions = userevents.groupby(['session']).apply(sessionsummary) 
     return sessions
 
-def getdebugsessions(debuggerusepath=None, sessionspath=None):
+def userdebugsummary(userevents):
+    """Given all events from a student on a project, summarise their use of the
+    debugger in a single line. Only `Type=Debug` events are considered.
+
+    Produces the same columns as :meth:`collapsesessions`, for a single student-project.
+    """
+    debugevents = userevents[(userevents['Type'] == 'Debug') & (userevents['Subtype'] != 'Unknown')]
+    if len(debugevents) == 0:
+        return pd.Series({'debugSessionCount': 0})
+
+    sessions = userdebugsessions(debugevents.copy())
+    cols = ['setBreakpoints', 'hitBreakpoints', 'stepOver', 'stepInto', 'length']
+    result = {}
+    for col in cols:
+        result['{}_mean'.format(col)] = np.mean(sessions[col])
+        result['{}_median'.format(col)] = np.median(sessions[col])
+    result['debugSessionCount'] = countbreakpointsession(sessions)
+
+    return pd.Series(result)
+
+@cache.cached(paths=['debuggerusepath', 'sessionspath'])
+def getdebugsessions(debuggerusepath=None, sessionspath=None, terms=None, assignments=None):
     """Given raw Debug events for all students on all projects, 
     reduce them to session summaries for each student-project.
 
     If sessionspath is provided, read already-computed Debug sessions
-    from the specified file.
+    from the specified file. If caching is turned on (see :mod:`cache`),
+    repeated calls with unchanged inputs do not recompute sessions either way.
+
+    debuggerusepath may also be a partitioned dataset (see :mod:`dataset`), in
+    which case only the partitions for `terms` and `assignments` (if given) are read,
+    or an SQLite store with debugger events in :attr:`sqlstore.DEBUGGER_TABLE`, in
+    which case only events for `assignments` (if given) are selected.
     """
     if debuggerusepath is None and sessionspath is None:
         raise ValueError('Either debuggerusepath or sessionspath must be specified.')
 
     if sessionspath:
         try:
-            sessions = pd.read_csv('data/fall-2016/debugger-sessions.csv',
+            sessions = pd.read_csv(sessionspath,
                     index_col=['userName', 'assignment'], parse_dates=['time', 'endTime'])
             return sessions
         except FileNotFoundError:
@@ -132,16 +165,52 @@ def getdebugsessions(debuggerusepath=None, sessionspath=None):
         'Type': str,
         'Subtype': str
     }
-    assignments = [ 'Project 1', 'Project 2', 'Project 3', 'Project 4' ]
-    events = pd.read_csv(filepath_or_buffer=debuggerusepath, low_memory=False, date_parser=dateparser,
-        parse_dates=['time'], dtype=dtypes, usecols=dtypes.keys()) \
-        .query("Subtype != 'Unknown' and assignment in @assignments") \
-        .sort_values(['userName', 'assignment', 'time'], ascending=[1, 1, 1])
-    sessions = events.groupby(['userName', 'assignment']).apply(userdebugsessions)
+    projects = [ 'Project 1', 'Project 2', 'Project 3', 'Project 4' ]
+    with instrument.stage('debugging.getdebugsessions.read') as stage:
+        if dataset.isdataset(debuggerusepath):
+            events = dataset.read(debuggerusepath, terms=terms, assignments=assignments,
+                                  columns=list(dtypes.keys()))
+            events['time'] = pd.to_datetime(events['time'].map(dateparser))
+        elif sqlstore.isstore(debuggerusepath) and not terms:
+            with sqlstore.EventStore(debuggerusepath) as store:
+                columns = [c for c in store.columns(sqlstore.DEBUGGER_TABLE) if c in dtypes]
+                events = store.events(table=sqlstore.DEBUGGER_TABLE, columns=columns,
+                                      assignments=assignments or projects, where="Subtype != 'Unknown'")
+            events = events.replace('', np.nan) # as read from a CSV
+            events['time'] = pd.to_datetime(events['time'].map(dateparser))
+        elif terms or assignments:
+            raise ValueError('terms can only be used with a partitioned dataset, '
+                             'and assignments with a dataset or an SQLite store')
+        else:
+            events = pd.read_csv(filepath_or_buffer=debuggerusepath, low_memory=False, date_parser=dateparser,
+                parse_dates=['time'], dtype=dtypes, usecols=dtypes.keys())
+        events = events \
+            .query("Subtype != 'Unknown' and assignment in @projects") \
+            .sort_values(['userName', 'assignment', 'time'], ascending=[1, 1, 1])
+        stage.rows_out = len(events)
+
+    with instrument.stage('debugging.getdebugsessions.sessions', rows_in=len(events)) as stage:
+        sessions = events.groupby(['userName', 'assignment']).apply(userdebugsessions)
+        stage.rows_out = len(sessions)
 
     return sessions
 
-def collapsesessions(sessions):
+def _digest(values, compression):
+    """A quantile sketch of a column of numbers or datetimes (as nanoseconds)."""
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.values.astype(np.int64)
+    return sketches.digest(values, compression=compression)
+
+def _estimatemedian(values, compression):
+    """Estimate the median of a column of numbers or datetimes with a quantile sketch."""
+    estimate = _digest(values, compression).median()
+    if np.issubdtype(values.dtype, np.datetime64):
+        return pd.Timestamp(int(estimate))
+    return estimate
+
+@instrument.instrumented('debugging.collapsesessions')
+@cache.cached()
+def collapsesessions(sessions, quantiles='exact', compression=100, digests=False):
     """Summarise debugger session summaries.
     Reduces all debugger sessions to a single line per student
     project.
@@ -149,21 +218,41 @@ def collapsesessions(sessions):
     Args:
         sessions (pd.DataFrame): Summarised debugger sessions, as returned 
                                  by :meth:`sessionsummary`
+        quantiles (str): How medians are computed; one of :attr:`sketches.QUANTILE_MODES`
+        compression (float): Accuracy of the sketches used if `quantiles` is not `exact`
+        digests (bool): Also give each median's serialized digest, in a `<column>_medianDigest`
+                        column (see :mod:`sketches`). Needs `quantiles` other than `exact`.
 
     Returns:
         A DataFrame with a single line per project, giving a coarse-grained overview
         of debugger usage.
     """
+    sketches.check_mode(quantiles, digests)
+
     # get counts
     counts = pd.DataFrame({ 'debugSessionCount': sessions \
                             .groupby(['userName', 'assignment']) \
                             .apply(countbreakpointsession) })
 
     # get mean and median stepOver, stepInto, breakpoints, and session lengths
-    consolidated = sessions.groupby(['userName', 'assignment']) \
-                .agg(['mean', 'median'])
+    grouped = sessions.groupby(['userName', 'assignment'])
+    consolidated = grouped.agg(['mean', 'median'] if quantiles != 'sketch' else ['mean'])
     consolidated.columns = [ '_'.join(x) for x in consolidated.columns.ravel() ]
 
+    if quantiles != 'exact':
+        estimates = grouped.agg(lambda values: _estimatemedian(values, compression))
+        suffix = '_median' if quantiles == 'sketch' else '_medianSketch'
+        estimates.columns = [ '{}{}'.format(col, suffix) for col in estimates.columns ]
+        consolidated = consolidated.join(estimates)
+        if quantiles == 'sketch': # in the usual column order
+            consolidated = consolidated[[ '{}_{}'.format(col, stat) for col in estimates.columns.str[:-7]
+                                          for stat in ('mean', 'median') ]]
+
+    if digests:
+        serialized = grouped.agg(lambda values: sketches.dumps(_digest(values, compression)))
+        serialized.columns = [ '{}_median{}'.format(col, sketches.DIGEST_SUFFIX) for col in serialized.columns ]
+        consolidated = consolidated.join(serialized)
+
     # put it all together
     consolidated = consolidated.merge(right=counts, right_index=True, left_index=True)
 
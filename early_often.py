@@ -13,97 +13,233 @@ To use:
     ./early_often.py <input file> <web-cat submissions file> <duedates file> <output file> on the command line
 """
 
-from utils import get_term
-from load_datasets import load_submission_data
-
+from utils import get_term, group_columns, ensure_sorted
+from load_datasets import load_submission_data, last_submission_times
+import instrument
+import sketches
+import cache
+import dataset
+import compaction
+import sampling
+import uncertainty
+
+import io
+import os
+import csv
 import sys
 import datetime
 import re
 import json
+import logging
 import pandas as pd
 import numpy as np
 
-def userearlyoften(usergroup, due_date_data, submissions, usercol='userId', lognosubs=False):
+logger = logging.getLogger('sensordata.early_often')
+
+def _median(values, quantiles, compression):
+    """Returns the exact median of values and/or a digest estimating it, as a tuple,
+    depending on the `quantiles` mode (see :mod:`sketches`)."""
+    exact = np.median(values) if quantiles != 'sketch' else None
+    digest = sketches.digest(values, compression=compression) if quantiles != 'exact' else None
+    return exact, digest
+
+def _stretchedsummary(weighted, unweighted, quantiles, compression):
+    """Summarise the relative times (days until the deadline) of edits, where each
+    edit's time is counted once per unit of its weighted size.
+
+    Returns:
+        A tuple of `((exact median, digest), standard deviation)`
     """
-    This function acts on data for one student's sensordata.
-    Generally, it is invoked by earlyoften in a split-apply-combine procedure.
+    weighted = np.asarray(weighted, dtype=np.int64)
+    unweighted = np.asarray(unweighted)
+    keep = weighted > 0
+    relative_times = weighted[keep] / unweighted[keep]
+    counts = weighted[keep]
+
+    exact = None
+    if quantiles != 'sketch':
+        stretched = np.repeat(relative_times, counts)
+        exact = np.median(stretched)
+        sd = np.std(stretched)
+    elif counts.sum() > 0:
+        # weighted, without repeating each time in memory
+        mean = np.average(relative_times, weights=counts)
+        sd = np.sqrt(np.average((relative_times - mean) ** 2, weights=counts))
+    else:
+        sd = np.nan
+
+    digest = None
+    if quantiles != 'exact':
+        digest = sketches.digest(relative_times, counts, compression=compression)
+    return (exact, digest), sd
+
+#: Events that count towards each Early/Often measure. Edits are weighted by their size.
+_EDIT_MEASURES = ['edits_bytes', 'edits_stmts', 'solution_bytes', 'solution_stmts', 'solution_methods',
+                  'test_bytes', 'test_stmts', 'test_methods', 'test_assertions']
+_EVENT_MEASURES = ['launches', 'test_launches', 'normal_launches', 'debug_sessions']
+
+def daycolumn(deadline):
+    """Returns the name of the column holding days until `deadline` (a key in the
+    due dates JSON file, such as `dueTime` or `milestone1`)."""
+    if deadline == 'dueTime':
+        return 'daysToDeadline'
+    return 'daysTo' + deadline[0].upper() + deadline[1:]
+
+def _summarise(sizes, days, quantiles, compression, digests=False):
+    """Compute Early/Often measures against one deadline.
+
+    Args:
+        sizes (dict): Edit sizes for each of :attr:`_EDIT_MEASURES`
+        days (dict): Days until the deadline for each edit or event in each measure
+        digests (bool): Also return each median's serialized digest (see :mod:`sketches`)
+
+    Returns:
+        A *dict* of measures.
+    """
+    weighted = {m: sizes[m] * days[m] for m in _EDIT_MEASURES}
+
+    byte_early_often_index = np.sum(weighted['edits_bytes']) / np.sum(sizes['edits_bytes'])
+    stmt_early_often_index = np.sum(weighted['edits_stmts']) / np.sum(sizes['edits_stmts'])
+    solution_byte_early_often_index = np.sum(weighted['solution_bytes']) / np.sum(sizes['solution_bytes'])
+    solution_stmt_early_often_index = np.sum(weighted['solution_stmts']) / np.sum(sizes['solution_stmts'])
+    solution_meth_early_often_index = np.sum(weighted['solution_methods']) / np.sum(sizes['solution_methods'])
+    test_byte_early_often_index = np.sum(weighted['test_bytes']) / np.sum(sizes['test_bytes'])
+    test_stmt_early_often_index = np.sum(weighted['test_stmts']) / np.sum(sizes['test_stmts'])
+    test_meth_early_often_index = np.sum(weighted['test_methods']) / np.sum(sizes['test_methods'])
+    test_assrt_early_often_index = np.sum(weighted['test_assertions']) / np.sum(sizes['test_assertions'])
+    launch_early_often = np.mean(days['launches'])
+    launch_sd = np.std(days['launches'])
+    test_launch_early_often = np.mean(days['test_launches'])
+    test_launch_sd = np.std(days['test_launches'])
+    normal_launch_early_often = np.mean(days['normal_launches'])
+    normal_launch_sd = np.std(days['normal_launches'])
+    debug_session_early_often = np.mean(days['debug_sessions'])
+    debug_session_sd = np.std(days['debug_sessions'])
+
+    medians = {
+        'launchMedian': _median(days['launches'], quantiles, compression),
+        'testLaunchMedian': _median(days['test_launches'], quantiles, compression),
+        'normalLaunchMedian': _median(days['normal_launches'], quantiles, compression),
+        'debugSessionMedian': _median(days['debug_sessions'], quantiles, compression)
+    }
+    sds = {}
+    stretched = [
+        ('byteEditMedian', 'byteEditSd', 'edits_bytes'),
+        ('solutionByteEditMedian', 'solutionByteEditSd', 'solution_bytes'),
+        ('testByteEditMedian', 'testByteEditSd', 'test_bytes'),
+        ('stmtEditMedian', 'stmtEditSd', 'edits_stmts'),
+        ('assertionsMedian', 'assertionSd', 'test_assertions')
+    ]
+    for mediancol, sdcol, measure in stretched:
+        medians[mediancol], sds[sdcol] = _stretchedsummary(weighted[measure], sizes[measure],
+                                                           quantiles, compression)
+
+    to_write = {
+        'byteEarlyOftenIndex': byte_early_often_index,
+        'byteEditMedian': medians['byteEditMedian'][0],
+        'byteEditSd': sds['byteEditSd'],
+        'stmtEarlyOftenIndex': stmt_early_often_index,
+        'stmtEditMedian': medians['stmtEditMedian'][0],
+        'stmtEditSd': sds['stmtEditSd'],
+        'solutionByteEarlyOftenIndex': solution_byte_early_often_index,
+        'solutionByteEditMedian': medians['solutionByteEditMedian'][0],
+        'solutionByteEditSd': sds['solutionByteEditSd'],
+        'solutionStmtEarlyOftenIndex': solution_stmt_early_often_index,
+        'solutionMethodsEarlyOftenIndex': solution_meth_early_often_index,
+        'testByteEarlyOftenIndex': test_byte_early_often_index,
+        'testByteEditMedian': medians['testByteEditMedian'][0],
+        'testByteEditSd': sds['testByteEditSd'],
+        'testStmtsEarlyOftenIndex': test_stmt_early_often_index,
+        'testMethodsEarlyOftenIndex': test_meth_early_often_index,
+        'assertionsEarlyOftenIndex': test_assrt_early_often_index,
+        'assertionsMedian': medians['assertionsMedian'][0],
+        'assertionSd': sds['assertionSd'],
+        'launchEarlyOften': launch_early_often,
+        'launchMedian': medians['launchMedian'][0],
+        'launchSd': launch_sd,
+        'testLaunchEarlyOften': test_launch_early_often,
+        'testLaunchMedian': medians['testLaunchMedian'][0],
+        'testLaunchSd': test_launch_sd,
+        'normalLaunchEarlyOften': normal_launch_early_often,
+        'normalLaunchMedian': medians['normalLaunchMedian'][0],
+        'normalLaunchSd': normal_launch_sd,
+        'debugSessionEarlyOften': debug_session_early_often,
+        'debugSessionMedian': medians['debugSessionMedian'][0],
+        'debugSessionSd': debug_session_sd
+    }
+
+    for col, (_, digest) in medians.items():
+        estimate = digest.median() if digest is not None else None
+        if quantiles == 'sketch':
+            to_write[col] = estimate
+        elif quantiles == 'validate':
+            to_write[col + 'Sketch'] = estimate
+        if digests and digest is not None:
+            to_write[col + sketches.DIGEST_SUFFIX] = sketches.dumps(digest)
+
+    return to_write
+
+def userrecords(usergroup, due_date_data, submissions, usercol='userId', lognosubs=False,
+                name=None, deadlines=None):
+    """
+    Collect the edits and events that count towards each Early/Often measure for one
+    student's work on one project: the size of each edit, and the days until each
+    deadline of each edit or event. These are summarised by :meth:`userearlyoften`,
+    and resampled by :mod:`uncertainty`.
 
     Args:
         usergroup (DataFrame): Event stream for a student working on a single project
-        due_date_data (dict): Dictionary containing due dates in millisecond timestamps 
+        due_date_data (dict): Dictionary containing due dates in millisecond timestamps
         submissions (DataFrame): Last submission from each student
         usercol (str): Name of the column identifying the user (default "userId")
         lognosubs (bool): Print a message for users for whom submissions were not found?
+        name (tuple, optional): (user, assignment) for the group. Defaults to
+                                `usergroup.name`.
+        deadlines (list, optional): Keys in `due_date_data` to measure against.
+                                    Defaults to `['dueTime']`.
 
     Returns:
-        A *DataFrame* containing the early often measurements for the user on a given assignment.
+        A tuple `(sizes, days)`: *dicts* mapping each of :attr:`_EDIT_MEASURES` to an
+        array of edit sizes, and each of those and :attr:`_EVENT_MEASURES` to an array
+        with a row for each edit or event and a column for each deadline. *None* if the
+        student made no final submission.
+
+    Raises:
+        ValueError: If a deadline for the project is missing from `due_date_data`.
     """
-    prev_row = None
-    total_weighted_edits_bytes = []
-    total_edits_bytes = []
-    total_weighted_edits_stmts = []
-    total_edits_stmts = []
-    total_weighted_solution_bytes = []
-    total_solution_bytes = []
-    total_weighted_solution_stmts = []
-    total_solution_stmts = []
-    total_weighted_test_bytes = []
-    total_test_bytes = []
-    total_weighted_test_stmts = []
-    total_test_stmts = []
-    total_weighted_solution_methods = []
-    total_solution_methods = []
-    total_weighted_test_methods = []
-    total_test_methods = []
-    total_weighted_launches = []
-    total_weighted_test_launches = []
-    total_weighted_normal_launches = []
-    total_test_assertions = []
-    total_weighted_test_assertions = []
-    total_weighted_debug_sessions = []
+    deadlines = deadlines or ['dueTime']
+    sizes = {m: [] for m in _EDIT_MEASURES}
+    days = {m: [] for m in _EDIT_MEASURES + _EVENT_MEASURES}
 
     curr_sizes_bytes = {}
     curr_sizes_stmts = {}
     curr_sizes_methods = {}
     curr_test_assertions = {} # for each file
 
-    user_id, assignment = usergroup.name # returns a tuple
-
-    # get the term and assignment due date
-    first = usergroup.iloc[0]
-    first_time = first['time']
-    epoch = datetime.datetime.utcfromtimestamp(0) # seconds
-    first_time = (first_time - epoch).total_seconds()
-        
-    term = get_term(first_time)
-    assignment_number = int(re.search(r'\d', assignment).group())
+    user_id, assignment = name if name is not None else usergroup.name # returns a tuple
 
-    due_time = due_date_data[term]['assignment%d' % (assignment_number)]['dueTime']
-    due_time = int(due_time)
-    due_date = datetime.date.fromtimestamp(due_time / 1000)
+    if any(daycolumn(d) not in usergroup.columns for d in deadlines + ['dueTime']):
+        # due dates and final submissions were not resolved up front by earlyoften
+        table = deadlinetable([user_id], [assignment], [usergroup['time'].iloc[0]],
+                              due_date_data, submissions, usercol=usercol, deadlines=deadlines)
+        usergroup = withdeadlines(usergroup, table, usercol=None, keys=deadlines)
+    if 'deadlineError' in usergroup.columns and usergroup['deadlineError'].iloc[0]:
+        # left unresolved by deadlinetable(errors='coerce')
+        raise ValueError(usergroup['deadlineError'].iloc[0])
 
-    if usercol == 'email':
-        user_id = user_id.split('@')[0]
-    
-    try:
-        lastsubmissiontime = submissions.loc[user_id, 'Project {}'.format(assignment_number)]['submissionTimeRaw']
-    except KeyError:
+    if usergroup['lastSubmissionTime'].isnull().all():
         # Either the user or the assignment is not present in the submission list.
-        # Extract the information manually.
         if lognosubs:
-            print('Cannot find final submission for {} on Project {}'.format(user_id, assignment_number))
+            print('Cannot find final submission for {} on {}'.format(user_id, assignment))
         return None
 
-    for index, row in usergroup.iterrows():
-        prev_row = row if prev_row is None else prev_row
-    
-        time = row['time']
-        date = time.date()
-        days_to_deadline = (due_date - date).days
+    usergroup = usergroup[~usergroup['pastCutoff']]
+    # days until each deadline, for every event: measured against all deadlines in one pass
+    eventdays = usergroup[[daycolumn(d) for d in deadlines]].values.astype(np.int64)
+    compacted = compaction.CHANGED['Current-Size'] in usergroup.columns
 
-        if time > lastsubmissiontime or days_to_deadline < -4:
-            prev_row = row
-            continue
+    for position, (index, row) in enumerate(usergroup.iterrows()):
+        days_to_deadlines = eventdays[position]
 
         if repr(row['Type']) == repr('Edit') and len(row['Class-Name']) > 0:
             class_name = repr(row['Class-Name'])
@@ -126,182 +262,436 @@ def userearlyoften(usergroup, due_date_data, submissions, usercol='userId', logn
                 assertion_change_size = abs(prev_assertions - curr_assertions)
                 curr_test_assertions[class_name] = curr_assertions
 
+            if compacted and compaction.recorded(row, 'Current-Size') is not None:
+                # a run of edits merged by compaction.compact: use the changes over the whole run
+                byte_edit_size, stmt_edit_size, method_edit_size, assertion_change_size = \
+                    [compaction.recorded(row, column) for column in compaction.CHANGED]
+
             on_test_case = int(row['onTestCase']) == 1
 
-            if byte_edit_size > 0:
-                total_weighted_edits_bytes.append(byte_edit_size * days_to_deadline)
-                total_edits_bytes.append(byte_edit_size)
-
-                if on_test_case:
-                    total_weighted_test_bytes.append(byte_edit_size * days_to_deadline)
-                    total_test_bytes.append(byte_edit_size)
-                else:
-                    total_weighted_solution_bytes.append(byte_edit_size * days_to_deadline)
-                    total_solution_bytes.append(byte_edit_size)
-
-            if stmt_edit_size > 0:
-                total_weighted_edits_stmts.append(stmt_edit_size * days_to_deadline)
-                total_edits_stmts.append(stmt_edit_size)
-
-                if on_test_case:
-                    total_weighted_test_stmts.append(stmt_edit_size * days_to_deadline)
-                    total_test_stmts.append(stmt_edit_size)
-                else:
-                    total_weighted_solution_stmts.append(stmt_edit_size * days_to_deadline)
-                    total_solution_stmts.append(stmt_edit_size)
-
-            if method_edit_size > 0:
-                if on_test_case:
-                    total_weighted_test_methods.append(method_edit_size * days_to_deadline)
-                    total_test_methods.append(method_edit_size)
-                else:
-                    total_weighted_solution_methods.append(method_edit_size * days_to_deadline)
-                    total_solution_methods.append(method_edit_size)
-
-            if assertion_change_size > 0:
-                total_weighted_test_assertions.append(assertion_change_size * days_to_deadline)
-                total_test_assertions.append(assertion_change_size)
+            changes = [
+                (byte_edit_size, ['edits_bytes', 'test_bytes' if on_test_case else 'solution_bytes']),
+                (stmt_edit_size, ['edits_stmts', 'test_stmts' if on_test_case else 'solution_stmts']),
+                (method_edit_size, ['test_methods' if on_test_case else 'solution_methods']),
+                (assertion_change_size, ['test_assertions'])
+            ]
+            for size, measures in changes:
+                if size > 0:
+                    for measure in measures:
+                        sizes[measure].append(size)
+                        days[measure].append(days_to_deadlines)
 
             curr_sizes_stmts[class_name] = curr_stmts
             curr_sizes_methods[class_name] = curr_methods
             curr_sizes_bytes[class_name] = curr_bytes
         elif (repr(row['Type']) == repr('Launch')):
-            total_weighted_launches.append(days_to_deadline)
+            days['launches'].append(days_to_deadlines)
 
             if (repr(row['Subtype']) == repr('Test')):
-                total_weighted_test_launches.append(days_to_deadline)
+                days['test_launches'].append(days_to_deadlines)
             elif (repr(row['Subtype']) == repr('Normal')):
-                total_weighted_normal_launches.append(days_to_deadline)
+                days['normal_launches'].append(days_to_deadlines)
         elif (repr(row['Type']) == repr('DebugSession')):
             length = float(row['length'])
             if length > 30:
-                total_weighted_debug_sessions.append(days_to_deadline)
-
-        prev_row = row
-
-    byte_early_often_index = np.sum(total_weighted_edits_bytes) / np.sum(total_edits_bytes)
-    stmt_early_often_index = np.sum(total_weighted_edits_stmts) / np.sum(total_edits_stmts)
-    solution_byte_early_often_index = np.sum(total_weighted_solution_bytes) / np.sum(total_solution_bytes)
-    solution_stmt_early_often_index = np.sum(total_weighted_solution_stmts) / np.sum(total_solution_stmts)
-    solution_meth_early_often_index = np.sum(total_weighted_solution_methods) / np.sum(total_solution_methods)
-    test_byte_early_often_index = np.sum(total_weighted_test_bytes) / np.sum(total_test_bytes)
-    test_stmt_early_often_index = np.sum(total_weighted_test_stmts) / np.sum(total_test_stmts)
-    test_meth_early_often_index = np.sum(total_weighted_test_methods) / np.sum(total_test_methods)
-    test_assrt_early_often_index = np.sum(total_weighted_test_assertions) / np.sum(total_test_assertions)
-    launch_early_often = np.mean(total_weighted_launches)
-    launch_median = np.median(total_weighted_launches)
-    launch_sd = np.std(total_weighted_launches)
-    test_launch_early_often = np.mean(total_weighted_test_launches)
-    test_launch_median = np.median(total_weighted_test_launches)
-    test_launch_sd = np.std(total_weighted_test_launches)
-    normal_launch_early_often = np.mean(total_weighted_normal_launches)
-    normal_launch_median = np.median(total_weighted_normal_launches)
-    normal_launch_sd = np.std(total_weighted_normal_launches)
-    debug_session_early_often = np.mean(total_weighted_debug_sessions)
-    debug_session_median = np.median(total_weighted_debug_sessions)
-    debug_session_sd = np.std(total_weighted_debug_sessions)
-
-    stretched_bytes = []
-    for weighted, unweighted in zip(total_weighted_edits_bytes, total_edits_bytes):
-        relative_time = weighted / unweighted
-        for i in range(weighted):
-            stretched_bytes.append(relative_time)
-
-    byte_edit_median = np.median(stretched_bytes)
-    byte_edit_sd = np.std(stretched_bytes)
-
-    stretched_solution_bytes = []
-    for weighted, unweighted in zip(total_weighted_solution_bytes, total_solution_bytes):
-        relative_time = weighted / unweighted
-        for i in range(weighted):
-            stretched_solution_bytes.append(relative_time)
-
-    solution_byte_edit_median = np.median(stretched_solution_bytes)
-    solution_byte_edit_sd = np.std(stretched_solution_bytes)
-
-    stretched_test_bytes = []
-    for weighted, unweighted in zip(total_weighted_test_bytes, total_test_bytes):
-        relative_time = weighted / unweighted
-        for i in range(weighted):
-            stretched_test_bytes.append(relative_time)
-
-    test_byte_edit_median = np.median(stretched_test_bytes)
-    test_byte_edit_sd = np.std(stretched_test_bytes)
-
-    stretched_stmts = []
-    for weighted, unweighted in zip(total_weighted_edits_stmts, total_edits_stmts):
-        relative_time = weighted / unweighted
-        for i in range(weighted):
-            stretched_stmts.append(relative_time)
-
-    stmt_edit_median = np.median(stretched_stmts)
-    stmt_edit_sd = np.std(stretched_stmts)
-
-    stretched_assertions = []
-    for weighted, unweighted in zip(total_weighted_test_assertions, total_test_assertions):
-        relative_time = weighted / unweighted
-        for i in range(weighted):
-            stretched_assertions.append(relative_time)
-
-    test_assertion_median = np.median(stretched_assertions)
-    test_assertion_sd = np.std(stretched_assertions)
+                days['debug_sessions'].append(days_to_deadlines)
 
-    to_write = {
-        'byteEarlyOftenIndex': byte_early_often_index,
-        'byteEditMedian': byte_edit_median,
-        'byteEditSd': byte_edit_sd,
-        'stmtEarlyOftenIndex': stmt_early_often_index,
-        'stmtEditMedian': stmt_edit_median,
-        'stmtEditSd': stmt_edit_sd,
-        'solutionByteEarlyOftenIndex': solution_byte_early_often_index,
-        'solutionByteEditMedian': solution_byte_edit_median,
-        'solutionByteEditSd': solution_byte_edit_sd,
-        'solutionStmtEarlyOftenIndex': solution_stmt_early_often_index,
-        'solutionMethodsEarlyOftenIndex': solution_meth_early_often_index,
-        'testByteEarlyOftenIndex': test_byte_early_often_index,
-        'testByteEditMedian': test_byte_edit_median,
-        'testByteEditSd': test_byte_edit_sd,
-        'testStmtsEarlyOftenIndex': test_stmt_early_often_index,
-        'testMethodsEarlyOftenIndex': test_meth_early_often_index,
-        'assertionsEarlyOftenIndex': test_assrt_early_often_index,
-        'assertionsMedian': test_assertion_median,
-        'assertionSd': test_assertion_sd,
-        'launchEarlyOften': launch_early_often,
-        'launchMedian': launch_median,
-        'launchSd': launch_sd,
-        'testLaunchEarlyOften': test_launch_early_often,
-        'testLaunchMedian': test_launch_median,
-        'testLaunchSd': test_launch_sd,
-        'normalLaunchEarlyOften': normal_launch_early_often,
-        'normalLaunchMedian': normal_launch_median,
-        'normalLaunchSd': normal_launch_sd,
-        'debugSessionEarlyOften': debug_session_early_often,
-        'debugSessionMedian': debug_session_median,
-        'debugSessionSd': debug_session_sd
-    }
+    sizes = {m: np.array(v, dtype=np.int64) for m, v in sizes.items()}
+    days = {m: np.array(v, dtype=np.int64).reshape(-1, len(deadlines)) for m, v in days.items()}
+    return sizes, days
+
+def userearlyoften(usergroup, due_date_data, submissions, usercol='userId', lognosubs=False,
+                   quantiles='exact', compression=100, name=None, deadlines=None, digests=False):
+    """
+    This function acts on data for one student's sensordata.
+    Generally, it is invoked by earlyoften in a split-apply-combine procedure.
+
+    Args:
+        usergroup (DataFrame): Event stream for a student working on a single project
+        due_date_data (dict): Dictionary containing due dates in millisecond timestamps 
+        submissions (DataFrame): Last submission from each student
+        usercol (str): Name of the column identifying the user (default "userId")
+        lognosubs (bool): Print a message for users for whom submissions were not found?
+        quantiles (str): How medians are computed; one of :attr:`sketches.QUANTILE_MODES`
+        compression (float): Accuracy of the sketches used if `quantiles` is not `exact`
+        name (tuple, optional): (user, assignment) for the group. Defaults to
+                                `usergroup.name`, which is set by `groupby().apply`.
+        deadlines (list, optional): Keys in `due_date_data` to measure against, such as
+            `['milestone1', 'dueTime']`. Defaults to `['dueTime']`. Measures against
+            `dueTime` keep their usual names; others are prefixed with the key
+            (e.g., `milestone1_byteEarlyOftenIndex`).
+        digests (bool): Also give each sketched median's serialized digest, in a column
+            suffixed with :attr:`sketches.DIGEST_SUFFIX`
+
+    Returns:
+        A *DataFrame* containing the early often measurements for the user on a given assignment.
+    """
+    deadlines = deadlines or ['dueTime']
+    records = userrecords(usergroup, due_date_data, submissions, usercol=usercol,
+                          lognosubs=lognosubs, name=name, deadlines=deadlines)
+    if records is None:
+        return None
+    return summariserecords(records, deadlines=deadlines, quantiles=quantiles, compression=compression,
+                            digests=digests)
+
+def summariserecords(records, deadlines=None, quantiles='exact', compression=100, digests=False):
+    """Early/Often measures from the records collected by :meth:`userrecords`, as
+    :meth:`userearlyoften` gives them. For callers that need the records themselves
+    too, such as :meth:`earlyoften` for confidence intervals.
+
+    Args:
+        records (tuple): `(sizes, days)`, as returned by :meth:`userrecords`
+        deadlines (list, optional): The deadlines the records were collected for.
+                                    Defaults to `['dueTime']`.
+        quantiles (str): How medians are computed; one of :attr:`sketches.QUANTILE_MODES`
+        compression (float): Accuracy of the sketches used if `quantiles` is not `exact`
+        digests (bool): Also give each sketched median's serialized digest
+
+    Returns:
+        A *Series* of measures, named as by :meth:`userearlyoften`.
+    """
+    deadlines = deadlines or ['dueTime']
+    sizes, days = records
+
+    to_write = {}
+    for k, deadline in enumerate(deadlines):
+        prefix = '' if deadline == 'dueTime' else deadline + '_'
+        measures = _summarise(sizes, {m: v[:, k] for m, v in days.items()}, quantiles, compression,
+                              digests=digests)
+        for col, value in measures.items():
+            to_write[prefix + col] = value
 
     return pd.Series(to_write)
 
-def earlyoften(infile, submissionpath, duetimepath, outfile=None, dtypes=None, date_parser=None):
+def _duedate(due_date_data, term, number, key):
+    """The day of one deadline of an assignment, from the due dates file."""
+    try:
+        due_time = int(due_date_data[term]['assignment%d' % (number)][key])
+    except KeyError:
+        raise ValueError('No {} for assignment{} in {}'.format(key, number, term))
+    return pd.Timestamp(datetime.date.fromtimestamp(due_time / 1000))
+
+def deadlinetable(users, assignments, firsttimes, due_date_data, submissions, usercol='userId',
+                  deadlines=None, errors='raise'):
+    """Resolve the due date and final submission time for each student-project, once,
+    so that they don't need to be looked up inside every group.
+
+    The term is determined from the time of the student's first event on the project,
+    and the assignment number from the first digit in the assignment name.
+
+    Args:
+        users (list): User identifiers, one per student-project
+        assignments (list): Assignment names, one per student-project
+        firsttimes (list): Time (datetime) of the first event for each student-project
+        due_date_data (dict): Dictionary containing due dates in millisecond timestamps
+        submissions (DataFrame): Last submission from each student. If *None*, no
+                                 submissions are looked up (e.g., mid-project).
+        usercol (str): Name of the column identifying the user. If `email`, domains
+                       are removed before looking up submissions.
+        deadlines (list, optional): Other keys in `due_date_data` (such as `milestone1`)
+                                    to resolve besides `dueTime`
+        errors (str): `raise` to raise a *ValueError* if a deadline is missing from
+            `due_date_data`, or `coerce` to leave that student-project's dates *NaT*
+            and describe the problem in a `deadlineError` column, so that only the
+            student-projects concerned fail (see :meth:`userrecords`)
+
+    Returns:
+        A *DataFrame* indexed by (user, assignment), with columns `dueDate` and
+        `lastSubmissionTime` (*NaT* if no submission was found), a `<key>Date`
+        column for each other deadline, and with `errors='coerce'`, `deadlineError`
+        (empty where every deadline was found).
+    """
+    if errors not in ('raise', 'coerce'):
+        raise ValueError("errors must be 'raise' or 'coerce'. Got {}.".format(errors))
+    epoch = datetime.datetime.utcfromtimestamp(0) # seconds
+    terms = [get_term((pd.Timestamp(t) - epoch).total_seconds()) for t in firsttimes]
+    numbers = [int(re.search(r'\d', a).group()) for a in assignments]
+
+    keys = ['dueTime'] + [d for d in (deadlines or []) if d != 'dueTime']
+    duedates = {}
+    unresolved = {} # the first missing deadline for each (term, number)
+    for term, number in set(zip(terms, numbers)):
+        for key in keys:
+            try:
+                duedates[(term, number, key)] = _duedate(due_date_data, term, number, key)
+            except ValueError as e:
+                if errors == 'raise':
+                    raise
+                logger.warning('%s: its student-projects cannot be measured', e)
+                duedates[(term, number, key)] = pd.NaT
+                unresolved.setdefault((term, number), str(e))
+
+    if submissions is None:
+        lastsubtimes = [pd.NaT] * len(users)
+    else:
+        lastsubtimes = last_submission_times(submissions, users, assignments, usercol=usercol)
+
+    table = pd.DataFrame({
+        'dueDate': [duedates[(term, number, 'dueTime')] for term, number in zip(terms, numbers)],
+        'lastSubmissionTime': lastsubtimes
+    }, index=pd.MultiIndex.from_arrays([users, assignments]))
+    for key in keys[1:]:
+        table[key + 'Date'] = [duedates[(term, number, key)] for term, number in zip(terms, numbers)]
+    if errors == 'coerce':
+        table['deadlineError'] = [unresolved.get((term, number), '') for term, number in zip(terms, numbers)]
+    return table
+
+def withdeadlines(df, deadlines, usercol='userId', assignmentcol='CASSIGNMENTNAME', keys=None):
+    """Join the table from :meth:`deadlinetable` onto events, and mark the events
+    that fall after the cutoff for Early/Often measures (after the final submission,
+    or more than 4 days after the due date) in a vectorised pass.
+
+    Args:
+        df (DataFrame): Events, with `time` parsed as datetimes
+        deadlines (DataFrame): As returned by :meth:`deadlinetable`
+        usercol (str): The user column in `df`. If *None*, `df` holds events for a
+                       single student-project and `deadlines` has a single row.
+        keys (list, optional): Other deadlines resolved by :meth:`deadlinetable`, for
+                               which days until the deadline are also computed
+
+    Returns:
+        The events with `dueDate`, `lastSubmissionTime`, `daysToDeadline` and
+        `pastCutoff` columns, and a :meth:`daycolumn` for each other deadline. The
+        cutoff always follows `dueDate`, so the same events are measured against
+        every deadline.
+    """
+    if usercol is None:
+        df = df.assign(**{col: deadlines[col].iloc[0] for col in deadlines.columns})
+    else:
+        df = df.join(deadlines, on=[usercol, assignmentcol])
+
+    day = df['time'].dt.normalize()
+    df['daysToDeadline'] = (df['dueDate'] - day).dt.days
+    for key in keys or []:
+        if key != 'dueTime':
+            df[daycolumn(key)] = (df[key + 'Date'] - day).dt.days
+    df['pastCutoff'] = (df['time'] > df['lastSubmissionTime']) | (df['daysToDeadline'] < -4)
+    return df
+
+def groupprojects(df, due_date_data, submissions, deadlines=None):
+    """Group events by student-project, with deadlines and final submissions resolved
+    up front (see :meth:`deadlinetable` and :meth:`withdeadlines`), ready for
+    `apply(userearlyoften, ...)`.
+
+    Args:
+        df (DataFrame): Events, with `time` parsed as datetimes and missing values as
+                        empty strings (as :meth:`earlyoften` reads them)
+        due_date_data (dict): Dictionary containing due dates in millisecond timestamps
+        submissions (DataFrame): Last submission from each student
+        deadlines (list, optional): Keys in `due_date_data` to measure against.
+                                    Defaults to `['dueTime']`.
+
+    Returns:
+        A tuple `(grouped, usercol)`: the grouped events, in order, and the name of
+        the column identifying users.
+    """
+    deadlines = list(deadlines or ['dueTime'])
+    usercol, assignmentcol = group_columns(df.columns)
+    # one stable sort (skipped if the file is already in this order), after which
+    # groups are contiguous and in order, so groupby need not sort again
+    df = ensure_sorted(df, [usercol, assignmentcol, 'time'])
+    firsts = df.groupby([usercol, assignmentcol], sort=False)['time'].first()
+    # missing deadlines fail only the student-projects they belong to, in userrecords
+    table = deadlinetable(firsts.index.get_level_values(0), firsts.index.get_level_values(1),
+                          firsts.values, due_date_data, submissions, usercol=usercol,
+                          deadlines=deadlines, errors='coerce')
+    df = withdeadlines(df, table, usercol=usercol, assignmentcol=assignmentcol, keys=deadlines)
+    return df.groupby([usercol, assignmentcol], sort=False), usercol
+
+#: Number of finished student-projects written to a checkpoint at a time
+CHECKPOINT_BATCH = 100
+
+def _appendrows(path, header, rows):
+    """Append rows to a CSV file in one write, and make sure they reach the disk.
+    A header is written first if the file is new."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        writer.writerow(header)
+    writer.writerows(rows)
+    with open(path, 'a', newline='') as outfile:
+        outfile.write(buffer.getvalue())
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+def _truncatetorn(path):
+    """Drop a partly written last line, left behind if a run died mid-write."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+def _checkpointed(grouped, checkpoint, signature, batch_size=CHECKPOINT_BATCH, measure=userearlyoften,
+                  **kwargs):
+    """Apply :meth:`userearlyoften` (or `measure`) to each student-project, appending
+    finished results to files in the `checkpoint` directory every `batch_size` groups.
+
+    Groups that raise are logged (and listed in `failed.csv`) instead of aborting the
+    run. Groups already recorded in `finished.csv` by an earlier, interrupted run are
+    not computed again; failed groups are retried, and `failed.csv` lists only the
+    groups that failed in the latest run.
+
+    Args:
+        grouped (DataFrameGroupBy): Events grouped by user and assignment
+        checkpoint (str): Directory for partial output
+        signature (dict): Describes the inputs and options of the run. Resuming a
+                          checkpoint made with a different signature is an error.
+        batch_size (int): Number of finished groups to write at a time
+        measure (callable): Called as `measure(group, name=key, **kwargs)` for each group
+        **kwargs: Passed to `measure`
+
+    Returns:
+        A *DataFrame* like the one `grouped.apply(userearlyoften)` would return.
+    """
+    usercol, assignmentcol = grouped.keys
+    os.makedirs(checkpoint, exist_ok=True)
+    statepath = os.path.join(checkpoint, 'checkpoint.json')
+    partialpath = os.path.join(checkpoint, 'partial.csv')
+    finishedpath = os.path.join(checkpoint, 'finished.csv')
+    failedpath = os.path.join(checkpoint, 'failed.csv')
+
+    if os.path.exists(statepath):
+        with open(statepath) as infile:
+            if json.load(infile) != signature:
+                raise ValueError('Checkpoint {} was made from different inputs or options. '
+                                 'Remove it to start over.'.format(checkpoint))
+    else:
+        with open(statepath + '.tmp', 'w') as outfile:
+            json.dump(signature, outfile)
+        os.replace(statepath + '.tmp', statepath)
+
+    for path in (partialpath, finishedpath):
+        _truncatetorn(path)
+    # earlier failures are all retried, so failed.csv only lists this run's
+    if os.path.exists(failedpath):
+        os.remove(failedpath)
+
+    finished = set()
+    if os.path.exists(finishedpath):
+        previous = pd.read_csv(finishedpath, dtype=str, keep_default_na=False)
+        finished = set(zip(previous[usercol], previous[assignmentcol]))
+        logger.info('Resuming from %s: %d student-projects already finished', checkpoint, len(finished))
+
+    header = None
+    if os.path.exists(partialpath) and os.path.getsize(partialpath) > 0:
+        header = list(pd.read_csv(partialpath, nrows=0).columns)
+
+    order = []
+    results, done, failures = [], [], []
+
+    def flush():
+        nonlocal header
+        if results:
+            if header is None:
+                header = [usercol, assignmentcol] + list(results[0][1].index)
+            rows = [list(key) + ['' if v is None or pd.isnull(v) else v if isinstance(v, str) else float(v)
+                                 for v in series.reindex(header[2:]).values]
+                    for key, series in results]
+            _appendrows(partialpath, header, rows)
+        # results are durable before their groups are marked finished
+        if done:
+            _appendrows(finishedpath, [usercol, assignmentcol, 'status'], done)
+        if failures:
+            _appendrows(failedpath, [usercol, assignmentcol, 'error'], failures)
+        del results[:], done[:], failures[:]
+
+    nfailed = 0
+    try:
+        for key, group in grouped:
+            order.append(key)
+            if (str(key[0]), str(key[1])) in finished:
+                continue
+            try:
+                result = measure(group, name=key, **kwargs)
+            except Exception as e:
+                nfailed += 1
+                logger.warning('Skipping %s on %s: %s: %s', key[0], key[1], type(e).__name__, e)
+                failures.append(list(key) + ['{}: {}'.format(type(e).__name__, e)])
+                continue
+            if result is None:
+                done.append(list(key) + ['nosubmission'])
+            else:
+                results.append((key, result))
+                done.append(list(key) + ['ok'])
+            if len(done) >= batch_size:
+                flush()
+    finally:
+        flush()
+
+    if nfailed:
+        logger.warning('%d student-projects failed; see %s', nfailed, failedpath)
+
+    if header is None:
+        return pd.DataFrame()
+    partial = pd.read_csv(partialpath, dtype={usercol: str, assignmentcol: str}) \
+                .drop_duplicates([usercol, assignmentcol], keep='last') \
+                .set_index([usercol, assignmentcol])
+    order = [key for key in order if key in partial.index]
+    return partial.reindex(pd.MultiIndex.from_tuples(order, names=[usercol, assignmentcol]))
+
+@instrument.instrumented('earlyoften')
+def earlyoften(infile, submissionpath, duetimepath, outfile=None, dtypes=None, date_parser=None,
+               quantiles='exact', compression=100, checkpoint=None, batch_size=CHECKPOINT_BATCH,
+               deadlines=None, terms=None, assignments=None, sample=None, replicates=None,
+               confidence=0.95, processes=None, digests=False):
     """Calculate Early/Often indices for developers based on IDE events.
     Early/Often refers to the mean time of a certain type of event, in terms of
     "days until the deadline". Applying the same concept, we also calculate
     medians and standard deviations.
     
     Args:
-        infile (str): Path to a file containing raw SensorData
+        infile (str): Path to a file containing raw SensorData, or to a partitioned
+            dataset of SensorData (see :mod:`dataset`). Either may have been compacted
+            (see :mod:`compaction`).
         outfile (str, optional): Path to a file where combined early often metrics should be written (optional). 
             If *None*, output is written to a Pandas DataFrame.
         submissionpath (str): Path to Web-CAT submissions. Used only to determine the time of the final submission.
         duetimepath (str): Path to a JSON file containing due date data for assignments in different terms.
         dtypes (dict, optional, no-CLI): Column data types (also only reads the specified columns)
         date_parser (func, optional, no-CLI): A function or lambda to parse timestamps.
+        quantiles (str, optional, no-CLI): How medians are computed; one of
+            :attr:`sketches.QUANTILE_MODES`. Defaults to `exact`.
+        compression (float, optional, no-CLI): Accuracy of quantile sketches
+        checkpoint (str, optional): A directory for partial results. If given, results
+            are saved every `batch_size` student-projects, student-projects that raise
+            are logged and skipped rather than ending the run, and running again with
+            the same inputs resumes where the last run stopped.
+        batch_size (int, optional, no-CLI): Student-projects per checkpoint write
+        deadlines (list, optional): Keys in the due dates file to measure against, such
+            as `['milestone1', 'milestone2', 'milestone3', 'earlyBonus', 'dueTime']`.
+            All are measured in the same pass over each student's events, giving one
+            block of columns per deadline (see :meth:`userearlyoften`). Defaults to
+            `['dueTime']`.
+        terms (list, optional): If `infile` is a partitioned dataset, only read these terms
+        assignments (list, optional): If `infile` is a partitioned dataset, only read
+            these assignments
+        sample (float, optional): Only measure this fraction of users, picked by a
+            stable hash of their names (see :meth:`sampling.insample`), for quick
+            estimates (see :meth:`sampling.bootstrap`). A *ValueError* is raised if
+            the sample includes none of the users.
+        replicates (int, optional): If given, add bootstrap confidence intervals for
+            each student's indices from this many replicates, as `<index>_ci_low` and
+            `<index>_ci_high` columns (see :mod:`uncertainty`). The records the indices
+            are computed from are kept in memory for this, rather than collected again. Unlike the indices,
+            intervals are not the same for compacted sensordata (see :mod:`compaction`),
+            where each merged run of edits is resampled as one record.
+        confidence (float, optional): Confidence level of the intervals
+        processes (int, optional): Worker processes for the intervals. Defaults to
+            the number of CPUs.
+        digests (bool, optional): Keep the digest behind each sketched median, serialized
+            in a column suffixed with :attr:`sketches.DIGEST_SUFFIX`, so that it can be
+            merged with others (see :mod:`sketches`). Needs `quantiles` other than `exact`.
 
     Returns:
         A *DataFrame* if no *outfile* is specified. *None* otherwise.
     """
-    submissions = load_submission_data(submissionpath)
-    print('0. Finished reading submission data.')
+    sketches.check_mode(quantiles, digests)
+    deadlines = list(deadlines or ['dueTime'])
+    with instrument.stage('earlyoften.load_submissions') as stage:
+        submissions = load_submission_data(submissionpath)
+        stage.rows_out = len(submissions)
 
     # Import event stream for all students 
     if not dtypes:
@@ -326,37 +716,98 @@ def earlyoften(infile, submissionpath, duetimepath, outfile=None, dtypes=None, d
     if not date_parser:
         # assume timestamps are in milliseconds since the epoch unless specified
         date_parser = lambda d: datetime.datetime.fromtimestamp(int(d) / 1000)
-    df = pd.read_csv(infile, dtype=dtypes, na_values=[], low_memory=False, usecols=list(dtypes.keys()), 
-            date_parser=date_parser, parse_dates=['time']) \
-            .sort_values(by=['time'], ascending=[1]) \
-            .fillna('')
-    print('1. Finished reading raw sensordata.')
-    
-    # Group data by student and project 
-    if 'userId' in df.columns:
-        user_id = 'userId'
-    elif 'email' in df.columns:
-        user_id = 'email' 
-    else:
-        user_id = 'userName'
-
-    assignmentcol = 'assignment'
-    if 'cleaned_assignment' in df.columns:
-        assignmentcol = 'cleaned_assignment'
-    elif 'CASSIGNMENTNAME' in df.columns:
-        assignmentcol = 'CASSIGNMENTNAME'
+    # edits merged by compaction.compact carry the changes they stand for
+    changed = [column for column in compaction.CHANGED.values() if column not in dtypes]
+    with instrument.stage('earlyoften.read_sensordata') as stage:
+        if dataset.isdataset(infile):
+            # only the partitions for the requested terms and assignments are opened
+            df = dataset.read(infile, terms=terms, assignments=assignments,
+                              columns=list(dtypes.keys()) + changed)
+            df['time'] = pd.to_datetime(df['time'].map(date_parser))
+        elif terms or assignments:
+            raise ValueError('terms and assignments can only be used with a partitioned dataset')
+        else:
+            header = pd.read_csv(infile, nrows=0).columns
+            changed = [column for column in changed if column in header]
+            df = pd.read_csv(infile, dtype=dict(dtypes, **{column: object for column in changed}),
+                    na_values=[], low_memory=False, usecols=list(dtypes.keys()) + changed,
+                    date_parser=date_parser, parse_dates=['time']) \
+                    .fillna('')
+        stage.rows_out = len(df)
+
+    if not len(df):
+        # e.g., a shard that no users hashed to (see shards.runshard)
+        logger.warning('No events in %s', infile)
+        results = pd.DataFrame()
+        if outfile:
+            results.to_csv(outfile)
+            return
+        return results
 
-    grouped = df.groupby([user_id, assignmentcol])
-    print('2. Finished grouping data. Calculating measures now. This could take some time...')
+    if sample is not None:
+        with instrument.stage('earlyoften.sample', rows_in=len(df)) as stage:
+            users = df[group_columns(df.columns)[0]]
+            df = df[sampling.insample(users, sample)]
+            stage.rows_out = len(df)
+        if not len(df):
+            raise ValueError('A sample of {} selects none of the {} users in {}. Sample a larger fraction.'
+                             .format(sample, users.nunique(), infile))
     
+    # Group data by student and project 
     due_date_data = None
     with open(duetimepath) as data_file:
         due_date_data = json.load(data_file)
 
-    results = grouped.apply(userearlyoften, 
-                due_date_data=due_date_data, 
-                submissions=submissions, 
-                usercol=user_id)
+    with instrument.stage('earlyoften.group', rows_in=len(df)) as stage:
+        grouped, user_id = groupprojects(df, due_date_data, submissions, deadlines=deadlines)
+        stage.rows_out = grouped.ngroups
+
+    kept = {} # the records behind each student-project's indices, if intervals are wanted
+
+    def measure(usergroup, name=None):
+        name = name if name is not None else usergroup.name
+        records = userrecords(usergroup, due_date_data, submissions, usercol=user_id, name=name,
+                              deadlines=deadlines)
+        if records is None:
+            return None
+        if replicates:
+            kept[name] = records
+        return summariserecords(records, deadlines=deadlines, quantiles=quantiles,
+                                compression=compression, digests=digests)
+
+    with instrument.stage('earlyoften.compute', rows_in=len(df)) as stage:
+        if checkpoint:
+            signature = {
+                'sensordata': cache.fingerprint(infile),
+                'submissions': cache.fingerprint(submissionpath),
+                'duetimes': cache.fingerprint(duetimepath),
+                'quantiles': quantiles,
+                'compression': compression,
+                'deadlines': deadlines,
+                'sample': sample,
+                'digests': digests
+            }
+            results = _checkpointed(grouped, checkpoint, signature, batch_size=batch_size,
+                                    measure=measure)
+        else:
+            results = grouped.apply(measure)
+            if digests: # digests are strings, so each row was a Series of objects
+                results = results.infer_objects()
+        stage.rows_out = len(results)
+
+    if replicates:
+        if compaction.iscompacted(df):
+            logger.warning('%s is compacted: confidence intervals resample merged runs of edits, '
+                           'and differ from those for the original events', infile)
+        # records for student-projects finished by an earlier run of the checkpoint are
+        # collected again; failed ones have no results, and get no intervals
+        for key in results.index:
+            if key not in kept:
+                kept[key] = userrecords(grouped.get_group(key), due_date_data, submissions,
+                                        usercol=user_id, name=key, deadlines=deadlines)
+        results = results.join(uncertainty.intervals(kept, deadlines=deadlines, replicates=replicates,
+                                                     confidence=confidence, processes=processes,
+                                                     names=grouped.keys))
 
     # Write out
     if outfile:
@@ -371,13 +822,13 @@ def main(args):
     submissionpath = args[1]
     duetimepath = args[2]
     outfile = args[3]
-    if args.length > 4:
+    date_parser = None
+    if len(args) > 4:
         dateformat = args[4]
-    else:
-        dateformat = None
+        date_parser = lambda d: datetime.datetime.strptime(d, dateformat)
 
     try:
-       results = earlyoften(infile=infile, submissionpath=submissionpath, duetimepath=duetimepath, outfile=outfile, dateformat=dateformat) # If outfile is None, stores results in memory
+       results = earlyoften(infile=infile, submissionpath=submissionpath, duetimepath=duetimepath, outfile=outfile, date_parser=date_parser) # If outfile is None, stores results in memory
     except FileNotFoundError:
         print("Error! File '%s' does not exist." % infile)
 
@@ -385,4 +836,5 @@ if __name__ == '__main__':
     if len(sys.argv) < 5:
         print(__doc__)
         sys.exit()
+    instrument.log_to_stderr()
     main(sys.argv[1:])
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""How long after a solution edit does a student next run their tests, and do
+those tests pass?
+
+Each Edit event is joined to the next test Termination by the same student on
+the same project with a sorted as-of join (:meth:`pandas.merge_asof`), over a
+whole term at once rather than in a loop per student. Test outcomes are read as
+:meth:`utils.split_termination_events` would split them: one outcome per test
+method, and a run passes if every outcome is a `Success` (see
+:meth:`utils.test_outcome_counts`).
+
+Every edit is joined separately, so sensordata compacted by
+:meth:`compaction.compact` (where a run of edits is one event, at the time of its
+last) gives different results; :meth:`editlatency` warns if given it.
+
+.. code-block:: python
+
+   import edit_latency
+
+   pairs = edit_latency.nexttests(events)           # one row per edit
+   summary = edit_latency.editlatency('all.csv')    # one row per student-project
+
+To use:
+    `import edit_latency`, or
+    ./edit_latency.py <input file> <output file> [--all-edits] on the command line
+"""
+import sys
+import logging
+
+import numpy as np
+import pandas as pd
+
+import cli
+import utils
+import instrument
+import compaction
+
+logger = logging.getLogger('sensordata.edit_latency')
+
+#: Quantiles of latency reported for each student-project
+QUANTILES = {'latencyQ25': 0.25, 'latencyMedian': 0.5, 'latencyQ75': 0.75, 'latencyQ90': 0.9}
+
+def _seconds(times):
+    """Times in seconds since the epoch, from datetimes or millisecond timestamps."""
+    if pd.api.types.is_datetime64_any_dtype(times):
+        return times.values.astype('datetime64[ns]').astype(np.int64) / 1e9
+    return pd.to_numeric(times).values / 1000
+
+def nexttests(events, solution_only=True):
+    """Join each Edit event to the next test Termination in the same student-project.
+
+    Args:
+        events (DataFrame): Sensordata, with `time` as datetimes or in milliseconds
+        solution_only (bool): Only consider edits to solution code (`onTestCase` is not 1)
+
+    Returns:
+        A *DataFrame* with one row per edit: the user and assignment columns, the
+        edit's `Class-Name` and `time`, the `latency` (in seconds) until the next test
+        run finished, and that run's `successes`, `failures`, `errors` and whether it
+        `passed`. Edits with no later test run have *NaN* latency.
+    """
+    usercol, assignmentcol = utils.group_columns(events.columns)
+    events = events.assign(_seconds=_seconds(events['time']), _row=np.arange(len(events)))
+
+    edits = events[(events['Type'] == 'Edit') & (events['Class-Name'].fillna('') != '')]
+    if solution_only:
+        edits = edits[pd.to_numeric(edits['onTestCase'], errors='coerce').fillna(0) != 1]
+    edits = edits[[usercol, assignmentcol, 'Class-Name', 'time', '_seconds', '_row']]
+
+    tests = events[(events['Type'] == 'Termination') & (events['Subtype'] == 'Test')]
+    tests = pd.concat([tests[[usercol, assignmentcol, '_seconds']], utils.test_outcome_counts(tests)],
+                      axis=1).rename(columns={'_seconds': '_testseconds'})
+    tests['_seconds'] = tests['_testseconds']
+
+    # strictly after: a run that finishes at the same moment can't include the edit
+    joined = pd.merge_asof(edits.sort_values('_seconds', kind='mergesort'),
+                           tests.sort_values('_seconds', kind='mergesort'),
+                           on='_seconds', by=[usercol, assignmentcol],
+                           direction='forward', allow_exact_matches=False)
+    joined['latency'] = joined.pop('_testseconds') - joined.pop('_seconds')
+    joined['passed'] = (joined['failures'] + joined['errors'] == 0).astype(float) \
+                         .where(joined['latency'].notnull())
+    # back in the order the edits came in
+    return joined.sort_values('_row').drop(columns='_row').reset_index(drop=True)
+
+def summarise(pairs):
+    """Latency distributions and pass rates for each student-project.
+
+    Args:
+        pairs (DataFrame): As returned by :meth:`nexttests`
+
+    Returns:
+        A *DataFrame* indexed by (user, assignment), with the number of `edits`, how
+        many were followed by a test run (`editsTested`), latency quantiles (see
+        :attr:`QUANTILES`) and `latencyMean` in seconds, and `passRate`: the fraction
+        of tested edits whose next test run passed. Empty if there were no edits.
+    """
+    usercol, assignmentcol = utils.group_columns(pairs.columns)
+    grouped = pairs.groupby([usercol, assignmentcol], sort=False)
+    summary = pd.DataFrame({
+        'edits': grouped.size(),
+        'editsTested': grouped['latency'].count(),
+        'latencyMean': grouped['latency'].mean(),
+        'passRate': grouped['passed'].mean()
+    })
+    # with no edits there are no quantile columns to unstack
+    quantiles = grouped['latency'].quantile(list(QUANTILES.values())).unstack() \
+                  .reindex(columns=list(QUANTILES.values()))
+    for name, q in QUANTILES.items():
+        summary[name] = quantiles[q]
+    return summary
+
+@instrument.instrumented('edit_latency.editlatency')
+def editlatency(infile=None, df=None, outfile=None, solution_only=True):
+    """Compute edit-to-next-test latency and pass rates for each student-project.
+
+    Args:
+        infile (str): Path to sensordata. Either this or `df` must be provided.
+        df (DataFrame): Already loaded sensordata
+        outfile (str, optional): Path to write results to. If *None*, results are returned.
+        solution_only (bool): Only consider edits to solution code
+
+    Returns:
+        A *DataFrame* (see :meth:`summarise`) if no *outfile* is specified. *None* otherwise.
+    """
+    if infile is None and df is None:
+        raise ValueError('Either infile or df must be provided. Got None for both.')
+    if df is None:
+        wanted = ['userId', 'email', 'userName', 'cleaned_assignment', 'CASSIGNMENTNAME', 'assignment',
+                  'time', 'Class-Name', 'Type', 'Subtype', 'Subsubtype', 'onTestCase', 'Compacted-Edits']
+        df = pd.read_csv(infile, dtype=str, na_values=[], keep_default_na=False, low_memory=False,
+                         usecols=lambda c: c in wanted)
+    if compaction.iscompacted(df):
+        logger.warning('%s is compacted: each merged run of edits counts as one edit, and results '
+                       'differ from those for the original events', infile or 'The sensordata')
+
+    # staged here rather than on nexttests, which metrics call once per student-project
+    with instrument.stage('edit_latency.nexttests', rows_in=len(df)) as stage:
+        pairs = nexttests(df, solution_only=solution_only)
+        stage.rows_out = len(pairs)
+    results = summarise(pairs)
+    if outfile:
+        results.to_csv(outfile)
+    else:
+        return results
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('editlatency').parse_args(args)
+
+    try:
+        editlatency(infile=args.infile, outfile=args.outfile, solution_only=not args.all_edits)
+    except FileNotFoundError as e:
+        print("Error! File '%s' does not exist." % e.filename)
+
+if __name__ == '__main__':
+    instrument.log_to_stderr()
+    main(sys.argv[1:])
@@ -0,0 +1,274 @@
+"""A memory-mapped, binary event store for per-student analyses.
+
+Sensordata is written once to a directory of column files (`.npy`), sorted by
+(user, assignment, time). String columns are dictionary-encoded, and a sidecar
+index records where each student-project's events start and end. Opening a
+store maps the column files into memory without reading them, so fetching one
+student-project's events is an O(1) slice that copies nothing, and any number
+of processes reading the same store share the same pages.
+
+.. code-block:: python
+
+   import eventstore
+   from early_often import userearlyoften
+
+   eventstore.build('all.csv', 'data/fall-2018/store')
+   store = eventstore.EventStore('data/fall-2018/store')
+
+   sizes = store.slice('student00001', 'Project 1')['Current-Size'] # a read-only view
+   events = store.frame('student00001', 'Project 1') # decoded, like earlyoften's input
+   results = store.apply(userearlyoften, due_date_data=..., submissions=...)
+
+To use:
+    `import eventstore`
+"""
+import os
+import json
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import utils
+import instrument
+
+#: Columns stored as 64-bit integers rather than dictionary-encoded strings
+NUMERIC_COLUMNS = ['time', 'onTestCase', 'Current-Statements', 'Current-Methods',
+                   'Current-Size', 'Current-Test-Assertions']
+
+#: Stands in for a missing value in numeric columns
+MISSING = np.iinfo(np.int64).min
+
+INDEX_DTYPE = np.dtype([('user', np.int32), ('assignment', np.int32),
+                        ('start', np.int64), ('end', np.int64)])
+
+def _column_file(storedir, col, suffix='.npy'):
+    return os.path.join(storedir, 'col-{}{}'.format(col.replace(os.sep, '_'), suffix))
+
+def _encode_numeric(values):
+    values = pd.to_numeric(pd.Series(values).replace('', np.nan), errors='raise')
+    return values.fillna(MISSING).astype(np.int64).values
+
+def build(infile, storedir, columns=None, chunksize=1000000):
+    """Write sensordata to a memory-mappable event store.
+
+    The input is read in chunks, so only the sort keys and one column at a time need
+    to fit in memory.
+
+    Args:
+        infile (str or pd.DataFrame): Path to a sensordata CSV, or already loaded
+                                      sensordata (with `time` in milliseconds)
+        storedir (str): Directory to write the store to. Created if it does not exist.
+        columns (list, optional): Columns to store, in addition to the user,
+                                  assignment and time columns. Stores every column if omitted.
+        chunksize (int): Number of rows read from `infile` at a time
+
+    Returns:
+        The opened :class:`EventStore`.
+    """
+    os.makedirs(storedir, exist_ok=True)
+    if isinstance(infile, pd.DataFrame):
+        chunks = [infile.astype(str).replace('nan', '')]
+    else:
+        usecols = None
+        if columns is not None:
+            wanted = set(columns) | {'userId', 'email', 'userName', 'cleaned_assignment',
+                                     'CASSIGNMENTNAME', 'assignment', 'time'}
+            usecols = lambda c: c in wanted
+        chunks = pd.read_csv(infile, dtype=str, keep_default_na=False, usecols=usecols,
+                             chunksize=chunksize)
+
+    kinds = None
+    vocabs = {}
+    files = {}
+    rows = 0
+    with instrument.stage('eventstore.build.encode') as stage:
+        for chunk in chunks:
+            if kinds is None:
+                usercol, assignmentcol = utils.group_columns(chunk.columns)
+                kinds = {col: 'int64' if col in NUMERIC_COLUMNS else 'str' for col in chunk.columns}
+                vocabs = {col: {} for col, kind in kinds.items() if kind == 'str'}
+                files = {col: open(_column_file(storedir, col, '.tmp'), 'wb') for col in kinds}
+
+            for col, kind in kinds.items():
+                values = chunk[col].values
+                if kind == 'str':
+                    vocab = vocabs[col]
+                    codes = np.fromiter((vocab.setdefault(v, len(vocab)) for v in values),
+                                        dtype=np.int32, count=len(values))
+                else:
+                    codes = _encode_numeric(values)
+                codes.tofile(files[col])
+            rows += len(chunk)
+        stage.rows_out = rows
+
+    for f in files.values():
+        f.close()
+    if kinds is None:
+        raise ValueError('No events found in {}'.format(infile))
+
+    # renumber string codes so that code order matches lexical order
+    remaps = {}
+    strings = {}
+    for col, vocab in vocabs.items():
+        ordered = sorted(vocab)
+        remap = np.empty(len(vocab), dtype=np.int32)
+        remap[[vocab[v] for v in ordered]] = np.arange(len(ordered), dtype=np.int32)
+        remaps[col] = remap
+        strings[col] = ordered
+
+    with instrument.stage('eventstore.build.sort', rows_in=rows) as stage:
+        load = lambda col: np.fromfile(_column_file(storedir, col, '.tmp'),
+                                       dtype=np.int32 if kinds[col] == 'str' else np.int64)
+        users = remaps[usercol][load(usercol)]
+        assignments = remaps[assignmentcol][load(assignmentcol)]
+        order = np.lexsort((load('time'), assignments, users))
+        users, assignments = users[order], assignments[order]
+
+        for col, kind in kinds.items():
+            values = load(col)[order]
+            if col in remaps:
+                values = remaps[col][values]
+            np.save(_column_file(storedir, col), values)
+            os.remove(_column_file(storedir, col, '.tmp'))
+            del values
+
+        boundaries = np.flatnonzero((users[1:] != users[:-1]) |
+                                    (assignments[1:] != assignments[:-1])) + 1
+        index = np.empty(len(boundaries) + 1, dtype=INDEX_DTYPE)
+        index['start'] = np.r_[0, boundaries]
+        index['end'] = np.r_[boundaries, rows]
+        index['user'] = users[index['start']]
+        index['assignment'] = assignments[index['start']]
+        np.save(os.path.join(storedir, 'index.npy'), index)
+        stage.rows_out = len(index)
+
+    with open(os.path.join(storedir, 'meta.json'), 'w') as metafile:
+        json.dump({
+            'rows': rows,
+            'usercol': usercol,
+            'assignmentcol': assignmentcol,
+            'columns': kinds,
+            'vocab': strings
+        }, metafile)
+
+    return EventStore(storedir)
+
+class EventStore:
+    """Read-only access to an event store written by :meth:`build`.
+
+    Args:
+        storedir (str): Directory containing the store
+    """
+
+    def __init__(self, storedir):
+        self.storedir = storedir
+        with open(os.path.join(storedir, 'meta.json')) as metafile:
+            meta = json.load(metafile)
+        self.usercol = meta['usercol']
+        self.assignmentcol = meta['assignmentcol']
+        self.kinds = meta['columns']
+        self.vocab = {col: np.array(v, dtype=object) for col, v in meta['vocab'].items()}
+        self._codes = {col: {s: i for i, s in enumerate(v)} for col, v in meta['vocab'].items()
+                       if col in (self.usercol, self.assignmentcol)}
+        self._columns = {}
+
+        self.index = np.load(os.path.join(storedir, 'index.npy'), mmap_mode='r')
+        self._offsets = {(int(u), int(a)): i
+                         for i, (u, a) in enumerate(zip(self.index['user'], self.index['assignment']))}
+
+    def __len__(self):
+        return int(self.index['end'][-1]) if len(self.index) else 0
+
+    @property
+    def columns(self):
+        """Names of the stored columns."""
+        return list(self.kinds)
+
+    def column(self, col):
+        """Returns the whole (memory-mapped, encoded) column `col`."""
+        if col not in self._columns:
+            self._columns[col] = np.load(_column_file(self.storedir, col), mmap_mode='r')
+        return self._columns[col]
+
+    def groups(self):
+        """Returns a list of `(user, assignment)` tuples, in storage order."""
+        users = self.vocab[self.usercol]
+        assignments = self.vocab[self.assignmentcol]
+        return [(users[u], assignments[a])
+                for u, a in zip(self.index['user'], self.index['assignment'])]
+
+    def bounds(self, user, assignment):
+        """Returns the `(start, end)` row offsets of a student-project's events.
+
+        Raises:
+            KeyError: If the student-project is not in the store
+        """
+        key = (self._codes[self.usercol][user], self._codes[self.assignmentcol][assignment])
+        entry = self.index[self._offsets[key]]
+        return int(entry['start']), int(entry['end'])
+
+    def slice(self, user, assignment, columns=None):
+        """Returns a student-project's events as a *dict* of read-only column views.
+        Nothing is copied; string columns hold codes into :attr:`vocab`.
+
+        Args:
+            user (str): The user, as it appears in the store's user column
+            assignment (str): The assignment, as it appears in the store's assignment column
+            columns (list, optional): Columns to return. Defaults to all of them.
+        """
+        start, end = self.bounds(user, assignment)
+        return {col: self.column(col)[start:end] for col in (columns or self.columns)}
+
+    def frame(self, user, assignment, columns=None, date_parser=None):
+        """Returns a student-project's events as a decoded *DataFrame*, in the same
+        shape as the events `earlyoften` reads: strings decoded, `time` parsed as
+        datetimes, and missing values as `''`. The frame's `name` is set to
+        `(user, assignment)`, as in a split-apply-combine procedure.
+
+        Args:
+            date_parser (func, optional): Parses millisecond timestamps. Defaults to local datetimes.
+        """
+        if not date_parser:
+            date_parser = lambda d: datetime.datetime.fromtimestamp(d / 1000)
+        decoded = {}
+        for col, values in self.slice(user, assignment, columns).items():
+            if col == 'time':
+                decoded[col] = pd.to_datetime([date_parser(t) for t in values])
+            elif self.kinds[col] == 'str':
+                decoded[col] = self.vocab[col][values]
+            else:
+                decoded[col] = np.where(values == MISSING, '', values.astype(object))
+
+        frame = pd.DataFrame(decoded)
+        object.__setattr__(frame, 'name', (user, assignment)) # as pandas does for groups
+        return frame
+
+    def apply(self, func, groups=None, columns=None, **kwargs):
+        """Apply `func` to each student-project's decoded events, like
+        `DataFrame.groupby([usercol, assignmentcol]).apply(func, **kwargs)`.
+
+        Args:
+            func (callable): Takes a DataFrame (see :meth:`frame`) and returns a Series,
+                             a DataFrame, or *None*
+            groups (list, optional): `(user, assignment)` tuples to apply to.
+                                     Defaults to every student-project in the store.
+            columns (list, optional): Columns to decode for each group
+
+        Returns:
+            A *DataFrame* indexed by user and assignment.
+        """
+        keys = []
+        results = []
+        for user, assignment in (groups or self.groups()):
+            result = func(self.frame(user, assignment, columns), **kwargs)
+            if result is not None:
+                keys.append((user, assignment))
+                results.append(result)
+
+        names = [self.usercol, self.assignmentcol]
+        if not results:
+            return pd.DataFrame()
+        if isinstance(results[0], pd.DataFrame):
+            return pd.concat(results, keys=keys, names=names)
+        return pd.DataFrame(results, index=pd.MultiIndex.from_tuples(keys, names=names))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""External (out-of-core) sorting for sensordata files larger than memory.
+
+The streaming scripts (:mod:`clean`, :mod:`time_spent`, :mod:`incremental_checking`)
+expect their input to be ordered by user and assignment. This sorts CSV files
+(or parquet shards, e.g. from :mod:`ingest`) by any list of columns while
+holding at most `runsize` rows in memory: the input is cut into sorted runs on
+disk, which are then combined with a k-way merge. The sort is stable, so rows
+that tie on every key keep their input order.
+
+Columns in :attr:`eventstore.NUMERIC_COLUMNS` (such as `time`) are compared as
+numbers, others as strings. Empty values sort last in numeric columns, and
+first in string columns.
+
+.. code-block:: bash
+
+   ./extsort.py sorted.csv fall2018.csv spring2019.csv --by userName assignment time
+   ./clean.py sorted.csv clean.csv
+
+To use:
+    `import extsort`, or
+    ./extsort.py <outfile> <infile> [<infile> ...] --by <column> [<column> ...] on the command line
+"""
+import os
+import sys
+import csv
+import heapq
+import tempfile
+import itertools
+
+import cli
+import instrument
+
+#: Default number of rows held in memory at once
+RUNSIZE = 500000
+
+#: Maximum number of runs merged at once; more runs are merged in several passes
+FANIN = 128
+
+def _numeric(column):
+    from eventstore import NUMERIC_COLUMNS
+    return column in NUMERIC_COLUMNS
+
+def _keyfunc(header, by, numeric):
+    """Returns a function mapping a row (a list) to its sort key."""
+    missing = [col for col in by if col not in header]
+    if missing:
+        raise ValueError('Cannot sort by {}: not in columns {}'.format(missing, header))
+    parts = []
+    for col in by:
+        position = header.index(col)
+        if col in numeric:
+            parts.append(lambda row, p=position: (row[p] == '', float(row[p]) if row[p] != '' else 0.0))
+        else:
+            parts.append(lambda row, p=position: row[p])
+    return lambda row: tuple(part(row) for part in parts)
+
+def _rows(path, header):
+    """Yields the rows of a CSV or parquet file as lists of strings, with columns
+    in the order of `header` (missing columns are empty)."""
+    if path.endswith('.parquet'):
+        import pandas as pd
+        df = pd.read_parquet(path).reindex(columns=header).fillna('').astype(str)
+        for row in df.itertuples(index=False, name=None):
+            yield list(row)
+        return
+
+    with open(path, 'r', newline='') as infile:
+        reader = csv.reader(infile)
+        columns = next(reader)
+        if columns == header:
+            yield from reader
+        else:
+            positions = [columns.index(col) if col in columns else None for col in header]
+            for row in reader:
+                yield [row[p] if p is not None else '' for p in positions]
+
+def _header(path):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    with open(path, 'r', newline='') as infile:
+        return next(csv.reader(infile))
+
+def _writerun(rows, directory):
+    handle, path = tempfile.mkstemp(suffix='.csv', dir=directory)
+    with os.fdopen(handle, 'w', newline='') as outfile:
+        csv.writer(outfile).writerows(rows)
+    return path
+
+def _readrun(path):
+    with open(path, 'r', newline='') as infile:
+        yield from csv.reader(infile)
+
+def _merge(runs, key, directory):
+    """Merge sorted runs until at most :attr:`FANIN` remain. Returns their paths."""
+    while len(runs) > FANIN:
+        merged = []
+        for i in range(0, len(runs), FANIN):
+            group = runs[i:i + FANIN]
+            merged.append(_writerun(heapq.merge(*[_readrun(r) for r in group], key=key), directory))
+            for run in group:
+                os.remove(run)
+        runs = merged
+    return runs
+
+def sort(inputs, outpath, by, numeric=None, runsize=RUNSIZE, tmpdir=None):
+    """Sort one or more sensordata files into a single CSV file, using bounded memory.
+
+    Args:
+        inputs (list): Paths to CSV or parquet files. Columns are taken from the first
+                       file; later files are matched to them by name.
+        outpath (str): Path to the sorted CSV file
+        by (list): Columns to sort by, e.g. `['userName', 'assignment', 'time']`
+        numeric (list, optional): Columns compared as numbers. Defaults to any of `by`
+                                  in :attr:`eventstore.NUMERIC_COLUMNS`.
+        runsize (int): Maximum number of rows held in memory at once
+        tmpdir (str, optional): Where sorted runs are written. Defaults to the
+                                directory of `outpath`.
+
+    Returns:
+        The number of rows written.
+    """
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    header = _header(inputs[0])
+    numeric = set(numeric if numeric is not None else [col for col in by if _numeric(col)])
+    key = _keyfunc(header, by, numeric)
+
+    with tempfile.TemporaryDirectory(dir=tmpdir or os.path.dirname(os.path.abspath(outpath))) as workdir:
+        runs = []
+        rows = itertools.chain.from_iterable(_rows(path, header) for path in inputs)
+        with instrument.stage('extsort.runs') as stage:
+            stage.rows_in = 0
+            while True:
+                chunk = list(itertools.islice(rows, runsize))
+                if not chunk:
+                    break
+                chunk.sort(key=key)
+                runs.append(_writerun(chunk, workdir))
+                stage.rows_in += len(chunk)
+                del chunk
+            stage.rows_out = len(runs)
+
+        with instrument.stage('extsort.merge', rows_in=stage.rows_in) as stage:
+            runs = _merge(runs, key, workdir)
+            with open(outpath, 'w', newline='') as outfile:
+                writer = csv.writer(outfile)
+                writer.writerow(header)
+                count = 0
+                for row in heapq.merge(*[_readrun(r) for r in runs], key=key):
+                    writer.writerow(row)
+                    count += 1
+            stage.rows_out = count
+
+    return count
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('sort').parse_args(args)
+
+    sort(args.infiles, args.outfile, args.by, numeric=args.numeric, runsize=args.run_size,
+         tmpdir=args.tmpdir)
+
+if __name__ == '__main__':
+    instrument.log_to_stderr()
+    main(sys.argv[1:])
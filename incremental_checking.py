@@ -4,14 +4,22 @@ amounts of [solution/test] code written between successive
 [solution/test] launches.
 
 (These measures didn't return anything interesting)
+
+Every edit counts, weighted by the time until the next launch, so sensordata
+compacted by compaction.compact (which merges runs of edits into one) gives
+different results; incremental_checking warns if its input is compacted.
 """
 
 #! /usr/bin/env python3
 
 import csv
 import sys
+import logging
 import datetime
 import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('sensordata.incremental_checking')
 
 def incremental_checking(infile, outfile, deadline = None):
     """
@@ -69,10 +77,16 @@ def incremental_checking(infile, outfile, deadline = None):
 
         prev_row = None
         curr_sizes = {}
+        warned = False
 
         for row in reader:
             prev_row = prev_row or row
 
+            if not warned and row.get('Compacted-Edits'):
+                logger.warning('%s is compacted: each merged run of edits counts as one edit, '
+                               'and results differ from those for the original events', infile)
+                warned = True
+
             if deadline:
                 due_date = datetime.date.fromtimestamp(int(float(deadline)) / 1000)
                 time = int(float(row['time']))
@@ -216,6 +230,85 @@ def incremental_checking(infile, outfile, deadline = None):
 
             writer.writerow(to_write)
 
+def userincrementalchecking(usergroup, deadline=None):
+    """Calculates incremental checking metrics for one student's events on a
+    single project. This is the split-apply-combine counterpart of
+    :meth:`incremental_checking`, for use with `DataFrame.groupby(...).apply`.
+
+    Args:
+        usergroup (pd.DataFrame): Chronologically ordered events for a student on
+                                  a single project, with `time` parsed as datetimes.
+                                  Not compacted (see :mod:`compaction`).
+        deadline (int, optional): Due time in milliseconds. Events more than 4 days
+                                  after the due date are ignored.
+
+    Returns:
+        A *Series* containing the same measures written by :meth:`incremental_checking`.
+    """
+    weighted_sol_edit_any_launch = []
+    weighted_sol_edit_reg_launch = []
+    weighted_sol_edit_test_launch = []
+    weighted_test_edit_test_launch = []
+    weighted_test_per_solution_edits = []
+
+    solution_edits_per_test_launch = []
+    solution_edits_per_reg_launch = []
+    test_edits_per_test_launch = []
+    solution_edits_per_any_launch = []
+
+    curr_sizes = {}
+    due_date = None
+    if deadline:
+        due_date = datetime.date.fromtimestamp(int(float(deadline)) / 1000)
+
+    hours = lambda edit, launch_time: (launch_time - edit['time']).total_seconds() / 3600
+
+    for _, row in usergroup.iterrows():
+        time = row['time']
+        if due_date is not None and (due_date - time.date()).days < -4:
+            continue
+
+        if row['Type'] == 'Edit' and len(row['Class-Name']) > 0:
+            class_name = row['Class-Name']
+            stmts = int(row['Current-Statements'])
+            prev_size = curr_sizes.get(class_name, 0)
+            curr_sizes[class_name] = stmts
+            edit = {'size': abs(stmts - prev_size), 'time': time}
+
+            if int(row['onTestCase']) == 1:
+                test_edits_per_test_launch.append(edit)
+            else:
+                solution_edits_per_any_launch.append(edit)
+                solution_edits_per_test_launch.append(edit)
+                solution_edits_per_reg_launch.append(edit)
+        elif row['Type'] == 'Launch':
+            weighted_sol_edit_any_launch.extend(
+                e['size'] * hours(e, time) for e in solution_edits_per_any_launch)
+            solution_edits_per_any_launch = []
+
+            if row['Subtype'] == 'Test':
+                solution_weights = [e['size'] * hours(e, time) for e in solution_edits_per_test_launch]
+                test_weights = [e['size'] * hours(e, time) for e in test_edits_per_test_launch]
+                weighted_sol_edit_test_launch.extend(solution_weights)
+                weighted_test_edit_test_launch.extend(test_weights)
+                solution_edits_per_test_launch = []
+                test_edits_per_test_launch = []
+
+                if sum(solution_weights) > 0:
+                    weighted_test_per_solution_edits.append(sum(test_weights) / sum(solution_weights))
+            else:
+                weighted_sol_edit_reg_launch.extend(
+                    e['size'] * hours(e, time) for e in solution_edits_per_reg_launch)
+                solution_edits_per_reg_launch = []
+
+    return pd.Series({
+        'solutionEditAnyLaunch': np.mean(weighted_sol_edit_any_launch),
+        'solutionEditRegularLaunch': np.mean(weighted_sol_edit_reg_launch),
+        'solutionEditTestLaunch': np.mean(weighted_sol_edit_test_launch),
+        'testEditTestLaunch': np.mean(weighted_test_edit_test_launch),
+        'testEditPerSolutionEdit': np.mean(weighted_test_per_solution_edits)
+    })
+
 def get_diff_in_hours(timestamp1, timestamp2):
     time1 = datetime.datetime.fromtimestamp(timestamp1 / 1000)
     time2 = datetime.datetime.fromtimestamp(timestamp2 / 1000)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""Receives live DevEventTracker events over HTTP.
+
+A small asyncio HTTP server accepts the same query-string events that the
+Eclipse plugin posts, parses them with :meth:`utils.processline`, and holds
+them in memory in batches. Batches are flushed periodically (or when they
+fill up) to an append-only columnar event log, partitioned by term and day::
+
+    <outdir>/term=fall2018/day=2018-09-10/part-1536600000000-000001.parquet
+
+Incoming events go through a bounded queue. When the writer falls behind and
+the queue is full, requests wait briefly for room and are then refused with
+`503 Service Unavailable`, so clients back off instead of the server running
+out of memory.
+
+Parquet files are written with pandas, which needs `pyarrow` (or
+`fastparquet`) to be installed.
+
+To use:
+    `import ingest`, or
+    ./ingest.py <output directory> [--port PORT] on the command line, and
+    ./ingest.py --replay <raw log> [--port PORT] to replay a log file against it
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import datetime
+from urllib import parse
+
+import pandas as pd
+
+import cli
+import utils
+
+logger = logging.getLogger('sensordata.ingest')
+
+#: Fields captured from each event, as in :mod:`raw_to_csv`
+FIELDNAMES = utils.DEFAULT_FIELDNAMES + ['userUuid', 'studentProjectUuid', 'Set']
+
+_OK = b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n'
+_BUSY = b'HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\n\r\n'
+_BAD = b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+def _partition(timestamp):
+    """Returns the (term, day) partition for a millisecond timestamp."""
+    day = datetime.date.fromtimestamp(timestamp / 1000)
+    return utils.get_term(timestamp), day.isoformat()
+
+class EventLog:
+    """An append-only event log, partitioned by term and day. Each flush writes
+    new files; existing files are never modified.
+
+    Args:
+        outdir (str): Root directory of the log
+        fieldnames (list): Columns written for each event
+    """
+
+    def __init__(self, outdir, fieldnames=None):
+        self.outdir = outdir
+        self.fieldnames = fieldnames or FIELDNAMES
+        self._sequence = 0
+
+    def append(self, events):
+        """Write a batch of events (dicts, as returned by :meth:`utils.processline`).
+        Events without a time are stamped with the current time.
+
+        Returns:
+            The number of events written.
+        """
+        if not events:
+            return 0
+        now = int(time.time() * 1000)
+        # stringified per event, so a column of ints with gaps isn't written as floats
+        rows = [{k: '' if v is None else str(v) for k, v in event.items()} for event in events]
+        df = pd.DataFrame(rows, columns=self.fieldnames).fillna('')
+        df['time'] = pd.to_numeric(df['time'].replace('', now)).astype('int64')
+
+        # events are partitioned by local day, so a term is looked up once per day
+        days = utils.local_times(df['time']).dt.normalize()
+        for _, part in df.groupby(days.values, sort=False):
+            term, day = _partition(int(part['time'].iloc[0]))
+            partdir = os.path.join(self.outdir, 'term={}'.format(term), 'day={}'.format(day))
+            os.makedirs(partdir, exist_ok=True)
+            self._sequence += 1
+            path = os.path.join(partdir, 'part-{}-{:06d}.parquet'.format(now, self._sequence))
+            part.to_parquet(path + '.tmp', index=False)
+            os.rename(path + '.tmp', path) # readers never see partial files
+
+        return len(df)
+
+def readlog(outdir, terms=None, days=None):
+    """Read events back from an :class:`EventLog`.
+
+    Args:
+        outdir (str): Root directory of the log
+        terms (list, optional): Only read these terms
+        days (list, optional): Only read these days (`YYYY-MM-DD` strings)
+
+    Returns:
+        A *DataFrame* of events, sorted by time.
+    """
+    frames = []
+    for termdir in sorted(os.listdir(outdir)):
+        if not termdir.startswith('term=') or (terms and termdir[5:] not in terms):
+            continue
+        for daydir in sorted(os.listdir(os.path.join(outdir, termdir))):
+            if days and daydir[4:] not in days:
+                continue
+            partdir = os.path.join(outdir, termdir, daydir)
+            frames.extend(pd.read_parquet(os.path.join(partdir, f))
+                          for f in sorted(os.listdir(partdir)) if f.endswith('.parquet'))
+
+    if not frames:
+        return pd.DataFrame(columns=FIELDNAMES)
+    return pd.concat(frames, ignore_index=True).sort_values(by=['time'], kind='mergesort')
+
+class IngestServer:
+    """Receives DevEventTracker events over HTTP and writes them to an :class:`EventLog`.
+
+    Args:
+        outdir (str): Root directory of the event log
+        host (str): Interface to listen on
+        port (int): Port to listen on
+        batch_size (int): Flush as soon as this many events are waiting
+        flush_interval (float): Flush at least this often (in seconds) while events are waiting
+        max_queue (int): Maximum number of events held in memory before requests are refused
+        enqueue_timeout (float): How long (in seconds) a request may wait for room in the queue
+        fieldnames (list, optional): Fields captured from each event. Defaults to :attr:`FIELDNAMES`.
+    """
+
+    def __init__(self, outdir, host='127.0.0.1', port=8080, batch_size=10000, flush_interval=5.0,
+                 max_queue=100000, enqueue_timeout=1.0, fieldnames=None):
+        self.log = EventLog(outdir, fieldnames=fieldnames)
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.enqueue_timeout = enqueue_timeout
+        self.received = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.error = None # the last exception raised writing a batch
+        self._queue = None
+        self._server = None
+        self._writer = None
+
+    async def start(self):
+        """Start listening and writing."""
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._writer = asyncio.ensure_future(self._drain())
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        if self.port == 0: # an ephemeral port was requested
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop accepting connections, and flush every event already received.
+
+        Raises:
+            RuntimeError: If any batch could not be written to the log.
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        await self._queue.join()
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        if self.error is not None:
+            raise RuntimeError('{} events could not be written to {}'.format(
+                self.failed, self.log.outdir)) from self.error
+
+    async def _handle(self, reader, writer):
+        """Serve one (keep-alive) connection."""
+        try:
+            while True:
+                requestline = await reader.readline()
+                if not requestline:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, _ = requestline.decode('latin-1').split()
+                    body = b''
+                    if int(headers.get('content-length', 0)):
+                        body = await reader.readexactly(int(headers['content-length']))
+                except (ValueError, asyncio.IncompleteReadError):
+                    writer.write(_BAD)
+                    break
+
+                url = 'http://{}{}'.format(headers.get('host', 'localhost'), target)
+                if method == 'POST' and body:
+                    url = '{}{}{}'.format(url, '&' if '?' in url else '?', body.decode('utf-8'))
+                writer.write(await self._receive(url))
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _receive(self, url):
+        """Parse one event and queue it, waiting briefly for room if the queue is full."""
+        try:
+            event = utils.processline(url, self.log.fieldnames)
+        except ValueError: # e.g., a malformed time
+            return _BAD
+        if event is None or not event.get('Type'):
+            return _BAD
+        try:
+            await asyncio.wait_for(self._queue.put(event), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return _BUSY
+        self.received += 1
+        return _OK
+
+    async def _drain(self):
+        """Collect queued events into batches and flush them to the log."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    if self._queue.qsize() == 0 and loop.time() >= deadline:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(),
+                                                            max(0, deadline - loop.time())))
+                    except asyncio.TimeoutError:
+                        break
+
+            try:
+                # write in a thread, so the server keeps accepting events meanwhile
+                self.written += await loop.run_in_executor(None, self.log.append, batch)
+            except Exception as e:
+                # keep draining, so that stop() doesn't wait forever; it raises this instead
+                logger.exception('Could not write %d events to %s', len(batch), self.log.outdir)
+                self.failed += len(batch)
+                self.error = e
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+async def replay(logpath, host='127.0.0.1', port=8080, connections=4):
+    """Replay a raw URL log (as written by DevEventTracker) against a server, as the
+    Eclipse plugin would. Events refused with `503` are retried.
+
+    Args:
+        logpath (str): Path to a file of newline separated URLs
+        connections (int): Number of concurrent keep-alive connections
+
+    Returns:
+        The number of events accepted by the server.
+    """
+    with open(logpath) as logfile:
+        targets = [parse.urlsplit(line.strip()) for line in logfile if line.strip()]
+    targets = ['{}?{}'.format(t.path or '/', t.query) for t in targets]
+
+    async def client(share):
+        reader, writer = await asyncio.open_connection(host, port)
+        accepted = 0
+        for target in share:
+            while True:
+                writer.write('GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(target, host).encode('latin-1'))
+                await writer.drain()
+                status = await reader.readline()
+                while (await reader.readline()) not in (b'\r\n', b''):
+                    pass
+                if b' 503 ' not in status:
+                    break
+                await asyncio.sleep(0.1)
+            accepted += b' 200 ' in status
+        writer.close()
+        return accepted
+
+    results = await asyncio.gather(*[client(targets[i::connections]) for i in range(connections)])
+    return sum(results)
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    parser = cli.commandparser('ingest')
+    args = parser.parse_args(args)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    if args.replay:
+        start = time.perf_counter()
+        accepted = loop.run_until_complete(replay(args.replay, host=args.host, port=args.port))
+        seconds = time.perf_counter() - start
+        print('Replayed {} events in {:.2f}s ({:.0f} events/s)'.format(accepted, seconds, accepted / seconds))
+        return
+    if not args.outdir:
+        parser.error('outdir is required unless --replay is given')
+
+    server = IngestServer(args.outdir, host=args.host, port=args.port, batch_size=args.batch_size,
+                          flush_interval=args.flush_interval, max_queue=args.max_queue)
+    loop.run_until_complete(server.start())
+    print('Listening on {}:{}'.format(server.host, server.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        loop.run_until_complete(server.stop())
+        print('Wrote {} events ({} refused)'.format(server.written, server.rejected))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
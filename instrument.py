@@ -0,0 +1,164 @@
+"""Lightweight timing and memory instrumentation for pipeline stages.
+
+Wrap a unit of work in a :meth:`stage` to record its wall time, the number of
+rows that went in and came out, throughput, and the peak resident set size of
+the process when it finished. Stages nest, so a stage started inside another
+one records its parent.
+
+.. code-block:: python
+
+   import instrument
+
+   with instrument.stage('earlyoften.read_sensordata') as s:
+       df = pd.read_csv(infile)
+       s.rows_out = len(df)
+
+   instrument.write_summary('profile.json')
+
+Completed stages are logged at INFO level to the `sensordata.instrument`
+logger, which is silent unless you ask for it (see :meth:`log_to_stderr`).
+If the environment variable `SENSORDATA_PROFILE` names a file, a JSON summary
+of all stages is written there when the interpreter exits.
+
+To use:
+    `import instrument`
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import functools
+import contextlib
+import collections
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+logger = logging.getLogger('sensordata.instrument')
+
+#: Largest number of completed stages kept, so that long-running processes
+#: (such as :mod:`ingest`) don't grow without bound
+MAX_RECORDS = 10000
+
+#: Completed stages, in the order they finished (the most recent :attr:`MAX_RECORDS`)
+RECORDS = collections.deque(maxlen=MAX_RECORDS)
+
+_active = []
+
+class Stage:
+    """Measurements for one stage of work. Set `rows_in` and `rows_out` while
+    the stage is running; timing and memory are filled in when it ends."""
+
+    def __init__(self, name, rows_in=None, parent=None):
+        self.name = name
+        self.parent = parent
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.seconds = None
+        self.peak_rss_mb = None
+
+    @property
+    def rows_per_second(self):
+        """Rows processed per second, based on `rows_in` (or `rows_out` if
+        nothing was recorded going in)."""
+        rows = self.rows_in if self.rows_in is not None else self.rows_out
+        if rows is None or not self.seconds:
+            return None
+        return rows / self.seconds
+
+    def to_dict(self):
+        """Returns the measurements for this stage as a JSON-friendly *dict*."""
+        return {
+            'stage': self.name,
+            'parent': self.parent,
+            'seconds': self.seconds,
+            'rowsIn': self.rows_in,
+            'rowsOut': self.rows_out,
+            'rowsPerSecond': self.rows_per_second,
+            'peakRssMb': self.peak_rss_mb
+        }
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process so far, in megabytes,
+    or *None* if it cannot be determined on this platform."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if os.uname().sysname != 'Darwin': # Linux reports kilobytes, macOS reports bytes
+        peak = peak * 1024
+    return peak / 2**20
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    """Time a stage of work.
+
+    Args:
+        name (str): Name of the stage, conventionally `module.step`
+        rows_in (int, optional): Number of rows going into the stage. May also be
+                                 set on the yielded :class:`Stage`.
+
+    Yields:
+        The :class:`Stage` being measured.
+    """
+    current = Stage(name, rows_in=rows_in, parent=_active[-1].name if _active else None)
+    _active.append(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - start
+        current.peak_rss_mb = peak_rss_mb()
+        _active.pop()
+        RECORDS.append(current)
+        logger.info('%s: %.2fs, rows in=%s, rows out=%s, peak RSS=%sMB', current.name,
+                    current.seconds, current.rows_in, current.rows_out,
+                    None if current.peak_rss_mb is None else round(current.peak_rss_mb, 1))
+
+def instrumented(name):
+    """Decorator that runs the decorated function as a :meth:`stage`. If the
+    function's return value has a length, it is recorded as `rows_out`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name) as s:
+                result = func(*args, **kwargs)
+                try:
+                    s.rows_out = len(result)
+                except TypeError:
+                    pass
+            return result
+        return wrapper
+    return decorator
+
+def summary():
+    """Returns a JSON-friendly *dict* summarising the completed stages in :attr:`RECORDS`."""
+    toplevel = [r for r in RECORDS if r.parent is None]
+    peaks = [r.peak_rss_mb for r in RECORDS if r.peak_rss_mb is not None]
+    return {
+        'totalSeconds': sum(r.seconds for r in toplevel),
+        'peakRssMb': max(peaks) if peaks else None,
+        'stages': [r.to_dict() for r in RECORDS]
+    }
+
+def write_summary(path):
+    """Write :meth:`summary` to a JSON file."""
+    with open(path, 'w') as outfile:
+        json.dump(summary(), outfile, indent=2)
+
+def reset():
+    """Forget all completed stages."""
+    RECORDS.clear()
+
+def log_to_stderr(level=logging.INFO):
+    """Print a line to stderr as each stage completes."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+if os.environ.get('SENSORDATA_PROFILE'):
+    atexit.register(write_summary, os.environ['SENSORDATA_PROFILE'])
@@ -1,15 +1,29 @@
 """Import datasets and metrics from several sources."""
+import re
 import datetime
 import pandas as pd
 import numpy as np
 import argparse
 
-def load_edits(edit_path=None, sensordata_path=None, assignment_col='assignment'):
+import utils
+import instrument
+import cache
+import dataset
+import sqlstore
+
+@instrument.instrumented('load_datasets.load_edits')
+def load_edits(edit_path=None, sensordata_path=None, assignment_col='assignment', terms=None,
+               assignments=None):
     """Loads edit events that took place on a source file.
 
     This convenience method filters out Edit events from raw sensordata, or
     reads an already filtered CSV file. If both edit_path and sensordata_path
     are specified, the already-filtered file (at edit_path) takes precedence.
+
+    sensordata_path may also be a partitioned dataset (see :mod:`dataset`), in
+    which case only the partitions for `terms` and `assignments` (if given) are read,
+    or an SQLite store (see :mod:`sqlstore`), in which case only Edit events for
+    `assignments` (if given) are selected.
     """
     if not edit_path and not sensordata_path:
         raise ValueError("Either edit_path or sensordata_path must be specified and non-empty")
@@ -38,16 +52,31 @@ def load_edits(edit_path=None, sensordata_path=None, assignment_col='assignment'
         'Current-Size': object,
         'Current-Test-Assertions': object
     }
-    data = pd.read_csv(sensordata_path, dtype=dtypes, usecols=dtypes.keys())
+    if dataset.isdataset(sensordata_path):
+        data = dataset.read(sensordata_path, terms=terms, assignments=assignments,
+                            columns=list(dtypes.keys()))
+        data['time'] = data['time'].astype(int)
+    elif sqlstore.isstore(sensordata_path) and not terms:
+        with sqlstore.EventStore(sensordata_path) as store:
+            columns = [c for c in store.columns() if c in dtypes] # in file order, as usecols gives
+            data = store.events(columns=columns, assignments=assignments, types=['Edit'],
+                                where='"Class-Name" != \'\'')
+        data['time'] = data['time'].astype(int)
+    elif terms or assignments:
+        raise ValueError('terms can only be used with a partitioned dataset, '
+                         'and assignments with a dataset or an SQLite store')
+    else:
+        data = pd.read_csv(sensordata_path, dtype=dtypes, usecols=dtypes.keys())
     data = data[(data['Type'] == 'Edit') & (data['Class-Name'] != '')]
-    data = data.fillna('') \
-               .sort_values(by=['email', assignment_col, 'time'], ascending=[1, 1, 1]) \
+    data = utils.ensure_sorted(data.fillna(''), ['email', assignment_col, 'time']) \
                .rename(columns={'email': 'userName', assignment_col: 'assignment'})
     data['userName'] = data.userName.apply(lambda u: u.split('@')[0])
     data = data.set_index(['userName', 'assignment'])
     return data
 
-def load_launches(launch_path=None, sensordata_path=None, newformat=True):
+@instrument.instrumented('load_datasets.load_launches')
+def load_launches(launch_path=None, sensordata_path=None, newformat=True, users=None, assignments=None,
+                  start=None, end=None):
     """Loads raw launch data.
 
     Convenience method: filters out everything but Launches from raw sensordata,
@@ -62,8 +91,13 @@ def load_launches(launch_path=None, sensordata_path=None, newformat=True):
 
     Args:
         launch_path (str): Path to file containing already filtered launch data
-        sensordata_path (str): Path to file containing raw sensordata
+        sensordata_path (str): Path to file containing raw sensordata, or to an SQLite
+                               store of sensordata (see :mod:`sqlstore`)
         newformat (bool, default=True): Use the new format?
+        users (list, optional, store only): Only select launches by these users
+        assignments (list, optional, store only): Only select launches on these assignments
+        start (float, optional, store only): Only select launches at or after this time
+        end (float, optional, store only): Only select launches before this time
     """
     errormessage = "Either launch_path or sensordata_path must be specified and non-empty."
     if not launch_path and not sensordata_path:
@@ -93,7 +127,18 @@ def load_launches(launch_path=None, sensordata_path=None, newformat=True):
         dtypes['TestFailures'] = str
 
     eventtypes = ['Launch', 'Termination']
-    data = pd.read_csv(sensordata_path, dtype=dtypes, usecols=dtypes.keys()) \
+    if sqlstore.isstore(sensordata_path):
+        # filters are applied by SQLite, using its indexes
+        with sqlstore.EventStore(sensordata_path) as store:
+            columns = [c for c in store.columns() if c in dtypes]
+            data = store.events(columns=columns, types=eventtypes, users=users,
+                                assignments=assignments, start=start, end=end)
+        data = data.replace('', np.nan).astype({'time': float}) # as read from a CSV
+    elif any(f is not None for f in (users, assignments, start, end)):
+        raise ValueError('users, assignments, start and end can only be used with an SQLite store')
+    else:
+        data = pd.read_csv(sensordata_path, dtype=dtypes, usecols=dtypes.keys())
+    data = data \
              .query('Type in @eventtypes') \
              .rename(columns={
                  'email': 'userName',
@@ -103,6 +148,8 @@ def load_launches(launch_path=None, sensordata_path=None, newformat=True):
     data = data.set_index(['userName', 'assignment'])
     return data
 
+@instrument.instrumented('load_datasets.load_submission_dists')
+@cache.cached(paths=['webcat_path'])
 def load_submission_dists(webcat_path, **kwargs):
     """Return a description of each students distribution of submission scores for
     each assignment, as a four number summary (quartiles).
@@ -136,11 +183,14 @@ def load_submission_dists(webcat_path, **kwargs):
         ('Q4', np.max)
     ]}).loc[:, 'score']
 
+@instrument.instrumented('load_datasets.load_raw_inc_data')
+@cache.cached(paths=['raw_inc_path'])
 def load_raw_inc_data(raw_inc_path):
     """Loads early/often metrics for code editing and launching.
     
     Note that this does NOT calculate the metrics. raw_inc_path refers
-    to a CSV file that contains already-calculated values. 
+    to a CSV file that contains already-calculated values. Confidence intervals
+    written by `earlyoften(..., replicates=N)` (see :mod:`uncertainty`) are kept.
     """
 
     data = pd.read_csv(raw_inc_path)
@@ -173,6 +223,8 @@ def load_raw_inc_data(raw_inc_path):
 
     return data
 
+@instrument.instrumented('load_datasets.load_submission_data')
+@cache.cached(paths=['webcat_path'])
 def load_submission_data(webcat_path, onlyfinal=True, pluscols=[], keepassignments=[]):
     """Loads submission data from webcat_path, which points at a
     CSV file containing submission data from a Web-CAT server.
@@ -234,6 +286,30 @@ def load_submission_data(webcat_path, onlyfinal=True, pluscols=[], keepassignmen
     data.set_index(['userName', 'assignment'], inplace=True)
     return data
 
+def last_submission_times(submissions, users, assignments, usercol='userName'):
+    """Look up the time of each student-project's final submission.
+
+    Args:
+        submissions (DataFrame): As returned by :meth:`load_submission_data`
+        users (list): User identifiers, one per student-project
+        assignments (list): Assignment names, one per student-project. Only the first
+                            digit is used (e.g., `Project 1` and `project1` match).
+        usercol (str): Name of the column the users come from. If `email`, domains
+                       are removed before looking up submissions.
+
+    Returns:
+        An array of submission times (*NaT* if no submission was found).
+    """
+    names = list(users)
+    if usercol == 'email':
+        names = [u.split('@')[0] for u in names]
+    numbers = [int(re.search(r'\d', a).group()) for a in assignments]
+    lastsubs = submissions['submissionTimeRaw']
+    lastsubs = lastsubs[~lastsubs.index.duplicated(keep='first')]
+    lookup = pd.MultiIndex.from_arrays([names, ['Project {}'.format(n) for n in numbers]])
+    return lastsubs.reindex(lookup).values
+
+@instrument.instrumented('load_datasets.load_time_spent_data')
 def load_time_spent_data(time_path):
     """Loads the time spent in hours for each student-project."""
 
@@ -0,0 +1,235 @@
+"""Compute several student-project metrics in a single pass over sensordata.
+
+Each metric is an accumulator that is handed the events for one student on one
+project and returns a row of measures. :meth:`computemetrics` reads the event
+stream once, groups it once by (user, assignment), and feeds every group to each
+of the requested metrics in turn. The results are joined into a single table
+indexed by `userName, assignment`.
+
+Sensordata compacted by :meth:`compaction.compact` gives the same Early/Often and
+debugging measures, but not the same incremental checking, time spent or edit
+latency, which need every edit; :meth:`computemetrics` warns if those are asked
+for on compacted sensordata.
+
+Adding a metric means writing a :class:`Metric` subclass, not another pass over the data:
+
+.. code-block:: python
+
+   import metrics
+
+   results = metrics.computemetrics('all.csv', metrics=[
+       metrics.EarlyOftenMetric('submissions.csv', 'due_times.json'),
+       metrics.IncrementalCheckingMetric(),
+       metrics.TimeSpentMetric(threshold=1),
+       metrics.DebugSessionsMetric(),
+       metrics.EditLatencyMetric()
+   ])
+
+To use:
+    `import metrics`
+"""
+import abc
+import json
+import logging
+import datetime
+
+import pandas as pd
+
+import utils
+import compaction
+
+logger = logging.getLogger('sensordata.metrics')
+
+class Metric(abc.ABC):
+    """Base class for per-(user, assignment) metric accumulators.
+
+    Subclasses list the sensordata columns they need in `columns`, may load any
+    external data they need in :meth:`setup` (called once, before the scan), and
+    implement :meth:`compute`.
+    """
+    #: Sensordata columns required by this metric
+    columns = []
+    #: Whether the metric's measures are the same for sensordata compacted by
+    #: :meth:`compaction.compact` as for the original events
+    compactable = False
+
+    def setup(self, usercol):
+        """Called once before any groups are computed.
+
+        Args:
+            usercol (str): Name of the column identifying users in the event stream
+        """
+        self.usercol = usercol
+
+    @abc.abstractmethod
+    def compute(self, usergroup):
+        """Compute measures for a single student-project.
+
+        Args:
+            usergroup (pd.DataFrame): Chronologically ordered events for one student
+                                      on one project. `usergroup.name` is the
+                                      `(user, assignment)` tuple.
+
+        Returns:
+            A *Series* (or dict) of measures, or *None* if nothing could be computed.
+        """
+
+class EarlyOftenMetric(Metric):
+    """Early/Often indices. See :meth:`early_often.userearlyoften`."""
+    columns = ['Class-Name', 'Type', 'Subtype', 'onTestCase', 'Current-Statements',
+               'Current-Methods', 'Current-Size', 'Current-Test-Assertions'] + \
+              list(compaction.CHANGED.values())
+    compactable = True
+
+    def __init__(self, submissionpath, duetimepath):
+        self.submissionpath = submissionpath
+        self.duetimepath = duetimepath
+
+    def setup(self, usercol):
+        from load_datasets import load_submission_data
+
+        super().setup(usercol)
+        self.submissions = load_submission_data(self.submissionpath)
+        with open(self.duetimepath) as data_file:
+            self.due_date_data = json.load(data_file)
+
+    def compute(self, usergroup):
+        from early_often import userearlyoften
+
+        return userearlyoften(usergroup, due_date_data=self.due_date_data,
+                              submissions=self.submissions, usercol=self.usercol)
+
+class IncrementalCheckingMetric(Metric):
+    """Incremental checking measures. See :meth:`incremental_checking.userincrementalchecking`."""
+    columns = ['Class-Name', 'Type', 'Subtype', 'onTestCase', 'Current-Statements']
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+
+    def compute(self, usergroup):
+        from incremental_checking import userincrementalchecking
+
+        return userincrementalchecking(usergroup, deadline=self.deadline)
+
+class TimeSpentMetric(Metric):
+    """Hours spent and number of work sessions. See :meth:`time_spent.usertimespent`."""
+    columns = []
+
+    def __init__(self, threshold=1):
+        self.threshold = threshold
+
+    def compute(self, usergroup):
+        from time_spent import usertimespent
+
+        return usertimespent(usergroup, threshold=self.threshold)
+
+class DebugSessionsMetric(Metric):
+    """Debugger session summaries. See :meth:`debugging.userdebugsummary`."""
+    columns = ['Type', 'Subtype', 'Set']
+    compactable = True
+
+    def compute(self, usergroup):
+        from debugging import userdebugsummary
+
+        return userdebugsummary(usergroup)
+
+class EditLatencyMetric(Metric):
+    """Time from solution edits to the next test run, and its pass rate. See
+    :meth:`edit_latency.summarise`. For a whole term at once, :meth:`edit_latency.editlatency`
+    is faster."""
+    columns = ['Class-Name', 'Type', 'Subtype', 'Subsubtype', 'onTestCase']
+
+    def compute(self, usergroup):
+        from edit_latency import nexttests, summarise
+
+        summary = summarise(nexttests(usergroup))
+        return summary.iloc[0] if len(summary) else None
+
+def readevents(infile, columns, date_parser=None):
+    """Read the given columns (if present) from a sensordata CSV, along with the
+    user, assignment, and time columns. Columns that are not present in the file
+    are added as empty strings.
+
+    Args:
+        infile (str): Path to a file containing sensordata
+        columns (list): Columns required by the metrics being computed
+        date_parser (func, optional): Parses timestamps. Defaults to millisecond timestamps.
+
+    Returns:
+        A *DataFrame* with `time` parsed as datetimes and missing values filled with `''`.
+    """
+    idcols = ['userId', 'email', 'userName', 'cleaned_assignment', 'CASSIGNMENTNAME',
+              'assignment', 'time']
+    wanted = set(idcols) | set(columns)
+    if not date_parser:
+        date_parser = lambda d: datetime.datetime.fromtimestamp(int(d) / 1000)
+
+    df = pd.read_csv(infile, dtype=object, na_values=[], low_memory=False,
+                     usecols=lambda c: c in wanted, date_parser=date_parser,
+                     parse_dates=['time']) \
+           .fillna('')
+    for col in columns:
+        if col not in df.columns:
+            df[col] = ''
+
+    return df
+
+def computemetrics(infile=None, df=None, metrics=None, outfile=None, date_parser=None):
+    """Compute several metrics for each student-project, reading and grouping the
+    event stream only once.
+
+    Args:
+        infile (str): Path to a file containing sensordata. Either this or `df`
+                      must be provided.
+        df (pd.DataFrame): Already loaded sensordata, with `time` parsed as datetimes
+        metrics (list): :class:`Metric` instances to compute
+        outfile (str, optional): Path to a file where the joined results should be written.
+            If *None*, the results are returned as a DataFrame.
+        date_parser (func, optional, no-CLI): A function or lambda to parse timestamps.
+
+    Returns:
+        A *DataFrame* indexed by `userName, assignment`, with one block of columns per
+        metric, if no *outfile* is specified. *None* otherwise.
+    """
+    if infile is None and df is None:
+        raise ValueError('Either infile or df must be provided. Got None for both.')
+    if not metrics:
+        raise ValueError('At least one metric must be specified.')
+
+    columns = []
+    for metric in metrics:
+        columns.extend(c for c in metric.columns if c not in columns)
+
+    if df is None:
+        df = readevents(infile, columns + ['Compacted-Edits'], date_parser=date_parser)
+
+    inexact = [type(metric).__name__ for metric in metrics if not metric.compactable]
+    if inexact and compaction.iscompacted(df):
+        logger.warning('%s is compacted: %s count each merged run of edits as one edit, and '
+                       'differ from their results for the original events',
+                       infile or 'The sensordata', ', '.join(inexact))
+
+    usercol, assignmentcol = utils.group_columns(df.columns)
+    for metric in metrics:
+        metric.setup(usercol)
+
+    df = df.sort_values(by=[usercol, assignmentcol, 'time'], ascending=[1, 1, 1])
+    results = df.groupby([usercol, assignmentcol]).apply(_computeall, metrics=metrics)
+    results.index = pd.MultiIndex.from_tuples(
+        [(str(user).split('@')[0], assignment) for user, assignment in results.index],
+        names=['userName', 'assignment']
+    )
+
+    if outfile:
+        results.to_csv(outfile)
+    else:
+        return results
+
+def _computeall(usergroup, metrics):
+    row = {}
+    for metric in metrics:
+        result = metric.compute(usergroup)
+        if result is not None:
+            row.update(dict(result))
+
+    return pd.Series(row)
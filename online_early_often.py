@@ -0,0 +1,312 @@
+"""Online (event-at-a-time) Early/Often indices.
+
+:meth:`early_often.userearlyoften` needs a student's whole event history before
+it can compute anything. The accumulators here compute the same measures, but
+keep only a small state for each student-project: the last known size of each
+class, running sums, and a histogram of *days until the deadline*. Since that
+is a whole number of days, the histogram is a compact, exact quantile sketch;
+its size is bounded by the length of the project, not the number of events.
+
+The state can be asked for the current measures at any time (e.g., to give
+instructors mid-project procrastination indicators), and saved to and loaded
+from disk between runs.
+
+.. code-block:: python
+
+   from online_early_often import EarlyOftenTracker
+
+   tracker = EarlyOftenTracker(due_date_data)
+   for event in new_events: # dicts, as returned by utils.processline
+       tracker.update(event)
+   tracker.measures() # a DataFrame, like earlyoften's output
+   tracker.save('earlyoften-state.json')
+
+   tracker = EarlyOftenTracker.load('earlyoften-state.json', due_date_data)
+
+To use:
+    `import online_early_often`
+"""
+import json
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import compaction
+from early_often import deadlinetable
+
+class Accumulator:
+    """Running sums and a histogram of days until the deadline for one kind
+    of event.
+
+    Args:
+        stretch (bool): Weight the histogram by edit size, as the `*EditMedian`
+                        and `*EditSd` measures of `userearlyoften` do. Otherwise
+                        every event counts once.
+    """
+
+    def __init__(self, stretch=False):
+        self.stretch = stretch
+        self.weighted = 0
+        self.total = 0
+        self.histogram = {}
+
+    def add(self, days, size=1):
+        """Record an event of `size` (1 for launches and debug sessions) made
+        `days` days before the deadline."""
+        self.weighted += size * days
+        self.total += size
+        if not self.stretch:
+            self.histogram[days] = self.histogram.get(days, 0) + 1
+        elif size * days > 0: # as in userearlyoften, edits on or after the due date are not stretched
+            self.histogram[days] = self.histogram.get(days, 0) + size * days
+
+    def index(self):
+        """Returns the (size-weighted) mean days until the deadline."""
+        return self.weighted / self.total if self.total else np.nan
+
+    def median(self):
+        """Returns the median of the histogram, as `np.median` would for the full list."""
+        count = sum(self.histogram.values())
+        if not count:
+            return np.nan
+        days = sorted(self.histogram)
+        cumulative = np.cumsum([self.histogram[d] for d in days])
+        lower = days[int(np.searchsorted(cumulative, (count - 1) // 2, side='right'))]
+        upper = days[int(np.searchsorted(cumulative, count // 2, side='right'))]
+        return (lower + upper) / 2
+
+    def sd(self):
+        """Returns the (population) standard deviation of the histogram."""
+        count = sum(self.histogram.values())
+        if not count:
+            return np.nan
+        mean = sum(d * w for d, w in self.histogram.items()) / count
+        return np.sqrt(sum(w * (d - mean) ** 2 for d, w in self.histogram.items()) / count)
+
+    def to_dict(self):
+        return {
+            'stretch': self.stretch,
+            'weighted': self.weighted,
+            'total': self.total,
+            'histogram': [[d, w] for d, w in sorted(self.histogram.items())]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        accumulator = cls(stretch=data['stretch'])
+        accumulator.weighted = data['weighted']
+        accumulator.total = data['total']
+        accumulator.histogram = {d: w for d, w in data['histogram']}
+        return accumulator
+
+#: Accumulators kept for each student-project, and whether they are size-weighted
+ACCUMULATORS = {
+    'bytes': True, 'stmts': True, 'solutionBytes': True, 'solutionStmts': False,
+    'solutionMethods': False, 'testBytes': True, 'testStmts': False, 'testMethods': False,
+    'assertions': True, 'launches': False, 'testLaunches': False, 'normalLaunches': False,
+    'debugSessions': False
+}
+
+def _parsetime(time):
+    if isinstance(time, datetime.datetime):
+        return pd.Timestamp(time)
+    return pd.Timestamp(datetime.datetime.fromtimestamp(int(time) / 1000))
+
+class EarlyOftenState:
+    """The Early/Often state for one student-project, updated one event at a time.
+
+    Args:
+        due_date (datetime): The project's due date
+        last_submission_time (datetime, optional): Time of the final submission. Events
+            after it are ignored. May be set later, once the student has submitted.
+    """
+
+    def __init__(self, due_date, last_submission_time=None):
+        self.due_date = pd.Timestamp(due_date)
+        self.last_submission_time = last_submission_time
+        self.events = 0
+        self.sizes = {} # class name -> [bytes, statements, methods, assertions]
+        self.accumulators = {name: Accumulator(stretch) for name, stretch in ACCUMULATORS.items()}
+
+    def update(self, event):
+        """Update the state with one event.
+
+        Args:
+            event (dict): A sensordata event (a *dict* or a row *Series*), with
+                `time` as a datetime or a millisecond timestamp
+        """
+        time = _parsetime(event['time'])
+        days = (self.due_date - time.normalize()).days
+        cutoff = self.last_submission_time
+        if (cutoff is not None and not pd.isnull(cutoff) and time > cutoff) or days < -4:
+            return
+        self.events += 1
+        acc = self.accumulators
+        eventtype = event.get('Type')
+
+        if eventtype == 'Edit' and len(event.get('Class-Name') or '') > 0:
+            class_name = event['Class-Name']
+            prev = self.sizes.get(class_name, [0, 0, 0, 0])
+            curr = [int(event['Current-Size']), int(event['Current-Statements']),
+                    int(event['Current-Methods']), prev[3]]
+            byte_edit_size = abs(prev[0] - curr[0])
+            stmt_edit_size = abs(prev[1] - curr[1])
+            method_edit_size = abs(prev[2] - curr[2])
+            assertion_change_size = 0
+            if event.get('Current-Test-Assertions', '') != '':
+                curr[3] = int(event['Current-Test-Assertions'])
+                assertion_change_size = abs(prev[3] - curr[3])
+            self.sizes[class_name] = curr
+            if compaction.recorded(event, 'Current-Size') is not None:
+                # a run of edits merged by compaction.compact: use the changes over the whole run
+                byte_edit_size, stmt_edit_size, method_edit_size, assertion_change_size = \
+                    [compaction.recorded(event, column) for column in compaction.CHANGED]
+
+            prefix = 'test' if int(event['onTestCase']) == 1 else 'solution'
+            if byte_edit_size > 0:
+                acc['bytes'].add(days, byte_edit_size)
+                acc[prefix + 'Bytes'].add(days, byte_edit_size)
+            if stmt_edit_size > 0:
+                acc['stmts'].add(days, stmt_edit_size)
+                acc[prefix + 'Stmts'].add(days, stmt_edit_size)
+            if method_edit_size > 0:
+                acc[prefix + 'Methods'].add(days, method_edit_size)
+            if assertion_change_size > 0:
+                acc['assertions'].add(days, assertion_change_size)
+        elif eventtype == 'Launch':
+            acc['launches'].add(days)
+            if event.get('Subtype') == 'Test':
+                acc['testLaunches'].add(days)
+            elif event.get('Subtype') == 'Normal':
+                acc['normalLaunches'].add(days)
+        elif eventtype == 'DebugSession':
+            if float(event['length']) > 30:
+                acc['debugSessions'].add(days)
+
+    def measures(self):
+        """Returns the current Early/Often measures, as a *Series* with the same
+        entries as :meth:`early_often.userearlyoften`."""
+        acc = self.accumulators
+        return pd.Series({
+            'byteEarlyOftenIndex': acc['bytes'].index(),
+            'byteEditMedian': acc['bytes'].median(),
+            'byteEditSd': acc['bytes'].sd(),
+            'stmtEarlyOftenIndex': acc['stmts'].index(),
+            'stmtEditMedian': acc['stmts'].median(),
+            'stmtEditSd': acc['stmts'].sd(),
+            'solutionByteEarlyOftenIndex': acc['solutionBytes'].index(),
+            'solutionByteEditMedian': acc['solutionBytes'].median(),
+            'solutionByteEditSd': acc['solutionBytes'].sd(),
+            'solutionStmtEarlyOftenIndex': acc['solutionStmts'].index(),
+            'solutionMethodsEarlyOftenIndex': acc['solutionMethods'].index(),
+            'testByteEarlyOftenIndex': acc['testBytes'].index(),
+            'testByteEditMedian': acc['testBytes'].median(),
+            'testByteEditSd': acc['testBytes'].sd(),
+            'testStmtsEarlyOftenIndex': acc['testStmts'].index(),
+            'testMethodsEarlyOftenIndex': acc['testMethods'].index(),
+            'assertionsEarlyOftenIndex': acc['assertions'].index(),
+            'assertionsMedian': acc['assertions'].median(),
+            'assertionSd': acc['assertions'].sd(),
+            'launchEarlyOften': acc['launches'].index(),
+            'launchMedian': acc['launches'].median(),
+            'launchSd': acc['launches'].sd(),
+            'testLaunchEarlyOften': acc['testLaunches'].index(),
+            'testLaunchMedian': acc['testLaunches'].median(),
+            'testLaunchSd': acc['testLaunches'].sd(),
+            'normalLaunchEarlyOften': acc['normalLaunches'].index(),
+            'normalLaunchMedian': acc['normalLaunches'].median(),
+            'normalLaunchSd': acc['normalLaunches'].sd(),
+            'debugSessionEarlyOften': acc['debugSessions'].index(),
+            'debugSessionMedian': acc['debugSessions'].median(),
+            'debugSessionSd': acc['debugSessions'].sd()
+        })
+
+    def to_dict(self):
+        """Returns the state as a JSON-friendly *dict*."""
+        cutoff = self.last_submission_time
+        return {
+            'dueDate': self.due_date.isoformat(),
+            'lastSubmissionTime': None if cutoff is None or pd.isnull(cutoff) else pd.Timestamp(cutoff).isoformat(),
+            'events': self.events,
+            'sizes': self.sizes,
+            'accumulators': {name: a.to_dict() for name, a in self.accumulators.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores a state saved with :meth:`to_dict`."""
+        cutoff = data['lastSubmissionTime']
+        state = cls(pd.Timestamp(data['dueDate']), None if cutoff is None else pd.Timestamp(cutoff))
+        state.events = data['events']
+        state.sizes = data['sizes']
+        state.accumulators = {name: Accumulator.from_dict(a) for name, a in data['accumulators'].items()}
+        return state
+
+class EarlyOftenTracker:
+    """Keeps an :class:`EarlyOftenState` for every student-project it has seen.
+
+    Args:
+        due_date_data (dict): Dictionary containing due dates in millisecond timestamps
+        submissions (DataFrame, optional): Last submission from each student, used to
+            set cutoffs for student-projects as they are first seen
+        usercol (str): Name of the column identifying the user
+        assignmentcol (str): Name of the column identifying the assignment
+    """
+
+    def __init__(self, due_date_data, submissions=None, usercol='userId', assignmentcol='CASSIGNMENTNAME'):
+        self.due_date_data = due_date_data
+        self.submissions = submissions
+        self.usercol = usercol
+        self.assignmentcol = assignmentcol
+        self.states = {}
+
+    def update(self, event):
+        """Update the state for the event's student-project with one event."""
+        key = (event[self.usercol], event[self.assignmentcol])
+        if key not in self.states:
+            deadlines = deadlinetable([key[0]], [key[1]], [_parsetime(event['time'])], self.due_date_data,
+                                      self.submissions, usercol=self.usercol)
+            cutoff = deadlines['lastSubmissionTime'].iloc[0]
+            self.states[key] = EarlyOftenState(deadlines['dueDate'].iloc[0],
+                                               None if pd.isnull(cutoff) else cutoff)
+        self.states[key].update(event)
+
+    def updateall(self, events):
+        """Update states with each event (row) in a *DataFrame*, in order."""
+        for event in events.to_dict('records'):
+            self.update(event)
+
+    def submitted(self, user, assignment, time):
+        """Record a student's final submission; later events on the project are ignored."""
+        self.states[(user, assignment)].last_submission_time = pd.Timestamp(time)
+
+    def measures(self):
+        """Returns the current measures for every student-project, as a *DataFrame*
+        indexed by user and assignment."""
+        if not self.states:
+            return pd.DataFrame()
+        keys = sorted(self.states)
+        return pd.DataFrame([self.states[k].measures() for k in keys],
+                            index=pd.MultiIndex.from_tuples(keys, names=[self.usercol, self.assignmentcol]))
+
+    def save(self, path):
+        """Write every state to a JSON file."""
+        with open(path, 'w') as outfile:
+            json.dump({
+                'usercol': self.usercol,
+                'assignmentcol': self.assignmentcol,
+                'states': [[user, assignment, state.to_dict()]
+                           for (user, assignment), state in self.states.items()]
+            }, outfile)
+
+    @classmethod
+    def load(cls, path, due_date_data, submissions=None):
+        """Restore a tracker written by :meth:`save`."""
+        with open(path) as infile:
+            data = json.load(infile)
+        tracker = cls(due_date_data, submissions=submissions, usercol=data['usercol'],
+                      assignmentcol=data['assignmentcol'])
+        for user, assignment, state in data['states']:
+            tracker.states[(user, assignment)] = EarlyOftenState.from_dict(state)
+        return tracker
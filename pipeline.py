@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""A declarative runner for the SensorData processing pipeline.
+
+The usual production flow (raw URL logs to CSV, mapping to users and
+assignments, cleaning, work sessions, then the metrics) is declared as a DAG
+of :class:`Stage` objects, each naming the inputs it needs. Running the
+pipeline:
+
+* skips stages whose inputs (and code, including every module of the package,
+  and parameters) have not changed since the last run in the same working
+  directory
+* keeps intermediate results as pickled DataFrames, so column types survive
+  and nothing is re-parsed from CSV between stages
+* runs stages that do not depend on each other at the same time, in separate
+  processes
+
+.. code-block:: python
+
+   import pipeline
+
+   outputs = pipeline.run(pipeline.DEFAULT_STAGES, workdir='data/fall-2018/pipeline', sources={
+       'raw': 'data/fall-2018/data-files',
+       'uuids': 'data/fall-2018/cs3114uuids.csv',
+       'submissions': 'data/fall-2018/submissions.csv',
+       'due_times': 'data/due_times.json'
+   })
+   earlyoften = pipeline.load(outputs['earlyoften'])
+
+To use:
+    `import pipeline`, or
+    ./pipeline.py <workdir> <name>=<path> [<name>=<path> ...] [--targets ...] on the command line
+"""
+import os
+import sys
+import json
+import queue
+import hashlib
+import inspect
+import tempfile
+import multiprocessing
+
+import pandas as pd
+
+import cli
+import cache
+import eventstore
+import instrument
+
+class Stage:
+    """One step of a pipeline.
+
+    Args:
+        name (str): Name of the stage, and of the artifact it produces
+        func (callable): A module-level function. It is called with one keyword argument
+            per input, and the stage's params, and returns a *DataFrame*. Inputs produced
+            by other stages are passed as DataFrames; source inputs are passed as paths.
+        inputs (list): Names of sources or other stages this stage needs
+        params (dict, optional): Extra keyword arguments for `func`
+    """
+
+    def __init__(self, name, func, inputs, params=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params or {}
+
+    def __repr__(self):
+        return 'Stage({}, inputs={})'.format(self.name, self.inputs)
+
+def load(path):
+    """Read an artifact written by the pipeline."""
+    return pd.read_pickle(path)
+
+def _typed(events):
+    """Keep integer columns integral, even where values are missing, so they
+    are written to CSV (with `--csv`) without decimal points."""
+    for col in eventstore.NUMERIC_COLUMNS:
+        if col in events.columns:
+            values = pd.to_numeric(events[col])
+            events[col] = values.astype('int64' if values.notnull().all() else 'Int64')
+    return events
+
+def rawtocsv(raw):
+    """Parse a raw URL log, or a directory of them, into events."""
+    import utils
+    fieldnames = utils.DEFAULT_FIELDNAMES + ['userUuid', 'studentProjectUuid', 'Set']
+    files = [raw] if os.path.isfile(raw) else \
+        [os.path.join(raw, f) for f in sorted(os.listdir(raw)) if os.path.isfile(os.path.join(raw, f))]
+    frames = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, path in enumerate(files):
+            outpath = os.path.join(tmp, '{}.csv'.format(i))
+            utils.raw_to_csv(path, outpath, fieldnames)
+            frames.append(pd.read_csv(outpath, low_memory=False))
+    return _typed(pd.concat(frames, ignore_index=True, sort=False))
+
+def maptouuids(rawtocsv, uuids):
+    """Map events to users and assignments. Adds the `userId`, `projectId` and
+    `CASSIGNMENTNAME` columns the later stages expect, where they are missing, and
+    marks edits not known to be on test cases (see :meth:`utils.processline`) as
+    `onTestCase=0`."""
+    import utils
+    df = utils.maptouuids(sensordata=rawtocsv, uuidpath=uuids)
+    if 'userId' not in df.columns:
+        df['userId'] = df['userName']
+    if 'projectId' not in df.columns:
+        df['projectId'] = df['studentProjectUuid']
+    if 'assignment' in df.columns:
+        df['CASSIGNMENTNAME'] = df['assignment'].fillna(df['CASSIGNMENTNAME'])
+    if 'onTestCase' in df.columns:
+        df.loc[df['Type'] == 'Edit', 'onTestCase'] = df.loc[df['Type'] == 'Edit', 'onTestCase'].fillna(0)
+    return utils.ensure_sorted(df, ['userName', 'CASSIGNMENTNAME', 'time'])
+
+def clean(maptouuids):
+    """Clean assignment names (see :meth:`clean.cleaned_assignments`)."""
+    from clean import cleaned_assignments
+    df = maptouuids
+    if 'uri' not in df.columns:
+        df = df.assign(uri='')
+    return cleaned_assignments(df)
+
+def worksessions(clean, threshold=1):
+    """Reduce events to work sessions, delimited by `threshold` hours of inactivity,
+    with the columns :meth:`time_spent.get_time_spent` expects."""
+    import utils
+    import sessions
+    df = utils.ensure_sorted(clean, ['userId', 'CASSIGNMENTNAME', 'time'])
+    df = df.groupby(['userId', 'CASSIGNMENTNAME'], sort=False, group_keys=False) \
+           .apply(sessions.assign_worksessions, threshold=threshold)
+    return df.groupby(['userId', 'CASSIGNMENTNAME', 'workSessionId'], sort=True) \
+             .agg(email=('email', 'first'), projectId=('projectId', 'first'),
+                  start_time=('time', 'min'), end_time=('time', 'max')) \
+             .reset_index()
+
+def timespent(worksessions):
+    """Time spent on each project, the total length of its work sessions (as
+    :meth:`time_spent.get_time_spent` computes it)."""
+    df = worksessions.assign(hoursOnProject=(worksessions['end_time'] - worksessions['start_time'])
+                                            / (3600 * 1000))
+    return df.groupby(['userId', 'CASSIGNMENTNAME'], sort=False) \
+             .agg(email=('email', 'first'), projectId=('projectId', 'first'),
+                  hoursOnProject=('hoursOnProject', 'sum'), projectStartTime=('start_time', 'min')) \
+             .reset_index() \
+             .rename(columns={'CASSIGNMENTNAME': 'assignment'}) \
+             [['userId', 'email', 'projectId', 'assignment', 'hoursOnProject', 'projectStartTime']]
+
+def earlyoften(maptouuids, submissions, due_times):
+    """Early/Often indices (see :meth:`early_often.userearlyoften`)."""
+    import utils
+    import early_often
+    from load_datasets import load_submission_data
+    with open(due_times) as due_file:
+        due_date_data = json.load(due_file)
+    submissions = load_submission_data(submissions)
+    # missing values as empty strings, and local times, as early_often.earlyoften reads them
+    df = maptouuids.astype(object).where(maptouuids.notnull(), '')
+    df['time'] = utils.local_times(maptouuids['time'])
+    grouped, usercol = early_often.groupprojects(df, due_date_data, submissions)
+    return grouped.apply(early_often.userearlyoften, due_date_data=due_date_data,
+                         submissions=submissions, usercol=usercol)
+
+def incchecking(clean):
+    """Incremental checking metrics for each student-project (see
+    :meth:`incremental_checking.userincrementalchecking`)."""
+    import utils
+    from incremental_checking import userincrementalchecking
+    df = clean.assign(time=utils.local_times(clean['time']), **{'Class-Name': clean['Class-Name'].fillna('')})
+    df = utils.ensure_sorted(df, ['userId', 'cleaned_assignment', 'time'])
+    grouped = df.groupby(['userId', 'cleaned_assignment'], sort=False)
+    return grouped[['projectId', 'email']].first() \
+                  .join(grouped.apply(userincrementalchecking)) \
+                  .reset_index() \
+                  .rename(columns={'cleaned_assignment': 'CASSIGNMENTNAME'}) \
+                  [['projectId', 'userId', 'email', 'CASSIGNMENTNAME', 'solutionEditAnyLaunch',
+                    'solutionEditRegularLaunch', 'solutionEditTestLaunch', 'testEditTestLaunch',
+                    'testEditPerSolutionEdit']]
+
+#: The production pipeline. Needs the sources `raw`, `uuids`, `submissions` and `due_times`.
+DEFAULT_STAGES = [
+    Stage('rawtocsv', rawtocsv, ['raw']),
+    Stage('maptouuids', maptouuids, ['rawtocsv', 'uuids']),
+    Stage('clean', clean, ['maptouuids']),
+    Stage('worksessions', worksessions, ['clean'], params={'threshold': 1}),
+    Stage('timespent', timespent, ['worksessions']),
+    Stage('earlyoften', earlyoften, ['maptouuids', 'submissions', 'due_times']),
+    Stage('incchecking', incchecking, ['clean'])
+]
+
+def _signature(stage, inputpaths):
+    """Hash of everything that determines a stage's output."""
+    digest = hashlib.sha256()
+    digest.update(stage.name.encode())
+    digest.update(inspect.getsource(stage.func).encode())
+    # stage functions are thin wrappers, so the modules they call count too
+    digest.update(cache.code_version().encode())
+    digest.update(repr(sorted(stage.params.items())).encode())
+    for name in stage.inputs:
+        digest.update(name.encode())
+        digest.update(cache.fingerprint(inputpaths[name]).encode())
+    return digest.hexdigest()
+
+def _runstage(stage, inputs, outpath):
+    """Run one stage (in a worker process) and write its artifact."""
+    kwargs = {name: load(path) if kind == 'artifact' else path for name, (kind, path) in inputs.items()}
+    kwargs.update(stage.params)
+    with instrument.stage('pipeline.{}'.format(stage.name)) as s:
+        result = stage.func(**kwargs)
+        s.rows_out = len(result)
+    partial = outpath + '.tmp'
+    result.to_pickle(partial)
+    os.replace(partial, outpath)
+    return stage.name
+
+def _validate(stages, sources):
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError('Stage names must be unique')
+    for stage in stages:
+        missing = [i for i in stage.inputs if i not in names and i not in sources]
+        if missing:
+            raise ValueError('Stage {} needs inputs {}, which are neither sources nor stages'
+                             .format(stage.name, missing))
+
+    # reject cycles
+    done = set(sources)
+    remaining = list(stages)
+    while remaining:
+        ready = [s for s in remaining if all(i in done for i in s.inputs)]
+        if not ready:
+            raise ValueError('Stages {} depend on each other in a cycle'.format([s.name for s in remaining]))
+        done.update(s.name for s in ready)
+        remaining = [s for s in remaining if s not in ready]
+
+def _needed(stages, targets):
+    """Returns the stages needed to produce `targets`, in declaration order."""
+    bystage = {s.name: s for s in stages}
+    needed = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name in bystage and name not in needed:
+            needed.add(name)
+            pending.extend(bystage[name].inputs)
+    return [s for s in stages if s.name in needed]
+
+def run(stages, workdir, sources, targets=None, processes=None, force=False):
+    """Run a pipeline, skipping stages whose inputs have not changed.
+
+    Args:
+        stages (list): :class:`Stage` objects. Order does not matter.
+        workdir (str): Directory for artifacts and bookkeeping, reused across runs
+        sources (dict): Maps source names to paths of input files (or directories)
+        targets (list, optional): Names of stages to produce, along with whatever they
+                                  depend on. Defaults to every stage.
+        processes (int, optional): Maximum number of stages run at the same time.
+                                   Defaults to the number of CPUs.
+        force (bool): Rerun every stage, even if its inputs have not changed
+
+    Returns:
+        A *dict* mapping each stage that was run or skipped to the path of its artifact.
+    """
+    _validate(stages, sources)
+    if targets:
+        unknown = [t for t in targets if t not in [s.name for s in stages]]
+        if unknown:
+            raise ValueError('Unknown targets: {}'.format(', '.join(unknown)))
+        stages = _needed(stages, targets)
+
+    os.makedirs(workdir, exist_ok=True)
+    statepath = os.path.join(workdir, 'pipeline-state.json')
+    state = {}
+    if os.path.exists(statepath) and not force:
+        with open(statepath) as statefile:
+            state = json.load(statefile)
+
+    artifacts = {s.name: os.path.join(workdir, '{}.pkl'.format(s.name)) for s in stages}
+    paths = dict(sources)
+    done = {}
+    pending = list(stages)
+    running = {}
+    finished = queue.Queue()
+
+    def inputs_of(stage):
+        return {name: ('artifact' if name in artifacts else 'source', paths[name]) for name in stage.inputs}
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes or os.cpu_count()) as pool:
+        while pending or running:
+            ready = [s for s in pending if all(i in paths for i in s.inputs)]
+            for stage in ready:
+                pending.remove(stage)
+                signature = _signature(stage, paths)
+                if state.get(stage.name) == signature and os.path.exists(artifacts[stage.name]):
+                    instrument.logger.info('pipeline.%s: unchanged, skipped', stage.name)
+                    paths[stage.name] = done[stage.name] = artifacts[stage.name]
+                    continue
+                running[stage.name] = signature
+                pool.apply_async(_runstage, (stage, inputs_of(stage), artifacts[stage.name]),
+                                 callback=lambda name: finished.put((name, None)),
+                                 error_callback=lambda e, name=stage.name: finished.put((name, e)))
+
+            if ready and any(s.name in done for s in ready):
+                continue # skipped stages may have made more stages ready
+            name, error = finished.get()
+            if error is not None:
+                raise RuntimeError('Stage {} failed'.format(name)) from error
+            state[name] = running.pop(name)
+            paths[name] = done[name] = artifacts[name]
+            with open(statepath, 'w') as statefile: # record progress as each stage finishes
+                json.dump(state, statefile, indent=2)
+
+    return done
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('pipeline').parse_args(args)
+
+    sources = dict(source.split('=', 1) for source in args.sources)
+    outputs = run(DEFAULT_STAGES, args.workdir, sources, targets=args.targets,
+                  processes=args.processes, force=args.force)
+    for name, path in outputs.items():
+        if args.csv:
+            load(path).to_csv(os.path.splitext(path)[0] + '.csv')
+        print('{}: {}'.format(name, path))
+
+if __name__ == '__main__':
+    instrument.log_to_stderr()
+    main(sys.argv[1:])
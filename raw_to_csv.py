@@ -41,8 +41,7 @@ def __join_csvs(dirpath):
     
     # match with users and assignments
     uuidpath = os.path.join('data', 'fall-2018', 'cs3114uuids.csv')
-    df = utils.maptouuids(sensordata=df, uuidpath=uuidpath)
-    df = df.sort_values(by=['userName', 'assignment', 'time'], ascending=[1, 1, 1]) 
+    df = utils.maptouuids(sensordata=df, uuidpath=uuidpath) # sorted by userName, assignment, time
     
     # write out
     df.to_csv(outpath, index=False)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Fast, approximate population-level Early/Often figures from a sample of users.
+
+When tuning an analysis we usually only need to know roughly how Early/Often
+measures are distributed across the class, not every student's values.
+:meth:`insample` picks a fraction of users by a stable hash of their names, so
+the same students are picked on every run, on every machine, and in every term
+they appear in; `earlyoften(..., sample=0.05)` runs the usual engine on those
+students only. :meth:`bootstrap` then estimates the population mean and
+quantiles of each measure, with bootstrap confidence intervals. Students (not
+student-projects) are resampled, since a student's projects are not independent
+of each other.
+
+.. code-block:: python
+
+   import sampling
+
+   estimates = sampling.estimate('all.csv', 'submissions.csv', 'due_times.json', fraction=0.05)
+   estimates.loc['byteEarlyOftenIndex', ['mean', 'mean_ci_low', 'mean_ci_high']]
+
+To use:
+    `import sampling`, or
+    ./sampling.py <sensordata> <submissions> <duetimes> <outfile> [--fraction <f>] on the command line
+"""
+import sys
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import cli
+import instrument
+
+#: Quantiles estimated for each measure by :meth:`bootstrap`
+QUANTILES = {'q25': 0.25, 'median': 0.5, 'q75': 0.75}
+
+def _position(user):
+    """A stable pseudo-random position in [0, 1) for a user. Email domains are
+    ignored, as in :meth:`shards.shard_of`, which uses the first 32 bits of the
+    same hash; the last 32 are used here so that samples don't follow shards."""
+    user = str(user).split('@')[0]
+    return int(hashlib.md5(user.encode('utf-8')).hexdigest()[-8:], 16) / 16**8
+
+def insample(users, fraction):
+    """Which users are in a deterministic sample of the given size.
+
+    Args:
+        users (list-like): User identifiers (e.g., a user column of sensordata)
+        fraction (float): Fraction of users to keep, in (0, 1]. Users in a smaller
+                          sample are always in a larger one.
+
+    Returns:
+        A boolean array, *True* for users in the sample.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError('fraction must be in (0, 1]. Got {}.'.format(fraction))
+    codes, uniques = pd.factorize(pd.Series(users).astype(str))
+    positions = np.array([_position(user) for user in uniques])
+    return positions[codes] < fraction if len(uniques) else np.zeros(len(codes), dtype=bool)
+
+def _weightedquantiles(values, cumulative, totals, q):
+    """The q-quantile (inverted CDF) of sorted `values`, for each row of cumulative
+    weights, or *NaN* where a row has no weight."""
+    positions = (cumulative < q * totals[:, None]).sum(axis=1)
+    estimates = values[np.minimum(positions, len(values) - 1)]
+    return np.where(totals > 0, estimates, np.nan)
+
+@instrument.instrumented('sampling.bootstrap')
+def bootstrap(results, replicates=1000, confidence=0.95, quantiles=QUANTILES, seed=0):
+    """Estimate the population mean and quantiles of each measure, with
+    percentile bootstrap confidence intervals.
+
+    All replicates are drawn at once: a matrix of how many times each student is
+    drawn in each replicate weights that student's rows, so each statistic is a
+    few matrix operations rather than a loop over replicates.
+
+    Args:
+        results (DataFrame): Per student-project measures, indexed by (user, assignment),
+                             as returned by :meth:`early_often.earlyoften`
+        replicates (int): Number of bootstrap replicates
+        confidence (float): Confidence level of the intervals
+        quantiles (dict): Names and values of the quantiles to estimate
+        seed (int): Seed for the random number generator, so that runs are repeatable
+
+    Returns:
+        A *DataFrame* with a row for each measure, and columns `n` (student-projects
+        with a value), `mean` and each quantile, each followed by its `_ci_low` and
+        `_ci_high` bounds.
+    """
+    if not 0 < confidence < 1:
+        raise ValueError('confidence must be in (0, 1). Got {}.'.format(confidence))
+    users = pd.Series(results.index.get_level_values(0)).astype(str).str.split('@').str[0]
+    codes, uniques = pd.factorize(users)
+    rng = np.random.default_rng(seed)
+    draws = rng.integers(0, len(uniques), size=(replicates, len(uniques)))
+    offsets = np.arange(replicates)[:, None] * len(uniques)
+    counts = np.bincount((draws + offsets).ravel(), minlength=replicates * len(uniques)) \
+               .reshape(replicates, len(uniques))
+    bounds = [(1 - confidence) / 2, (1 + confidence) / 2]
+
+    estimates = {}
+    for column in results.columns:
+        values = pd.to_numeric(results[column], errors='coerce').values.astype(float)
+        keep = ~np.isnan(values)
+        order = np.argsort(values[keep], kind='mergesort')
+        values, valuecodes = values[keep][order], codes[keep][order]
+        row = {'n': len(values)}
+        if not len(values):
+            estimates[column] = row
+            continue
+
+        weights = counts[:, valuecodes]
+        totals = weights.sum(axis=1)
+        cumulative = np.cumsum(weights, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            statistics = {'mean': (values.mean(), (weights @ values) / totals)}
+        ones = np.arange(1, len(values) + 1)[None, :]
+        for name, q in quantiles.items():
+            statistics[name] = (_weightedquantiles(values, ones, np.array([len(values)]), q)[0],
+                                _weightedquantiles(values, cumulative, totals, q))
+        for name, (estimate, replicated) in statistics.items():
+            row[name] = estimate
+            row[name + '_ci_low'], row[name + '_ci_high'] = np.nanquantile(replicated, bounds)
+        estimates[column] = row
+
+    return pd.DataFrame.from_dict(estimates, orient='index')
+
+def estimate(infile, submissionpath, duetimepath, fraction=0.05, outfile=None, replicates=1000,
+             confidence=0.95, seed=0, **kwargs):
+    """Run Early/Often on a sample of users, and estimate population figures from it.
+
+    Args:
+        infile (str): Path to sensordata (see :meth:`early_often.earlyoften`)
+        submissionpath (str): Path to Web-CAT submissions
+        duetimepath (str): Path to a JSON file of due dates
+        fraction (float): Fraction of users to sample (see :meth:`insample`)
+        outfile (str, optional): Path to write the estimates to. If *None*, they are returned.
+        replicates (int): Number of bootstrap replicates
+        confidence (float): Confidence level of the intervals
+        seed (int): Seed for the bootstrap
+        **kwargs: Passed on to :meth:`early_often.earlyoften` (e.g., `deadlines`)
+
+    Returns:
+        A *DataFrame* (see :meth:`bootstrap`) if no *outfile* is specified. *None* otherwise.
+    """
+    from early_often import earlyoften # which uses insample, from this module
+    results = earlyoften(infile, submissionpath, duetimepath, sample=fraction, **kwargs)
+    estimates = bootstrap(results, replicates=replicates, confidence=confidence, seed=seed)
+    if outfile:
+        estimates.to_csv(outfile)
+    else:
+        return estimates
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('estimate').parse_args(args)
+
+    try:
+        estimate(args.infile, args.submissions, args.duetimes, fraction=args.fraction,
+                 outfile=args.outfile, replicates=args.replicates, confidence=args.confidence,
+                 deadlines=args.deadlines)
+    except FileNotFoundError as e:
+        print("Error! File '%s' does not exist." % e.filename)
+
+if __name__ == '__main__':
+    instrument.log_to_stderr()
+    main(sys.argv[1:])
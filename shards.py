@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""Sharded execution of long-running analyses, with mergeable partial results.
+
+Inputs are partitioned into N shards by a stable hash of the user, so all of a
+student's events (and submissions) land in the same shard. Each shard is a
+self-contained directory that can be copied to, and run on, a separate node
+with only its local filesystem. Since students never span shards, merging the
+per-shard outputs gives the same result as a single-node run.
+
+.. code-block:: bash
+
+   ./shards.py partition 8 shards/ sensordata=all.csv submissions=subs.csv due_times=due_times.json
+   # on each node i:
+   ./shards.py run earlyoften shards/shard-0000i shards/partial-0000i.pkl
+   # once all nodes are done:
+   ./shards.py merge results.csv 'shards/partial-*.pkl'
+
+Or, with local processes standing in for nodes, :meth:`runlocal`.
+
+Partial results computed with `digests=True` (see :mod:`sketches`) can also be
+merged when the same student-project appears in more than one of them, e.g.
+from runs over successive slices of a term's events: see :meth:`merge`.
+
+To use:
+    `import shards`
+"""
+import os
+import sys
+import csv
+import json
+import glob
+import shutil
+import hashlib
+import multiprocessing
+
+import pandas as pd
+
+import cli
+import utils
+import sketches
+import instrument
+
+#: Inputs that are copied whole into every shard, rather than partitioned
+REPLICATED = ['due_times']
+
+def shard_of(user, nshards):
+    """Returns the shard (in `range(nshards)`) for a user. Email domains are
+    ignored, so `jdoe@vt.edu` and `jdoe` map to the same shard. The hash is
+    stable across runs, machines and Python versions."""
+    user = str(user).split('@')[0]
+    return int(hashlib.md5(user.encode('utf-8')).hexdigest()[:8], 16) % nshards
+
+def _sharddir(outdir, shard):
+    return os.path.join(outdir, 'shard-{:05d}'.format(shard))
+
+def _partitionfile(inpath, outdir, name, nshards):
+    """Stream a CSV into per-shard files, by a hash of its user column."""
+    filename = os.path.basename(inpath)
+    outfiles = [open(os.path.join(_sharddir(outdir, s), filename), 'w', newline='')
+                for s in range(nshards)]
+    shards = {}
+    with open(inpath, 'r', newline='') as infile, \
+            instrument.stage('shards.partition.{}'.format(name)) as stage:
+        reader = csv.reader(infile)
+        header = next(reader)
+        usercol, _ = utils.group_columns(header)
+        position = header.index(usercol)
+        writers = [csv.writer(f) for f in outfiles]
+        for writer in writers:
+            writer.writerow(header)
+
+        stage.rows_in = 0
+        for row in reader:
+            user = row[position]
+            if user not in shards:
+                shards[user] = shard_of(user, nshards)
+            writers[shards[user]].writerow(row)
+            stage.rows_in += 1
+
+    for f in outfiles:
+        f.close()
+    return filename
+
+def partition(inputs, outdir, nshards):
+    """Partition input files into shards.
+
+    Args:
+        inputs (dict): Maps input names (e.g. `sensordata`, `submissions`, `debugger`,
+                       `due_times`) to paths. CSV inputs are partitioned by their user
+                       column; inputs named in :attr:`REPLICATED` are copied to every shard.
+        outdir (str): Directory in which shard directories are created
+        nshards (int): Number of shards
+
+    Returns:
+        A *list* of shard directories. Each contains its share of the inputs and an
+        `inputs.json` mapping input names to filenames.
+    """
+    sharddirs = [_sharddir(outdir, s) for s in range(nshards)]
+    for sharddir in sharddirs:
+        os.makedirs(sharddir, exist_ok=True)
+
+    filenames = {}
+    for name, path in inputs.items():
+        if name in REPLICATED:
+            for sharddir in sharddirs:
+                shutil.copy(path, sharddir)
+            filenames[name] = os.path.basename(path)
+        else:
+            filenames[name] = _partitionfile(path, outdir, name, nshards)
+
+    for sharddir in sharddirs:
+        with open(os.path.join(sharddir, 'inputs.json'), 'w') as manifest:
+            json.dump(filenames, manifest)
+
+    return sharddirs
+
+def _earlyoften(inputs, **options):
+    from early_often import earlyoften
+    return earlyoften(inputs['sensordata'], inputs['submissions'], inputs['due_times'], **options)
+
+def _getdebugsessions(inputs, **options):
+    from debugging import getdebugsessions, collapsesessions
+    sessions = getdebugsessions(debuggerusepath=inputs['debugger'])
+    return collapsesessions(sessions, **options) if options else sessions
+
+#: Analyses that can be run on shards, and the inputs each one needs
+TASKS = {
+    'earlyoften': (_earlyoften, ['sensordata', 'submissions', 'due_times']),
+    'getdebugsessions': (_getdebugsessions, ['debugger'])
+}
+
+def runshard(task, sharddir, outfile, options=None):
+    """Run an analysis on one shard, and write its partial result.
+
+    Args:
+        task (str): One of :attr:`TASKS`
+        sharddir (str): A shard directory created by :meth:`partition`
+        outfile (str): Path to write the partial result to (a pickled DataFrame)
+        options (dict, optional): Keyword arguments for the analysis, e.g.
+            `{'quantiles': 'sketch', 'digests': True}` for :meth:`early_often.earlyoften`.
+            Debugger sessions are collapsed (see :meth:`debugging.collapsesessions`)
+            with these options if any are given.
+    """
+    func, needed = TASKS[task]
+    with open(os.path.join(sharddir, 'inputs.json')) as manifest:
+        inputs = {name: os.path.join(sharddir, f) for name, f in json.load(manifest).items()}
+    missing = [name for name in needed if name not in inputs]
+    if missing:
+        raise ValueError('{} needs inputs {}, missing from {}'.format(task, missing, sharddir))
+
+    with instrument.stage('shards.run.{}'.format(task)) as stage:
+        result = func(inputs, **(options or {}))
+        stage.rows_out = len(result)
+    result.to_pickle(outfile)
+    return outfile
+
+def _mergedigests(result):
+    """Combine the rows for each student-project that appears more than once: its
+    digests are merged, and its sketched medians estimated again from them."""
+    digestcols = [c for c in result.columns if c.endswith(sketches.DIGEST_SUFFIX)]
+    repeated = result.index.duplicated(keep=False)
+    rows = {}
+    for key, group in result[repeated].groupby(level=list(range(result.index.nlevels)), sort=False):
+        row = {}
+        for col in digestcols:
+            digest = sketches.mergeall(group[col])
+            median = col[:-len(sketches.DIGEST_SUFFIX)]
+            # estimates sit beside exact medians in validate mode
+            median = median + 'Sketch' if median + 'Sketch' in result.columns else median
+            estimate = digest.median()
+            if pd.api.types.is_datetime64_any_dtype(result[median]) and not pd.isnull(estimate):
+                estimate = pd.Timestamp(int(estimate))
+            row[col] = sketches.dumps(digest)
+            row[median] = estimate
+        rows[key] = row
+
+    merged = pd.DataFrame(list(rows.values()), columns=result.columns,
+                          index=pd.MultiIndex.from_tuples(list(rows), names=result.index.names))
+    return pd.concat([result[~repeated], merged], sort=False)
+
+def merge(partials, outfile=None):
+    """Combine partial results from each shard into the result a single-node run
+    would have given.
+
+    Since users never span shards, each student-project normally appears in one
+    partial result. One that appears in several (e.g., in partial results from
+    successive slices of the events) is combined into one row if the results have
+    digest columns (see :mod:`sketches`): the digests are merged, and the medians
+    they estimate are estimated from the merged digests. Its other measures can't
+    be combined this way, and are left empty.
+
+    Args:
+        partials (list): Paths to partial results written by :meth:`runshard`
+        outfile (str, optional): Path to a CSV file to write the merged result to.
+            If *None*, the result is returned as a DataFrame.
+    """
+    frames = [pd.read_pickle(p) for p in partials]
+    frames = [f for f in frames if len(f)]
+    result = pd.concat(frames, sort=False) if frames else pd.DataFrame()
+    if result.index.has_duplicates and result.columns.str.endswith(sketches.DIGEST_SUFFIX).any():
+        result = _mergedigests(result)
+    result = result.sort_index()
+
+    if outfile:
+        result.to_csv(outfile)
+    else:
+        return result
+
+def _runshard(args):
+    return runshard(*args)
+
+def runlocal(task, inputs, nshards, workdir, processes=None, options=None):
+    """Partition, run and merge on this machine, with one process per shard
+    standing in for a node.
+
+    Args:
+        task (str): One of :attr:`TASKS`
+        inputs (dict): Input paths, as for :meth:`partition`
+        nshards (int): Number of shards
+        workdir (str): Directory for shards and partial results
+        processes (int, optional): Number of worker processes. Defaults to `nshards`.
+        options (dict, optional): Keyword arguments for the analysis (see :meth:`runshard`)
+
+    Returns:
+        The merged result, as a *DataFrame*.
+    """
+    sharddirs = partition(inputs, workdir, nshards)
+    jobs = [(task, d, os.path.join(workdir, 'partial-{:05d}.pkl'.format(s)), options)
+            for s, d in enumerate(sharddirs)]
+    with multiprocessing.get_context('spawn').Pool(processes or nshards) as pool:
+        partials = pool.map(_runshard, jobs)
+
+    return merge(partials)
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('shards').parse_args(args)
+
+    if args.command == 'partition':
+        inputs = dict(arg.split('=', 1) for arg in args.inputs)
+        for sharddir in partition(inputs, args.outdir, args.nshards):
+            print(sharddir)
+    elif args.command == 'run':
+        runshard(args.task, args.sharddir, args.outfile)
+    else:
+        partials = [p for pattern in args.partials for p in sorted(glob.glob(pattern))]
+        merge(partials, outfile=args.outfile)
+
+if __name__ == '__main__':
+    instrument.log_to_stderr()
+    main(sys.argv[1:])
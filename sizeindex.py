@@ -0,0 +1,203 @@
+"""A precomputed history of code size, for point-in-time size queries without
+replaying Edit events.
+
+:meth:`early_often.userearlyoften` and :mod:`incremental_checking` rebuild the
+current size of each class by replaying every Edit event in order. A
+:class:`SizeIndex` does that once: for each (user, assignment, Class-Name) it
+keeps the sorted history of `Current-Size`, `Current-Statements`,
+`Current-Methods` and `Current-Test-Assertions`, and for each student-project
+the running total of those sizes (and of the absolute changes to them) across
+all classes. Questions like "how big was the project at time t" or "how much
+code changed between t1 and t2" are then binary searches, and thousands of them
+(e.g., one at every launch or submission) are answered in one vectorised call.
+
+.. code-block:: python
+
+   from sizeindex import SizeIndex
+
+   index = SizeIndex(load_datasets.load_edits(sensordata_path='all.csv').reset_index())
+   index.size('student00001', 'Project 1', 1537484400000)           # bytes, at the due date
+   launches['projectBytes'] = index.sizes(launches['userName'], launches['assignment'],
+                                          launches['time'])
+
+Times are in milliseconds, as in sensordata. A size "at" time t includes edits
+made at t.
+
+To use:
+    `from sizeindex import SizeIndex`
+"""
+import numpy as np
+import pandas as pd
+
+import utils
+import instrument
+import compaction
+
+#: Measures kept in the index, and the sensordata columns they come from
+MEASURES = {
+    'bytes': 'Current-Size',
+    'statements': 'Current-Statements',
+    'methods': 'Current-Methods',
+    'assertions': 'Current-Test-Assertions'
+}
+
+class _Segments:
+    """Sorted (segment, time) keys, for finding the last entry at or before a time
+    in many segments at once."""
+
+    def __init__(self, codes, times):
+        self.tmin = int(times.min()) if len(times) else 0
+        self.span = int(times.max()) - self.tmin + 1 if len(times) else 1
+        if (int(codes.max()) + 1 if len(codes) else 1) * (self.span + 1) >= 2**62:
+            raise ValueError('Too many segments over too long a time to index together')
+        self.keys = codes.astype(np.int64) * (self.span + 1) + (times.astype(np.int64) - self.tmin)
+        self.starts = np.searchsorted(self.keys, np.arange(int(codes.max()) + 2 if len(codes) else 1)
+                                      * (self.span + 1))
+
+    def last(self, codes, times):
+        """Positions of the last entry at or before each time in each segment, or -1
+        if there is none (or the segment is unknown, given as code -1)."""
+        codes = np.asarray(codes, dtype=np.int64)
+        offsets = np.clip(np.asarray(times, dtype=np.int64) - self.tmin, -1, self.span - 1)
+        positions = np.searchsorted(self.keys, codes * (self.span + 1) + offsets, side='right') - 1
+        known = (codes >= 0) & (codes < len(self.starts) - 1)
+        valid = known & (positions >= self.starts[np.where(known, codes, 0)])
+        return np.where(valid, positions, -1)
+
+class SizeIndex:
+    """Size histories of every class in every student-project.
+
+    Args:
+        edits (DataFrame): Edit events with `time` (milliseconds), `Class-Name`,
+            size columns (see :attr:`MEASURES`) and user and assignment columns (see
+            :meth:`utils.group_columns`). Other event types and edits with no class
+            name are ignored, and the events need not be sorted.
+    """
+
+    @instrument.instrumented('sizeindex.build')
+    def __init__(self, edits):
+        usercol, assignmentcol = utils.group_columns(edits.columns)
+        edits = edits.fillna('')
+        if 'Type' in edits.columns:
+            edits = edits[edits['Type'] == 'Edit']
+        edits = edits[edits['Class-Name'] != '']
+
+        keys = [edits[usercol].astype(str), edits[assignmentcol].astype(str)]
+        self.projects = pd.MultiIndex.from_arrays(keys).unique()
+        self.classes = pd.MultiIndex.from_arrays(keys + [edits['Class-Name'].astype(str)]).unique()
+        projectcodes = self.projects.get_indexer(pd.MultiIndex.from_arrays(keys))
+        classcodes = self.classes.get_indexer(
+            pd.MultiIndex.from_arrays(keys + [edits['Class-Name'].astype(str)]))
+        times = pd.to_numeric(edits['time']).values.astype(np.int64)
+
+        # per class: the value of each measure after each edit, in time order
+        order = np.lexsort((times, classcodes))
+        self._classcodes = classcodes[order]
+        self._classtimes = times[order]
+        self._classprojects = projectcodes[order]
+        self._classes = _Segments(self._classcodes, self._classtimes)
+
+        self._values = {}
+        deltas, churn = {}, {}
+        for measure, column in MEASURES.items():
+            raw = edits[column].values[order] if column in edits.columns else np.full(len(order), '')
+            present = raw != ''
+            values = np.zeros(len(order), dtype=np.int64)
+            values[present] = pd.to_numeric(raw[present]).astype(np.int64)
+            # a missing value (e.g., assertions in a solution class) leaves the size as it was
+            last = np.where(present, np.arange(len(order)), -1)
+            last = np.maximum.accumulate(last) if len(last) else last
+            firstofclass = self._classes.starts[self._classcodes] if len(order) else last
+            carried = np.where(last >= firstofclass, values[np.maximum(last, 0)], 0)
+            previous = np.concatenate([[0], carried[:-1]])
+            previous[np.arange(len(order)) == firstofclass] = 0
+            self._values[measure] = np.where(last >= firstofclass, carried, -1)
+            deltas[measure] = carried - previous
+            # edits merged by compaction.compact record how much they changed in total
+            churn[measure] = np.abs(deltas[measure])
+            if compaction.CHANGED[column] in edits.columns:
+                recorded = edits[compaction.CHANGED[column]].values[order]
+                merged = recorded != ''
+                churn[measure][merged] = pd.to_numeric(recorded[merged]).astype(np.int64)
+
+        # per project: running totals of size and of absolute change, in time order
+        projectorder = np.lexsort((self._classtimes, self._classprojects))
+        self._projecttimes = self._classtimes[projectorder]
+        self._projects = _Segments(self._classprojects[projectorder], self._projecttimes)
+        self._totals, self._churn = {}, {}
+        for measure, delta in deltas.items():
+            self._totals[measure] = self._segmentcumsum(delta[projectorder])
+            self._churn[measure] = self._segmentcumsum(churn[measure][projectorder])
+
+    def _segmentcumsum(self, values):
+        totals = np.cumsum(values)
+        starts = self._projects.starts[:-1]
+        before = np.concatenate([[0], totals])[starts] # running total before each project
+        counts = np.diff(self._projects.starts)
+        return totals - np.repeat(before, counts)
+
+    def _projectcodes(self, users, assignments):
+        lookup = pd.MultiIndex.from_arrays([pd.Index(users).astype(str),
+                                            pd.Index(assignments).astype(str)])
+        return self.projects.get_indexer(lookup)
+
+    def _check(self, measure):
+        if measure not in MEASURES:
+            raise ValueError('Unknown measure {}; use one of {}'.format(measure, list(MEASURES)))
+
+    def sizes(self, users, assignments, times, measure='bytes'):
+        """Total size of each student-project at each time.
+
+        Args:
+            users (list-like): User for each query
+            assignments (list-like): Assignment for each query
+            times (list-like): Time for each query, in milliseconds
+            measure (str): One of :attr:`MEASURES`
+
+        Returns:
+            An array of sizes: 0 before the first edit, and *NaN* for student-projects
+            with no edits at all.
+        """
+        self._check(measure)
+        codes = self._projectcodes(users, assignments)
+        positions = self._projects.last(codes, times)
+        result = np.where(positions >= 0, self._totals[measure][np.maximum(positions, 0)], 0)
+        return np.where(codes >= 0, result, np.nan)
+
+    def size(self, user, assignment, time, measure='bytes'):
+        """Total size of one student-project at one time (see :meth:`sizes`)."""
+        return self.sizes([user], [assignment], [time], measure=measure)[0]
+
+    def deltas(self, users, assignments, starts, ends, measure='bytes'):
+        """Net change in size of each student-project between two times."""
+        return self.sizes(users, assignments, ends, measure) - \
+               self.sizes(users, assignments, starts, measure)
+
+    def churn(self, users, assignments, starts, ends, measure='bytes'):
+        """Total absolute change in size of each student-project's classes between two
+        times: the amount of code written, as Early/Often counts it."""
+        self._check(measure)
+        codes = self._projectcodes(users, assignments)
+        totals = []
+        for times in (starts, ends):
+            positions = self._projects.last(codes, times)
+            totals.append(np.where(positions >= 0, self._churn[measure][np.maximum(positions, 0)], 0))
+        return np.where(codes >= 0, totals[1] - totals[0], np.nan)
+
+    def classsizes(self, users, assignments, classes, times, measure='bytes'):
+        """Size of individual classes at each time (*NaN* before the class has a value)."""
+        self._check(measure)
+        lookup = pd.MultiIndex.from_arrays([pd.Index(users).astype(str), pd.Index(assignments).astype(str),
+                                            pd.Index(classes).astype(str)])
+        positions = self._classes.last(self.classes.get_indexer(lookup), times)
+        values = self._values[measure][np.maximum(positions, 0)]
+        return np.where((positions >= 0) & (values >= 0), values, np.nan)
+
+    def history(self, user, assignment, classname):
+        """The full size history of one class, as a *DataFrame* indexed by time."""
+        code = self.classes.get_indexer(pd.MultiIndex.from_tuples([(user, assignment, classname)]))[0]
+        if code < 0:
+            raise ValueError('No edits to {} by {} on {}'.format(classname, user, assignment))
+        start, end = self._classes.starts[code], self._classes.starts[code + 1]
+        return pd.DataFrame({measure: values[start:end] for measure, values in self._values.items()},
+                            index=pd.Index(self._classtimes[start:end], name='time')).replace(-1, np.nan)
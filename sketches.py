@@ -0,0 +1,223 @@
+"""Mergeable quantile sketches.
+
+A :class:`TDigest` summarises a (weighted) distribution in a bounded number of
+centroids, and estimates its quantiles. Accuracy is set by `compression`:
+larger values keep more centroids and give more accurate estimates, especially
+near the median. Digests built separately (on different shards, or in
+different runs) can be merged, and saved as JSON.
+
+.. code-block:: python
+
+   import sketches
+   from sketches import TDigest
+
+   left = TDigest(compression=100)
+   left.addmany([3, 1, 4, 1, 5])
+   right = sketches.loads(saved)
+   left.merge(right).median()
+
+Functions that report medians (e.g., :meth:`early_often.userearlyoften` and
+:meth:`debugging.collapsesessions`) take a `quantiles` argument, one of
+:attr:`QUANTILE_MODES`:
+
+* `exact`: compute medians from the full list of values (the default)
+* `sketch`: estimate medians with a :class:`TDigest`
+* `validate`: compute exact medians, and report estimates next to them in
+  columns suffixed with `Sketch`
+
+With `digests=True` (and `quantiles` other than `exact`), they also keep each
+digest, serialized with :meth:`dumps`, in a column named after its median with
+:attr:`DIGEST_SUFFIX` added (e.g., `byteEditMedianDigest`). :meth:`shards.merge`
+merges the digests of a student-project found in several partial results, and
+a column of digests can be merged into one, e.g. for the median over a class:
+
+.. code-block:: python
+
+   results = early_often.earlyoften(..., quantiles='sketch', digests=True)
+   sketches.mergeall(results['byteEditMedianDigest']).median()
+
+To use:
+    `import sketches`
+"""
+import json
+import math
+
+import numpy as np
+
+#: Ways of computing medians
+QUANTILE_MODES = ('exact', 'sketch', 'validate')
+
+#: Suffix of the columns holding serialized digests, after the name of the median they estimate
+DIGEST_SUFFIX = 'Digest'
+
+def check_mode(quantiles, digests=False):
+    """Raises a ValueError if `quantiles` is not one of :attr:`QUANTILE_MODES`, or if
+    `digests` are asked for without sketching."""
+    if quantiles not in QUANTILE_MODES:
+        raise ValueError('quantiles must be one of {}, not {}'.format(QUANTILE_MODES, quantiles))
+    if digests and quantiles == 'exact':
+        raise ValueError('digests are only kept if quantiles is sketch or validate')
+
+class TDigest:
+    """A merging t-digest (Dunning & Ertl, 2019).
+
+    Args:
+        compression (float): Accuracy parameter. The digest keeps roughly
+                             `compression / 2` centroids at most.
+    """
+
+    def __init__(self, compression=100):
+        if compression <= 0:
+            raise ValueError('compression must be positive')
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer = []
+
+    @property
+    def count(self):
+        """Total weight of the values added so far."""
+        self._compress()
+        return float(self.weights.sum())
+
+    def add(self, value, weight=1):
+        """Add a value to the digest, with an optional weight."""
+        if weight <= 0:
+            return
+        self._buffer.append((value, weight))
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def addmany(self, values, weights=None):
+        """Add many values at once."""
+        values = np.asarray(values, dtype=float)
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float)
+        keep = weights > 0
+        self._compress(values[keep], weights[keep])
+
+    def merge(self, other):
+        """Merge another digest into this one. Returns this digest."""
+        other._compress()
+        self._compress(other.means, other.weights)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def _compress(self, values=None, weights=None):
+        """Merge buffered (and given) values into the centroids."""
+        if self._buffer:
+            buffered = np.array(self._buffer, dtype=float)
+            self._buffer = []
+            values = buffered[:, 0] if values is None else np.r_[values, buffered[:, 0]]
+            weights = buffered[:, 1] if weights is None else np.r_[weights, buffered[:, 1]]
+        if values is None or not len(values):
+            return
+
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        means = np.r_[self.means, values]
+        masses = np.r_[self.weights, weights]
+        order = np.argsort(means, kind='mergesort')
+        means, masses = means[order], masses[order]
+
+        total = masses.sum()
+        scale = self.compression / (2 * math.pi)
+        k = lambda q: scale * math.asin(2 * min(q, 1.0) - 1)
+
+        merged_means = []
+        merged_weights = []
+        mean, weight = means[0], masses[0]
+        before = 0.0
+        kleft = k(0.0)
+        for x, w in zip(means[1:], masses[1:]):
+            if k((before + weight + w) / total) - kleft <= 1:
+                weight += w
+                mean += (x - mean) * w / weight
+            else:
+                merged_means.append(mean)
+                merged_weights.append(weight)
+                before += weight
+                kleft = k(before / total)
+                mean, weight = x, w
+        merged_means.append(mean)
+        merged_weights.append(weight)
+
+        self.means = np.array(merged_means)
+        self.weights = np.array(merged_weights)
+
+    def quantile(self, q):
+        """Estimate the `q`-th quantile (0 <= q <= 1). Returns *NaN* if the digest is empty."""
+        self._compress()
+        if not len(self.means):
+            return np.nan
+        if len(self.means) == 1:
+            return float(self.means[0])
+
+        target = q * self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        if target <= centers[0]:
+            return float(self._between(self.min, self.means[0], 0, centers[0], target))
+        if target >= centers[-1]:
+            return float(self._between(self.means[-1], self.max, centers[-1], self.weights.sum(), target))
+        i = int(np.searchsorted(centers, target, side='right'))
+        return float(self._between(self.means[i - 1], self.means[i], centers[i - 1], centers[i], target))
+
+    @staticmethod
+    def _between(low, high, lowrank, highrank, target):
+        if highrank <= lowrank:
+            return low
+        return low + (high - low) * (target - lowrank) / (highrank - lowrank)
+
+    def median(self):
+        """Estimate the median."""
+        return self.quantile(0.5)
+
+    def to_dict(self):
+        """Returns the digest as a JSON-friendly *dict*."""
+        self._compress()
+        return {
+            'compression': self.compression,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'centroids': [[float(m), float(w)] for m, w in zip(self.means, self.weights)]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores a digest saved with :meth:`to_dict`."""
+        digest = cls(compression=data['compression'])
+        if data['centroids']:
+            centroids = np.array(data['centroids'], dtype=float)
+            digest.means, digest.weights = centroids[:, 0], centroids[:, 1]
+            digest.min, digest.max = data['min'], data['max']
+        return digest
+
+def digest(values, weights=None, compression=100):
+    """Returns a :class:`TDigest` of (optionally weighted) values."""
+    result = TDigest(compression=compression)
+    result.addmany(values, weights)
+    return result
+
+def median(values, weights=None, compression=100):
+    """Estimate the median of (optionally weighted) values with a :class:`TDigest`."""
+    return digest(values, weights, compression=compression).median()
+
+def dumps(digest):
+    """Serialize a :class:`TDigest` as a JSON string, e.g. to keep it in a CSV column."""
+    return json.dumps(digest.to_dict(), separators=(',', ':'))
+
+def loads(text):
+    """Restores a digest serialized with :meth:`dumps`."""
+    return TDigest.from_dict(json.loads(text))
+
+def mergeall(serialized):
+    """Merge serialized digests (such as a column of them) into one :class:`TDigest`.
+    Missing values are skipped. The result has the compression of the first digest."""
+    merged = None
+    for text in serialized:
+        if not isinstance(text, str) or not text:
+            continue
+        merged = loads(text) if merged is None else merged.merge(loads(text))
+    return merged if merged is not None else TDigest()
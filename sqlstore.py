@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""An indexed SQLite store of events, for ad hoc questions that shouldn't need a
+whole CSV in memory.
+
+:meth:`build` bulk-loads sensordata (or debugger events) into a table, in
+batched transactions with the database in WAL mode, and indexes it on
+(userName, assignment, time) and (Type, Subtype). `userName` and `assignment`
+are added if the source names them differently (`email` or `userId`,
+`CASSIGNMENTNAME`). Every other column is kept as text, exactly as it appears in
+the CSV; `time` is stored as a number so that ranges use the index.
+
+:class:`EventStore` answers filtered queries with DataFrames, and
+:meth:`load_datasets.load_edits`, :meth:`load_datasets.load_launches` and
+:meth:`debugging.getdebugsessions` accept a store wherever they accept a CSV,
+pushing their filters into SQL.
+
+.. code-block:: python
+
+   import sqlstore
+
+   sqlstore.build('data/fall-2018/all.csv', 'events.db')
+   sqlstore.build('data/fall-2016/debugger-use.csv', 'events.db', table=sqlstore.DEBUGGER_TABLE)
+
+   store = sqlstore.EventStore('events.db')
+   # all Launch events for a student on Project 3 after milestone 2
+   launches = store.events(users=['student00001'], assignments=['Project 3'],
+                           types=['Launch'], start=1539039600000)
+   # Termination events with failures in the last 48 hours
+   failures = store.events(types=['Termination'], start=now - 48 * 3600 * 1000,
+                           where='"Unit-Name" != \'\'')
+
+To use:
+    `import sqlstore`, or
+    ./sqlstore.py <infile> <database> [--table <name>] on the command line
+"""
+import os
+import sys
+import sqlite3
+
+import pandas as pd
+
+import cli
+import utils
+import instrument
+
+#: Table that sensordata is loaded into by default
+SENSORDATA_TABLE = 'events'
+
+#: Table that debugger events are loaded into, and read from by :mod:`debugging`
+DEBUGGER_TABLE = 'debugger'
+
+_HEADER = b'SQLite format 3\x00'
+
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+def isstore(path):
+    """Returns *True* if `path` is an SQLite database."""
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as infile:
+        return infile.read(len(_HEADER)) == _HEADER
+
+def connect(dbpath):
+    """Open a connection to a store, in WAL mode so that readers don't block a writer."""
+    connection = sqlite3.connect(dbpath)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+def _keycolumns(chunk):
+    """Add `userName` and `assignment` columns to a chunk, if it names them differently."""
+    usercol, assignmentcol = utils.group_columns(chunk.columns)
+    if 'userName' not in chunk.columns:
+        chunk['userName'] = chunk[usercol].str.split('@').str[0] if usercol == 'email' else chunk[usercol]
+    if 'assignment' not in chunk.columns:
+        chunk['assignment'] = chunk[assignmentcol]
+    return chunk
+
+@instrument.instrumented('sqlstore.build')
+def build(infile, dbpath, table=SENSORDATA_TABLE, chunksize=100000):
+    """Bulk-load events from a CSV file into a table of a store, creating the store,
+    table and indexes if needed. Loading the same table again appends to it; columns
+    the table doesn't have yet are added.
+
+    Args:
+        infile (str): Path to a CSV of events, with a user column, an assignment
+                      column and `time`
+        dbpath (str): Path to the SQLite database
+        table (str): Table to load into
+        chunksize (int): Number of rows inserted per transaction
+
+    Returns:
+        The number of rows loaded.
+    """
+    connection = connect(dbpath)
+    count = 0
+    try:
+        for chunk in pd.read_csv(infile, dtype=str, na_values=[], keep_default_na=False,
+                                 chunksize=chunksize):
+            chunk = _keycolumns(chunk)
+            existing = [row[1] for row in connection.execute('PRAGMA table_info({})'.format(_quote(table)))]
+            if not existing:
+                columns = ', '.join('{} {}'.format(_quote(col), 'NUMERIC' if col == 'time' else 'TEXT')
+                                    for col in chunk.columns)
+                connection.execute('CREATE TABLE {} ({})'.format(_quote(table), columns))
+            else:
+                for col in chunk.columns:
+                    if col not in existing:
+                        connection.execute("ALTER TABLE {} ADD COLUMN {} TEXT DEFAULT ''"
+                                           .format(_quote(table), _quote(col)))
+
+            chunk['time'] = pd.to_numeric(chunk['time'])
+            sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+                _quote(table), ', '.join(_quote(col) for col in chunk.columns),
+                ', '.join('?' * len(chunk.columns)))
+            with connection: # one transaction per chunk
+                connection.executemany(sql, chunk.astype(object).itertuples(index=False, name=None))
+            count += len(chunk)
+
+        with connection:
+            connection.execute('CREATE INDEX IF NOT EXISTS {} ON {} (userName, assignment, time)'
+                               .format(_quote('{}_user_assignment_time'.format(table)), _quote(table)))
+            connection.execute('CREATE INDEX IF NOT EXISTS {} ON {} (Type, Subtype)'
+                               .format(_quote('{}_type_subtype'.format(table)), _quote(table)))
+        connection.execute('ANALYZE')
+    finally:
+        connection.close()
+    return count
+
+class EventStore:
+    """Filtered queries against a store written by :meth:`build`.
+
+    Args:
+        dbpath (str): Path to the SQLite database
+    """
+
+    def __init__(self, dbpath):
+        if not isstore(dbpath):
+            raise ValueError('{} is not an SQLite database'.format(dbpath))
+        self.dbpath = dbpath
+        self.connection = connect(dbpath)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def tables(self):
+        """Returns the names of the tables in the store."""
+        rows = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                       "AND name NOT LIKE 'sqlite_%'")
+        return [row[0] for row in rows]
+
+    def columns(self, table=SENSORDATA_TABLE):
+        """Returns the columns of a table."""
+        return [row[1] for row in self.connection.execute('PRAGMA table_info({})'.format(_quote(table)))]
+
+    def query(self, sql, params=()):
+        """Run any SQL query and return the result as a *DataFrame*."""
+        return pd.read_sql_query(sql, self.connection, params=params)
+
+    def events(self, table=SENSORDATA_TABLE, columns=None, users=None, assignments=None, types=None,
+               subtypes=None, start=None, end=None, where=None, params=()):
+        """Select events matching all of the given filters, in the order they were loaded.
+
+        Args:
+            table (str): Table to read from
+            columns (list, optional): Columns to return. Defaults to all.
+            users (list, optional): Values of `userName` to keep
+            assignments (list, optional): Values of `assignment` to keep
+            types (list, optional): Values of `Type` to keep
+            subtypes (list, optional): Values of `Subtype` to keep
+            start (float, optional): Keep events at or after this time (same units as `time`)
+            end (float, optional): Keep events before this time
+            where (str, optional): Any further SQL condition
+            params (tuple, optional): Parameters for placeholders in `where`
+
+        Returns:
+            A *DataFrame* of events.
+        """
+        conditions, values = [], []
+        for col, allowed in (('userName', users), ('assignment', assignments), ('Type', types),
+                             ('Subtype', subtypes)):
+            if allowed is not None:
+                allowed = list(allowed)
+                conditions.append('{} IN ({})'.format(_quote(col), ', '.join('?' * len(allowed))))
+                values.extend(allowed)
+        if start is not None:
+            conditions.append('time >= ?')
+            values.append(start)
+        if end is not None:
+            conditions.append('time < ?')
+            values.append(end)
+        if where:
+            conditions.append('({})'.format(where))
+            values.extend(params)
+
+        sql = 'SELECT {} FROM {}{} ORDER BY rowid'.format(
+            '*' if columns is None else ', '.join(_quote(col) for col in columns),
+            _quote(table),
+            ' WHERE ' + ' AND '.join(conditions) if conditions else '')
+        return self.query(sql, params=values)
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('sqlstore').parse_args(args)
+
+    build(args.infile, args.database, table=args.table, chunksize=args.chunksize)
+
+if __name__ == '__main__':
+    instrument.log_to_stderr()
+    main(sys.argv[1:])
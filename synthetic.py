@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Generates synthetic, but realistic, DevEventTracker data for testing
+and benchmarking.
+
+Everything is driven by a seeded random number generator, so the same arguments
+always produce the same files. Data is produced in batches of student-projects,
+so output can scale from a few thousand events to hundreds of millions without
+holding the whole dataset in memory.
+
+The following files are written to the output directory:
+
+* `sensordata.csv`: Events in the sensordata CSV format (see :attr:`utils.DEFAULT_FIELDNAMES`)
+* `raw.log`: The same events as newline separated URLs, as posted by the Eclipse plugin
+* `debugger-use.csv`: Debug events, in the format expected by :meth:`debugging.getdebugsessions`
+* `uuids.csv`: studentProjectUuids for each student-project (see :meth:`utils.maptouuids`)
+* `submissions.csv`: Web-CAT submissions (see :meth:`load_datasets.load_submission_data`)
+* `due_times.json`: Due dates for each assignment, in the format of `due_times.json`
+
+To use:
+    `import synthetic`, or
+    ./synthetic.py <output directory> <number of events> [--seed SEED] on the command line
+"""
+import os
+import sys
+import json
+import datetime
+from urllib import parse
+
+import numpy as np
+import pandas as pd
+
+import cli
+
+#: Relative frequencies of each event Type
+EVENT_TYPES = {
+    'Edit': 0.80,
+    'Launch': 0.07,
+    'Termination': 0.07,
+    'Debug': 0.06
+}
+
+#: Class names that students write. Names ending in *Test* are test classes.
+CLASS_NAMES = ['Project', 'Node', 'LinkedList', 'Parser', 'Record', 'ProjectTest',
+               'LinkedListTest', 'ParserTest']
+
+DEBUG_SUBTYPES = ['Start', 'Breakpoint', 'Step over', 'Step into', 'Terminate']
+
+SENSORDATA_COLUMNS = ['userId', 'projectId', 'email', 'CASSIGNMENTNAME', 'userUuid',
+                      'studentProjectUuid', 'time', 'Class-Name', 'Unit-Type', 'Unit-Name',
+                      'Type', 'Subtype', 'Subsubtype', 'onTestCase', 'Current-Statements',
+                      'Current-Methods', 'Current-Size', 'Current-Test-Assertions', 'Set']
+
+_DAY = 24 * 3600 * 1000
+
+def term_start(term):
+    """Returns a (naive, local) datetime for the first day of classes in the given
+    term id, e.g., `fall2018` or `spring2016`.
+    """
+    season = term.rstrip('0123456789')
+    year = int(term[len(season):])
+    if season == 'fall':
+        return datetime.datetime(year, 8, 27)
+    if season == 'spring':
+        return datetime.datetime(year, 1, 20)
+
+    raise ValueError('Unsupported term {}. Use fall or spring terms.'.format(term))
+
+def due_times(term, assignments=4):
+    """Generate due date data for a term, in the format of `due_times.json`.
+
+    Assignments are due every 3.5 weeks, at 11pm, with milestones due 10, 7, and 4
+    days before the due date, and an early bonus deadline the day before.
+
+    Returns:
+        A *dict* like `{term: {'assignment1': {'dueTime': ..., 'milestone1': ...}}}`
+    """
+    start = term_start(term)
+    entries = {}
+    for i in range(1, assignments + 1):
+        due = start + datetime.timedelta(days=int(24.5 * i), hours=23)
+        due = int(due.timestamp() * 1000)
+        entries['assignment{}'.format(i)] = {
+            'milestone1': due - 10 * _DAY,
+            'milestone2': due - 7 * _DAY,
+            'milestone3': due - 4 * _DAY,
+            'earlyBonus': due - _DAY,
+            'dueTime': due
+        }
+
+    return {term: entries}
+
+def _uuid(rng, n):
+    """Random (but seeded) hex identifiers shaped like UUIDs."""
+    raw = rng.randint(0, 2**32, size=(n, 4), dtype=np.uint64)
+    return ['{:08x}-{:04x}-{:04x}-{:04x}-{:04x}{:08x}'.format(
+        int(a), int(b) >> 16, int(b) & 0xffff, int(c) >> 16, int(c) & 0xffff, int(d))
+        for a, b, c, d in raw]
+
+def _projects(rng, events, students, assignments, due_data):
+    """Lay out student-projects and decide how many events each one gets.
+
+    Event counts are heavy-tailed, so a handful of students produce many more
+    events than the rest, as in real data.
+    """
+    n = students * assignments
+    weights = rng.gamma(shape=1.5, scale=1.0, size=n)
+    counts = rng.multinomial(events, weights / weights.sum())
+
+    users = ['student{:05d}'.format(s) for s in range(students)]
+    projects = pd.DataFrame({
+        'userName': np.repeat(users, assignments),
+        'assignmentNumber': np.tile(np.arange(1, assignments + 1), students),
+        'events': counts
+    })
+    projects['assignment'] = 'Project ' + projects['assignmentNumber'].astype(str)
+    projects['dueTime'] = [due_data['assignment{}'.format(a)]['dueTime']
+                           for a in projects['assignmentNumber']]
+    useruuids = dict(zip(users, _uuid(rng, students)))
+    projects['userUuid'] = projects['userName'].map(useruuids)
+    projects['studentProjectUuid'] = _uuid(rng, n)
+    projects['projectId'] = _uuid(rng, n)
+    projects['crn'] = np.where(rng.rand(n) < 0.5, '83521', '83522')
+
+    return projects
+
+def _events(rng, projects):
+    """Generate the event stream for a batch of student-projects."""
+    counts = projects['events'].values
+    n = counts.sum()
+    proj = np.repeat(np.arange(len(projects)), counts)
+    starts = np.cumsum(counts) - counts # index of the first event of each project
+
+    # bursty timing: short gaps inside work sessions, long gaps between them
+    gaps = np.where(rng.rand(n) < 1 / 150,
+                    rng.exponential(10 * 3600 * 1000, size=n),
+                    rng.exponential(40 * 1000, size=n))
+    gaps[starts[counts > 0]] = 0
+    elapsed = np.cumsum(gaps)
+    elapsed -= elapsed[np.repeat(starts, counts)]
+    offsets = rng.gamma(shape=2.0, scale=3.5, size=len(projects)) * _DAY
+    first = projects['dueTime'].values - offsets
+    time = (np.repeat(first, counts) + elapsed).astype(np.int64)
+
+    types = rng.choice(list(EVENT_TYPES), size=n, p=list(EVENT_TYPES.values()))
+    df = pd.DataFrame({
+        'userId': np.repeat(projects['userName'].values, counts),
+        'projectId': np.repeat(projects['projectId'].values, counts),
+        'email': np.repeat((projects['userName'] + '@vt.edu').values, counts),
+        'CASSIGNMENTNAME': np.repeat(projects['assignment'].values, counts),
+        'userUuid': np.repeat(projects['userUuid'].values, counts),
+        'studentProjectUuid': np.repeat(projects['studentProjectUuid'].values, counts),
+        'time': time,
+        'Type': types
+    })
+    for col in SENSORDATA_COLUMNS:
+        if col not in df.columns:
+            df[col] = ''
+
+    # edits: a random walk of sizes for each class in each project
+    edits = (types == 'Edit').nonzero()[0]
+    classes = rng.randint(len(CLASS_NAMES), size=len(edits))
+    increments = np.round(rng.normal(loc=12, scale=40, size=len(edits))).astype(np.int64)
+    sizes = pd.Series(increments).groupby([proj[edits], classes]).cumsum().clip(lower=0).values
+    classnames = np.array(CLASS_NAMES)[classes]
+    ontest = np.char.endswith(classnames, 'Test')
+    df.loc[edits, 'Class-Name'] = classnames
+    df.loc[edits, 'Unit-Type'] = 'File'
+    df.loc[edits, 'onTestCase'] = ontest.astype(int)
+    df.loc[edits, 'Current-Size'] = sizes
+    df.loc[edits, 'Current-Statements'] = sizes // 30
+    df.loc[edits, 'Current-Methods'] = sizes // 200
+    df.loc[edits[ontest], 'Current-Test-Assertions'] = sizes[ontest] // 150
+
+    # launches and terminations
+    for typ in ('Launch', 'Termination'):
+        idx = (types == typ).nonzero()[0]
+        df.loc[idx, 'Subtype'] = np.where(rng.rand(len(idx)) < 0.6, 'Test', 'Normal')
+    tests = ((types == 'Termination') & (df['Subtype'].values == 'Test')).nonzero()[0]
+    ntests = rng.randint(1, 6, size=len(tests))
+    failing = rng.rand(len(tests)) < 0.4
+    df.loc[tests, 'Unit-Name'] = ['|' + '|'.join('test{}'.format(i) for i in range(k)) + '|'
+                                  for k in ntests]
+    df.loc[tests, 'Subsubtype'] = ['|' + '|'.join(['Failure' if f and i == 0 else 'Success'
+                                                   for i in range(k)]) + '|'
+                                   for k, f in zip(ntests, failing)]
+
+    # debugger events
+    debug = (types == 'Debug').nonzero()[0]
+    df.loc[debug, 'Subtype'] = rng.choice(DEBUG_SUBTYPES, size=len(debug),
+                                          p=[0.15, 0.3, 0.25, 0.15, 0.15])
+    df.loc[debug, 'Set'] = np.where(rng.rand(len(debug)) < 0.3, 'set', '')
+
+    return df[SENSORDATA_COLUMNS]
+
+def _submissions(rng, projects, lasttimes):
+    """Generate Web-CAT submissions for each student-project, ending shortly
+    after the student's last event."""
+    nsubs = rng.randint(1, 8, size=len(projects))
+    rows = projects.loc[projects.index.repeat(nsubs)].reset_index(drop=True)
+    last = np.repeat(lasttimes, nsubs)
+    number = np.concatenate([np.arange(1, k + 1) for k in nsubs])
+    remaining = np.repeat(nsubs, nsubs) - number
+    maxscore = 50
+    correctness = np.minimum(maxscore, rng.binomial(maxscore, 0.6, size=len(rows)) + 3 * number)
+    elements = rng.randint(150, 400, size=len(rows))
+
+    return pd.DataFrame({
+        'userName': rows['userName'],
+        'assignment': rows['assignment'],
+        'submissionNo': number,
+        'score.correctness': correctness,
+        'max.score.correctness': maxscore,
+        'elements': elements,
+        'elementsCovered': (elements * rng.uniform(0.7, 1.0, size=len(rows))).astype(int),
+        'submissionTimeRaw': (last + rng.randint(0, 2 * 3600 * 1000, size=len(rows)) -
+                              remaining * 3600 * 1000).astype(np.int64),
+        'dueDateRaw': rows['dueTime']
+    })
+
+def _urls(df):
+    """Convert events to URLs as posted by DevEventTracker. Some fields are sent as
+    name/value pairs, as the plugin does."""
+    direct = ['email', 'CASSIGNMENTNAME', 'userUuid', 'studentProjectUuid', 'time', 'Type',
+              'Subtype', 'Subsubtype', 'Unit-Type', 'Unit-Name', 'Set']
+    paired = ['Class-Name', 'Current-Statements', 'Current-Methods', 'Current-Size',
+              'Current-Test-Assertions']
+    lines = []
+    for row in df.itertuples(index=False):
+        row = dict(zip(df.columns, row))
+        params = [(k, row[k]) for k in direct if row[k] != '']
+        pairs = [(k, row[k]) for k in paired if row[k] != '']
+        for i, (k, v) in enumerate(pairs):
+            params.append(('name{}'.format(i), k))
+            params.append(('value{}'.format(i), v))
+        lines.append('http://localhost/DevEventTracker/addEvent?{}\n'.format(parse.urlencode(params)))
+
+    return lines
+
+def generate(outdir, events=1000, students=None, assignments=4, term='fall2018', seed=0,
+             batchsize=1000000, rawlog=True):
+    """Generate a complete synthetic dataset.
+
+    Args:
+        outdir (str): Directory to write files to. Created if it does not exist.
+        events (int): Total number of events to generate
+        students (int, optional): Number of students. Defaults to one student per
+                                  ~1500 events per assignment.
+        assignments (int): Number of assignments in the term
+        term (str): Term id, e.g., `fall2018`
+        seed (int): Seed for the random number generator
+        batchsize (int): Approximate number of events generated and written at a time
+        rawlog (bool): Also write `raw.log`? Formatting URLs is the slowest part of
+                       generation, so you may want to skip it for very large datasets.
+
+    Returns:
+        A *dict* mapping each kind of file (`sensordata`, `raw`, `debugger`, `uuids`,
+        `submissions`, `due_times`) to its path.
+    """
+    rng = np.random.RandomState(seed)
+    if not students:
+        students = max(1, int(np.ceil(events / (assignments * 1500))))
+    os.makedirs(outdir, exist_ok=True)
+    paths = {
+        'sensordata': os.path.join(outdir, 'sensordata.csv'),
+        'raw': os.path.join(outdir, 'raw.log'),
+        'debugger': os.path.join(outdir, 'debugger-use.csv'),
+        'uuids': os.path.join(outdir, 'uuids.csv'),
+        'submissions': os.path.join(outdir, 'submissions.csv'),
+        'due_times': os.path.join(outdir, 'due_times.json')
+    }
+
+    due_data = due_times(term, assignments)
+    with open(paths['due_times'], 'w') as outfile:
+        json.dump(due_data, outfile, indent=2)
+
+    projects = _projects(rng, events, students, assignments, due_data[term])
+    uuids = projects.rename(columns={'assignment': 'CASSIGNMENTNAME'})
+    uuids['email'] = uuids['userName'] + '@vt.edu'
+    uuids[['userUuid', 'studentProjectUuid', 'CASSIGNMENTNAME', 'email', 'crn']] \
+        .to_csv(paths['uuids'], index=False)
+
+    batches = np.cumsum(projects['events'].values) // batchsize
+    first = True
+    if not rawlog:
+        del paths['raw']
+    with open(paths.get('raw', os.devnull), 'w') as rawfile:
+        for _, batch in projects.groupby(batches, sort=True):
+            df = _events(rng, batch)
+            mode = 'w' if first else 'a'
+            df.to_csv(paths['sensordata'], mode=mode, header=first, index=False)
+            if rawlog:
+                rawfile.writelines(_urls(df))
+
+            debug = df[df['Type'] == 'Debug']
+            pd.DataFrame({
+                'userName': debug['userId'],
+                'assignment': debug['CASSIGNMENTNAME'],
+                'time': debug['time'] / 1000,
+                'Line': np.where(debug['Subtype'] == 'Breakpoint', '42', ''),
+                'Set': debug['Set'],
+                'Type': debug['Type'],
+                'Subtype': debug['Subtype']
+            }).to_csv(paths['debugger'], mode=mode, header=first, index=False)
+
+            lasttimes = df.groupby('studentProjectUuid', sort=False)['time'].max() \
+                          .reindex(batch['studentProjectUuid']).values
+            lasttimes = np.where(np.isnan(lasttimes), batch['dueTime'].values, lasttimes)
+            _submissions(rng, batch.reset_index(drop=True), lasttimes) \
+                .to_csv(paths['submissions'], mode=mode, header=first, index=False)
+            first = False
+
+    return paths
+
+def main(args):
+    """Parses CLI arguments and begins execution."""
+    args = cli.commandparser('synthetic').parse_args(args)
+
+    paths = generate(args.outdir, events=args.events, students=args.students,
+                     assignments=args.assignments, term=args.term, seed=args.seed,
+                     rawlog=args.rawlog)
+    for kind, path in paths.items():
+        print('{}: {}'.format(kind, path))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
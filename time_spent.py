@@ -1,18 +1,32 @@
 #! /usr/bin/env python3
+"""
+Calculates the time each student spent on each project, from work sessions
+(get_time_spent) or directly from their events (usertimespent).
+
+Work sessions are delimited by gaps between events, so sessions computed from
+sensordata compacted by compaction.compact (which keeps only the last of each
+run of edits) can be split where the original events were not, and give less
+time spent. Compute sessions and time spent from the original events.
+"""
 
 import csv
 import sys
 import datetime
 
+import pandas as pd
+
+import sessions
+import instrument
+
 def get_time_spent(infile, outfile, deadline = None):
     """
     Takes in worksession data from the infile and gives back
     the time spent on a project for a student.
     """
-    print('Getting time spent on project...')
     fieldnames = ['userId', 'email', 'projectId', 'assignment', 'hoursOnProject', 'projectStartTime']
 
-    with open(infile, 'r') as fin, open(outfile, 'w') as fout:
+    with open(infile, 'r') as fin, open(outfile, 'w') as fout, \
+            instrument.stage('time_spent.get_time_spent') as stage:
         reader = csv.DictReader(fin, delimiter=',')
         writer = csv.DictWriter(fout, delimiter=',', fieldnames=fieldnames)
 
@@ -23,7 +37,9 @@ def get_time_spent(infile, outfile, deadline = None):
         time_spent = 0
         project_start_time = None
 
+        stage.rows_in = stage.rows_out = 0
         for row in reader:
+            stage.rows_in += 1
             if deadline:
                 current = datetime.date.fromtimestamp(int(float(row['start_time'])) / 1000)
                 due_date = datetime.date.fromtimestamp(int(float(deadline)) / 1000)
@@ -45,6 +61,7 @@ def get_time_spent(infile, outfile, deadline = None):
                 writer.writerow({'userId': prev_row['userId'], 'email': prev_row['email'],
                     'projectId': prev_row['projectId'], 'assignment': prev_row['CASSIGNMENTNAME'],
                     'hoursOnProject': time_spent, 'projectStartTime': project_start_time})
+                stage.rows_out += 1
                 end_time = datetime.datetime.fromtimestamp(int(float(row['end_time'])) / 1000)
                 start_time = datetime.datetime.fromtimestamp(int(float(row['start_time'])) / 1000)
                 project_start_time = int(float(row['start_time']))
@@ -59,6 +76,37 @@ def get_time_spent(infile, outfile, deadline = None):
             'hoursOnProject': time_spent,
             'projectStartTime': project_start_time
         })
+        stage.rows_out += 1
+
+def usertimespent(usergroup, threshold=1):
+    """Gets the time spent by a student on a single project, directly from their
+    event stream rather than from already computed worksessions. Work sessions
+    are delimited by `threshold` hours of inactivity (see
+    :meth:`sessions.assign_worksessions`).
+
+    Args:
+        usergroup (pd.DataFrame): Events for a student on a single project, with `time`
+                                  parsed as datetimes. Not compacted (see :mod:`compaction`).
+        threshold (float): Hours of inactivity that end a work session
+
+    Returns:
+        A *Series* containing `hoursOnProject`, `projectStartTime` (a millisecond
+        timestamp) and `workSessionCount`.
+    """
+    events = pd.DataFrame({
+        'time': usergroup['time'].sort_values().astype('int64').values // 10**6
+    })
+    events = sessions.assign_worksessions(events, threshold=threshold)
+    spans = events.groupby('workSessionId')['time'].agg(['min', 'max'])
+    # the times are naive local datetimes, so the start is converted back to an
+    # epoch timestamp as local time (as datetime.datetime.timestamp does)
+    start = usergroup['time'].min().to_pydatetime()
+
+    return pd.Series({
+        'hoursOnProject': (spans['max'] - spans['min']).sum() / (3600 * 1000),
+        'projectStartTime': int(start.timestamp() * 1000),
+        'workSessionCount': len(spans)
+    })
 
 def main(args):
     infile = args[0]
@@ -73,4 +121,5 @@ if __name__ == '__main__':
         print('Takes in worksession data from the infile and gives back the time spent on a project for a student.')
         print('Usage:\n\t./time_spent.py <input_file> <output_file>')
         sys.exit()
+    instrument.log_to_stderr()
     main(sys.argv[1:])
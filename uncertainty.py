@@ -0,0 +1,179 @@
+"""Bootstrap confidence intervals for each student's Early/Often measures.
+
+An Early/Often index is a mean of days until the deadline over a student's
+edits (weighted by edit size) or launches, and a student with a handful of large
+edits has a much less certain index than one with hundreds. :meth:`intervals`
+resamples each student's records (as collected by
+:meth:`early_often.userrecords`) with replacement and recomputes the weighted
+means, giving a percentile confidence interval for each index as `<index>_ci_low`
+and `<index>_ci_high` columns.
+
+Rather than rerunning :meth:`early_often.userearlyoften` once per replicate, all
+replicates for a student are drawn as one matrix of record indices (in batches,
+to bound memory), and the weighted means of every replicate are computed with a
+few array operations. The records are the ones the indices were computed from,
+so events are only read once, and student-projects' records (not their events)
+are spread over a process pool. On
+compacted sensordata (see :mod:`compaction`), each merged run of edits is
+resampled as one record.
+
+.. code-block:: python
+
+   results = early_often.earlyoften('all.csv', 'submissions.csv', 'due_times.json',
+                                    replicates=1000)
+   results[['byteEarlyOftenIndex', 'byteEarlyOftenIndex_ci_low', 'byteEarlyOftenIndex_ci_high']]
+
+Results written this way keep their intervals when read back with
+:meth:`load_datasets.load_raw_inc_data`.
+
+To use:
+    `import uncertainty`
+"""
+import os
+import hashlib
+import functools
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+import instrument
+
+#: Measures given intervals, and the records (see :meth:`early_often.userrecords`) they are means of
+MEASURES = {
+    'byteEarlyOftenIndex': 'edits_bytes',
+    'stmtEarlyOftenIndex': 'edits_stmts',
+    'solutionByteEarlyOftenIndex': 'solution_bytes',
+    'solutionStmtEarlyOftenIndex': 'solution_stmts',
+    'solutionMethodsEarlyOftenIndex': 'solution_methods',
+    'testByteEarlyOftenIndex': 'test_bytes',
+    'testStmtsEarlyOftenIndex': 'test_stmts',
+    'testMethodsEarlyOftenIndex': 'test_methods',
+    'assertionsEarlyOftenIndex': 'test_assertions',
+    'launchEarlyOften': 'launches',
+    'testLaunchEarlyOften': 'test_launches',
+    'normalLaunchEarlyOften': 'normal_launches',
+    'debugSessionEarlyOften': 'debug_sessions'
+}
+
+#: Largest number of (replicate, record) cells drawn at once
+BATCH_CELLS = 2**22
+
+def replicatemeans(days, weights=None, replicates=1000, rng=None):
+    """Weighted means of resampled records, for every replicate at once.
+
+    Args:
+        days (array): Days until the deadline of each record, with a column for each
+                      deadline (or a single column)
+        weights (array, optional): Weight (edit size) of each record. Defaults to 1.
+        replicates (int): Number of bootstrap replicates
+        rng (Generator, optional): Random number generator
+
+    Returns:
+        An array with a row for each replicate and a column for each deadline (*NaN*
+        if there are no records).
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    days = np.asarray(days, dtype=float)
+    days = days[:, None] if days.ndim == 1 else days
+    weights = np.ones(len(days)) if weights is None else np.asarray(weights, dtype=float)
+    if not len(days):
+        return np.full((replicates, days.shape[1]), np.nan)
+
+    means = []
+    batch = max(1, BATCH_CELLS // len(days))
+    for start in range(0, replicates, batch):
+        # each row of the index matrix is one resample of the records
+        index = rng.integers(0, len(days), size=(min(batch, replicates - start), len(days)))
+        resampled = weights[index]
+        totals = resampled.sum(axis=1)
+        means.append(np.stack([(resampled * days[index, k]).sum(axis=1) / totals
+                               for k in range(days.shape[1])], axis=1))
+    return np.concatenate(means)
+
+def userintervals(sizes, days, deadlines=None, replicates=1000, confidence=0.95, rng=None):
+    """Confidence intervals for one student-project's measures.
+
+    Args:
+        sizes (dict): Edit sizes, as returned by :meth:`early_often.userrecords`
+        days (dict): Days until each deadline, as returned by :meth:`early_often.userrecords`
+        deadlines (list, optional): The deadlines the records were collected for.
+                                    Defaults to `['dueTime']`.
+        replicates (int): Number of bootstrap replicates
+        confidence (float): Confidence level of the intervals
+        rng (Generator, optional): Random number generator
+
+    Returns:
+        A *Series* with `<measure>_ci_low` and `<measure>_ci_high` for each of
+        :attr:`MEASURES`, prefixed as in :meth:`early_often.userearlyoften` for
+        deadlines other than `dueTime`.
+    """
+    deadlines = deadlines or ['dueTime']
+    bounds = [(1 - confidence) / 2, (1 + confidence) / 2]
+    rng = rng if rng is not None else np.random.default_rng()
+
+    to_write = {}
+    for name, records in MEASURES.items():
+        means = replicatemeans(days[records], sizes.get(records), replicates=replicates, rng=rng)
+        for k, deadline in enumerate(deadlines):
+            prefix = '' if deadline == 'dueTime' else deadline + '_'
+            if np.isnan(means[:, k]).all():
+                low, high = np.nan, np.nan
+            else:
+                low, high = np.nanquantile(means[:, k], bounds)
+            to_write[prefix + name + '_ci_low'] = low
+            to_write[prefix + name + '_ci_high'] = high
+    return pd.Series(to_write)
+
+def _seed(seed, key):
+    """A seed for one student-project, so that its intervals don't depend on which
+    process computes them, or in what order."""
+    return [seed, int(hashlib.md5(repr(key).encode('utf-8')).hexdigest()[:8], 16)]
+
+def _keyintervals(task, deadlines, replicates, confidence, seed):
+    key, records = task
+    if records is None:
+        return key, None
+    rng = np.random.default_rng(_seed(seed, key))
+    return key, userintervals(*records, deadlines=deadlines, replicates=replicates,
+                              confidence=confidence, rng=rng)
+
+@instrument.instrumented('uncertainty.intervals')
+def intervals(records, deadlines=None, replicates=1000, confidence=0.95, seed=0, processes=None,
+              names=None):
+    """Bootstrap confidence intervals for every student-project.
+
+    Args:
+        records (dict): Maps each (user, assignment) to its records, as returned by
+                        :meth:`early_often.userrecords`, e.g. as kept by
+                        :meth:`early_often.earlyoften` while computing the indices
+        deadlines (list, optional): Keys in the due dates the records were collected for
+        replicates (int): Number of bootstrap replicates
+        confidence (float): Confidence level of the intervals
+        seed (int): Seed for the random number generators, so that runs are repeatable
+        processes (int, optional): Number of worker processes. Defaults to the number of
+                                   CPUs; 1 computes everything in this process.
+        names (list, optional): Names of the user and assignment index levels
+
+    Returns:
+        A *DataFrame* indexed by (user, assignment), with the columns described in
+        :meth:`userintervals`. Student-projects with no records (*None*, for no final
+        submission) are left out.
+    """
+    if not 0 < confidence < 1:
+        raise ValueError('confidence must be in (0, 1). Got {}.'.format(confidence))
+    work = functools.partial(_keyintervals, deadlines=deadlines, replicates=replicates,
+                             confidence=confidence, seed=seed)
+    tasks = list(records.items())
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        computed = [work(task) for task in tasks]
+    else:
+        # only the records are sent to the workers, not the events
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            computed = pool.map(work, tasks, chunksize=max(1, len(tasks) // (4 * processes)))
+
+    computed = [(key, values) for key, values in computed if values is not None]
+    index = pd.MultiIndex.from_arrays([[key[0] for key, _ in computed], [key[1] for key, _ in computed]],
+                                      names=names)
+    return pd.DataFrame([values for _, values in computed], index=index)
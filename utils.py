@@ -13,14 +13,17 @@ from urllib import parse
 
 import numpy as np
 import pandas as pd
+from dateutil import tz
 
-logging.basicConfig(filename='sensordata-utils.log', filemode='w', level=logging.WARN)
+import instrument
+
+logger = logging.getLogger('sensordata.utils')
 
 def get_term(timestamp: float) -> str:
     """Returns a term id based on a timestamp in seconds. If the provided
     timestamp is in milliseconds this method will truncate the timestamp to seconds.
     """
-    inmillis = len(str(abs(timestamp))) >= 13
+    inmillis = len(str(int(abs(timestamp)))) >= 13
     if inmillis:
         timestamp = int(timestamp / 1000)
     eventtime = datetime.datetime.fromtimestamp(timestamp)
@@ -62,6 +65,75 @@ DEFAULT_FIELDNAMES = [
     'ConsoleOutput'
 ]
 
+def group_columns(columns):
+    """Returns the names of the user and assignment columns present in a set of
+    sensordata columns, as a tuple `(usercol, assignmentcol)`.
+
+    Users are identified by `userId`, `email`, or `userName` (in that order of
+    preference), and assignments by `cleaned_assignment`, `CASSIGNMENTNAME`, or
+    `assignment`.
+    """
+    if 'userId' in columns:
+        usercol = 'userId'
+    elif 'email' in columns:
+        usercol = 'email'
+    else:
+        usercol = 'userName'
+
+    assignmentcol = 'assignment'
+    if 'cleaned_assignment' in columns:
+        assignmentcol = 'cleaned_assignment'
+    elif 'CASSIGNMENTNAME' in columns:
+        assignmentcol = 'CASSIGNMENTNAME'
+
+    return usercol, assignmentcol
+
+def is_sorted(df, by):
+    """Returns *True* if the rows of `df` are already in ascending order of the
+    columns `by` (compared lexicographically, as `sort_values(by=by)` would order
+    them), using a single vectorised pass over adjacent rows.
+
+    Columns with missing values are reported as unsorted, since their ordering
+    relative to other values cannot be checked this way.
+    """
+    if len(df) < 2:
+        return True
+    if len(by) == 1:
+        column = df[by[0]]
+        return not column.isnull().any() and column.is_monotonic_increasing
+
+    undecided = np.ones(len(df) - 1, dtype=bool) # adjacent pairs equal on every key so far
+    for col in by:
+        column = df[col]
+        if column.isnull().any():
+            return False
+        values = column.values
+        prev, curr = values[:-1], values[1:]
+        if (undecided & (curr < prev)).any():
+            return False
+        undecided &= (curr == prev)
+        if not undecided.any():
+            break
+    return True
+
+def ensure_sorted(df, by):
+    """Returns `df` in ascending order of the columns `by`. If it is already in that
+    order (see :meth:`is_sorted`) it is returned as is; otherwise it is sorted with a
+    single stable multi-key sort, so rows that tie on every key keep their order.
+
+    Data sorted this way can be grouped by a prefix of `by` with `sort=False`,
+    avoiding a second sort inside `groupby`.
+    """
+    if is_sorted(df, by):
+        return df
+    return df.sort_values(by=by, kind='mergesort')
+
+def local_times(millis):
+    """Parse millisecond timestamps to naive local datetimes, as `earlyoften` does
+    (with :meth:`datetime.datetime.fromtimestamp`), without a Python call per row."""
+    return pd.to_datetime(millis, unit='ms').dt.tz_localize('UTC') \
+             .dt.tz_convert(tz.tzlocal()).dt.tz_localize(None)
+
 def raw_to_csv(inpath: str, outpath: str, fieldnames=None) -> None:
     """
     Given a file of newline separated URLs, writes the URL query params as
@@ -71,20 +143,25 @@ def raw_to_csv(inpath: str, outpath: str, fieldnames=None) -> None:
     the :attr:`DEFAULT_FIELDNAMES`. These fieldnames can be imported  and 
     modified as needed.
     """
-    with open(inpath, 'r') as infile, open(outpath, 'w') as outfile:
+    with open(inpath, 'r') as infile, open(outpath, 'w') as outfile, \
+            instrument.stage('utils.raw_to_csv') as stage:
         if not fieldnames:
             fieldnames = DEFAULT_FIELDNAMES
         writer = csv.DictWriter(outfile, delimiter=',', fieldnames=fieldnames)
         writer.writeheader()
 
+        stage.rows_in = stage.rows_out = 0
         for line in infile:
+            stage.rows_in += 1
             event = processline(line, fieldnames)
             if event is not None:
                 if isinstance(event, list):
                     for item in event:
                         writer.writerow(item)
+                    stage.rows_out += len(event)
                 else:
                     writer.writerow(event)
+                    stage.rows_out += 1
 
 def processline(url, fieldnames=None, filtertype=None):
     """
@@ -125,6 +202,7 @@ def processline(url, fieldnames=None, filtertype=None):
 
     return kvpairs
 
+@instrument.instrumented('utils.split_termination_events')
 def split_termination_events(df):
     """Typically, Termination events contain results of several test methods being run at 
     once. This method takes a DataFrame containing such Termination events and returns it
@@ -156,14 +234,17 @@ def __split_one_termination(t):
         except AttributeError:
             return [t]
     except KeyError:
-        logging.error('Missing some required keys to split termination event. Need \
+        logger.error('Missing some required keys to split termination event. Need \
             Type, Subtype, and Subsubtype. Doing nothing.')
         return [t] 
 
     return expandedevents
 
 def test_outcomes(te):
-    """Parse outcomes for the specified test termination."""
+    """Parse outcomes for the specified test termination.
+
+    See :meth:`test_outcome_counts` for whole frames of terminations at once.
+    """
     outcomes = te['Subsubtype'].strip('|').split('|')
     failures = outcomes.count('Failure')
     successes = outcomes.count('Success')
@@ -175,6 +256,56 @@ def test_outcomes(te):
         'errors': errors
     })
 
+def test_outcome_counts(terminations):
+    """Parse outcomes for many test terminations at once, without a row-wise apply.
+    Counts are the same as :meth:`test_outcomes` gives for each row.
+
+    Args:
+        terminations (DataFrame): Test termination events, with `Subsubtype` in the
+                                  form `|Success|Failure|...|`
+
+    Returns:
+        A *DataFrame* with the same index as `terminations`, and columns `successes`,
+        `failures` and `errors`.
+    """
+    outcomes = terminations['Subsubtype'].fillna('').astype(str).str.strip('|').str.split('|')
+    tokens = outcomes.explode()
+    positions = np.repeat(np.arange(len(outcomes)), outcomes.str.len().values)
+    tokens = tokens.values
+    counts = pd.DataFrame({
+        'successes': np.bincount(positions, weights=tokens == 'Success', minlength=len(outcomes)),
+        'failures': np.bincount(positions, weights=tokens == 'Failure', minlength=len(outcomes)),
+        'total': np.bincount(positions, minlength=len(outcomes))
+    }, index=terminations.index).astype(np.int64)
+    counts['errors'] = counts.pop('total') - counts['successes'] - counts['failures']
+    return counts
+
+def test_outcome_table(events, by=None):
+    """Summarise test outcomes for each group of events (by default, each subsession
+    of each student-project), parsing every test termination in one pass.
+
+    Args:
+        events (DataFrame): Events, of which only test terminations (`Type=Termination`,
+                            `Subtype=Test`) are used
+        by (list, optional): Columns to group by. Defaults to the user and assignment
+                             columns (see :meth:`group_columns`) and `subsession` (see
+                             :meth:`sessions.assign_subsessions`), if present.
+
+    Returns:
+        A *DataFrame* indexed by `by`, with the total `successes`, `failures` and
+        `errors`, the number of test `terminations`, and the number of those in which
+        every test `passed`.
+    """
+    if by is None:
+        by = list(group_columns(events.columns))
+        if 'subsession' in events.columns:
+            by.append('subsession')
+    tests = events[(events['Type'] == 'Termination') & (events['Subtype'] == 'Test')]
+    counts = test_outcome_counts(tests)
+    counts['terminations'] = 1
+    counts['passed'] = ((counts['failures'] + counts['errors']) == 0).astype(np.int64)
+    return counts.groupby([tests[col] for col in by]).sum()
+
 def _shouldwritekey(key, fieldnames):
     if not fieldnames:
         return True
@@ -184,6 +315,7 @@ def _shouldwritekey(key, fieldnames):
 
     return False
 
+@instrument.instrumented('utils.maptouuids')
 def maptouuids(sensordata=None, sdpath=None, uuids=None, uuidpath=None, crnfilter=None,
                crncol='crn', usercol='email', assignmentcol='CASSIGNMENTNAME', due_dates=None):
     """Map sensordata to users and assignments based on studentProjectUuids.
@@ -217,7 +349,9 @@ def maptouuids(sensordata=None, sdpath=None, uuids=None, uuidpath=None, crnfilte
 
     # read sensordata
     if sensordata is None:
-        sensordata = pd.read_csv(sdpath, low_memory=False)
+        with instrument.stage('utils.maptouuids.read_sensordata') as stage:
+            sensordata = pd.read_csv(sdpath, low_memory=False)
+            stage.rows_out = len(sensordata)
 
     # read uuids
     cols = ['userUuid', 'studentProjectUuid', assignmentcol, usercol]
@@ -225,10 +359,7 @@ def maptouuids(sensordata=None, sdpath=None, uuids=None, uuidpath=None, crnfilte
         cols.append(crncol)
     if uuids is None:
         uuids = pd.read_csv(uuidpath, usecols=cols)
-    uuids = (
-        uuids.rename(columns={usercol: 'userName', assignmentcol: 'assignment'})
-             .sort_values(by=['userName', 'assignment'], ascending=[1, 1])
-    )
+    uuids = uuids.rename(columns={usercol: 'userName', assignmentcol: 'assignment'})
     umap = lambda u: u.split('@')[0] if str(u) != 'nan' and u != '' else u
     uuids['userName'] = uuids['userName'].apply(umap)
 
@@ -269,8 +400,8 @@ def maptouuids(sensordata=None, sdpath=None, uuids=None, uuidpath=None, crnfilte
                 with_conflicts.apply(__assignment_from_timestamp, due_dates=due_dates, axis=1)
         )
     
-    merged = pd.concat([with_conflicts, without_conflicts], ignore_index=True, sort=False) \
-               .sort_values(by=['userName', 'assignment', 'time'])
+    merged = pd.concat([with_conflicts, without_conflicts], ignore_index=True, sort=False)
+    merged = ensure_sorted(merged, ['userName', 'assignment', 'time'])
 
 
     return merged